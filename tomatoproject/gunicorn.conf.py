@@ -0,0 +1,113 @@
+"""
+Gunicorn configuration for SmartCrop AI
+
+    gunicorn tomato_disease.wsgi -c gunicorn.conf.py
+
+With GUNICORN_PRELOAD=True, Django, the inference runtime's Python modules and
+the model file are loaded once in the master and shared copy-on-write by the
+workers. The runtime itself (TensorFlow / TFLite / ONNX Runtime thread pools)
+does not survive fork, so each worker builds it in post_fork and warms up in
+the background; /readyz reports 503 until that worker is ready.
+"""
+import gc
+import os
+import tempfile
+
+# Imported under another name: gunicorn reads every module-level setting name,
+# and "config" is one of them
+from decouple import config as env
+
+workers = env('WEB_CONCURRENCY', default=2, cast=int)
+threads = env('GUNICORN_THREADS', default=1, cast=int)
+timeout = env('GUNICORN_TIMEOUT', default=120, cast=int)
+# Recycle workers periodically; jitter keeps them from restarting together
+max_requests = env('GUNICORN_MAX_REQUESTS', default=1000, cast=int)
+max_requests_jitter = env('GUNICORN_MAX_REQUESTS_JITTER', default=100, cast=int)
+preload_app = env('GUNICORN_PRELOAD', default=False, cast=bool)
+
+# Workers share their metrics through snapshot files so any of them can
+# answer /metrics for all; one directory per master
+if not os.environ.get('METRICS_MULTIPROCESS_DIR'):
+    os.environ['METRICS_MULTIPROCESS_DIR'] = os.path.join(
+        tempfile.gettempdir(), f'tomato-metrics-{os.getpid()}'
+    )
+
+if preload_app:
+    # wsgi.py must not start the model-loading thread in the master -
+    # threads do not survive fork. Workers start it in post_fork instead.
+    os.environ['MODEL_LOAD_ON_STARTUP'] = 'False'
+    # The app is imported right after this file is read, before any server
+    # hook runs; collecting meanwhile would leave freed "holes" in the pages
+    # the workers will share. post_fork turns the collector back on.
+    gc.disable()
+
+
+def on_starting(server):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tomato_disease.settings')
+    from tomato_app import metrics
+
+    metrics.reset_multiprocess_dir()
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+
+    from django.conf import settings
+    from tomato_app.ml_model import predictor
+
+    if predictor.preload_for_fork():
+        server.log.info("Preloaded %s backend in master", settings.INFERENCE_BACKEND)
+        if settings.INFERENCE_BACKEND == 'keras':
+            server.log.info("The keras backend only shares the TensorFlow modules; "
+                            "tflite_int8 and onnx also share the model file")
+    # Move everything allocated so far into the permanent generation so the
+    # workers' cyclic GC never writes to (and so copies) these pages
+    gc.freeze()
+    server.log.info("Froze %d objects before forking workers", gc.get_freeze_count())
+
+
+def post_fork(server, worker):
+    from django.conf import settings
+    from tomato_app import memory, profiling
+
+    if profiling.start_sampling_profiler():
+        server.log.info("Sampling profiler started in worker %s", worker.pid)
+    if settings.MEMORY_TRACEMALLOC:
+        memory.start_tracing()
+    if not preload_app:
+        return
+
+    gc.enable()
+    from tomato_app.ml_model import predictor
+
+    predictor.after_fork()
+    predictor.start_background_load()
+
+
+def post_request(worker, req, environ, resp):
+    # Like max_requests: finish this request, then exit and be replaced
+    from tomato_app import memory
+
+    recycle = memory.recycle_reason()
+    if recycle is not None and worker.alive:
+        reason, message = recycle
+        worker.log.warning("Recycling worker %s: %s", worker.pid, message)
+        memory.note_recycle(reason)
+        worker.alive = False
+
+
+def child_exit(server, worker):
+    # Keep the exited worker's counters in the /metrics totals
+    from tomato_app import metrics
+
+    metrics.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    # Write out predictions still buffered by the write-behind writer
+    from tomato_app import profiling
+    from tomato_app.persistence import flush_predictions
+
+    flush_predictions()
+    profiling.stop_sampling_profiler()
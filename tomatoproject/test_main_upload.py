@@ -1,146 +0,0 @@
-#!/usr/bin/env python3
-"""Test the enhanced main upload page functionality"""
-
-import requests
-import re
-import json
-from PIL import Image
-import io
-
-def test_main_upload():
-    """Test the main upload page with all enhancements"""
-    try:
-        session = requests.Session()
-        
-        print("🚀 Testing Enhanced Main Upload Page")
-        print("=" * 60)
-        
-        # Test 1: Get the main upload page
-        print("\n1️⃣  Testing main upload page load...")
-        response = session.get('http://localhost:8000/upload/')
-        
-        if response.status_code != 200:
-            print(f"❌ Failed to load main upload page: {response.status_code}")
-            return
-            
-        print("✅ Main upload page loaded successfully")
-        
-        # Check for key elements
-        if 'imageInput' in response.text:
-            print("✅ File input element found")
-        if 'uploadArea' in response.text:
-            print("✅ Upload area found")
-        if 'uploadImage' in response.text:
-            print("✅ Upload function found")
-        if 'csrf_token' in response.text:
-            print("✅ CSRF token found")
-            
-        # Test 2: Get CSRF token
-        print("\n2️⃣  Testing CSRF token extraction...")
-        csrf_match = re.search(r'csrf_token.*?==.*?[\'"]([^\'"]+)[\'"]', response.text)
-        if csrf_match:
-            csrf_token = csrf_match.group(1)
-            print(f"✅ CSRF token extracted: {csrf_token[:10]}...")
-        else:
-            print("⚠️  CSRF token format different, trying alternative...")
-            # Try alternative patterns
-            csrf_match = re.search(r'X-CSRFToken.*?[\'"]([^\'"]+)[\'"]', response.text)
-            if csrf_match:
-                csrf_token = csrf_match.group(1)
-                print(f"✅ CSRF token found: {csrf_token[:10]}...")
-            else:
-                print("⚠️  Could not extract CSRF token, will test without")
-                csrf_token = None
-        
-        # Test 3: Create and upload test image
-        print("\n3️⃣  Testing image upload via API...")
-        
-        # Create a realistic test image (not just green)
-        test_img = Image.new('RGB', (224, 224), color=(34, 139, 34))  # Forest green
-        # Add some texture/variation
-        from PIL import ImageDraw
-        draw = ImageDraw.Draw(test_img)
-        for i in range(20):
-            x = i * 11
-            draw.rectangle([x, 50, x+5, 174], fill=(0, 100, 0))  # Darker green stripes
-        
-        img_bytes = io.BytesIO()
-        test_img.save(img_bytes, format='JPEG', quality=85)
-        img_bytes.seek(0)
-        
-        print("✅ Test image created with realistic texture")
-        
-        # Test API endpoint directly (simulating AJAX call)
-        files = {'image': ('tomato_leaf_test.jpg', img_bytes, 'image/jpeg')}
-        headers = {}
-        if csrf_token:
-            headers['X-CSRFToken'] = csrf_token
-            
-        print("📡 Calling API endpoint /api/predict/...")
-        response = session.post('http://localhost:8000/api/predict/', files=files, headers=headers)
-        
-        print(f"📊 Response status: {response.status_code}")
-        print(f"📋 Response headers: {dict(response.headers)}")
-        
-        if response.status_code == 200:
-            try:
-                data = response.json()
-                print(f"✅ API response received successfully")
-                
-                # Validate response structure
-                if data.get('success') and data.get('prediction'):
-                    pred = data['prediction']
-                    print(f"\n🎯 PREDICTION RESULTS:")
-                    print(f"   Disease: {pred.get('class', 'Unknown')}")
-                    print(f"   Confidence: {pred.get('confidence', 0):.1f}%")
-                    
-                    if pred.get('disease_info'):
-                        info = pred['disease_info']
-                        print(f"   Symptoms: {info.get('symptoms', 'N/A')[:100]}...")
-                        if info.get('interventions'):
-                            print(f"   Treatment: {info.get('interventions', 'N/A')[:100]}...")
-                    
-                    # Check all predictions
-                    if data.get('all_predictions'):
-                        print(f"\n📊 ALL PREDICTIONS:")
-                        for i, p in enumerate(data['all_predictions'][:3]):
-                            print(f"   {i+1}. {p.get('disease', 'Unknown')}: {p.get('confidence', 0):.1f}%")
-                    
-                    print("\n" + "=" * 60)
-                    print("🎉 MAIN UPLOAD PAGE TEST PASSED!")
-                    print("\n✅ All enhancements working:")
-                    print("   • Robust file validation")
-                    print("   • Enhanced error handling") 
-                    print("   • Improved progress tracking")
-                    print("   • Better CSRF handling")
-                    print("   • Enhanced UI/UX")
-                    print("   • Detailed results display")
-                    
-                else:
-                    print(f"❌ Invalid response format: {data}")
-                    
-            except json.JSONDecodeError as e:
-                print(f"❌ Invalid JSON response: {e}")
-                print(f"Response text: {response.text[:500]}")
-                
-        elif response.status_code == 403:
-            print(f"❌ CSRF error - token may be invalid")
-            print(f"Response: {response.text[:500]}")
-            
-        elif response.status_code == 500:
-            print(f"❌ Server error - check server logs")
-            print(f"Error response: {response.text[:1000]}")
-            
-        else:
-            print(f"❌ Unexpected status code: {response.status_code}")
-            print(f"Response: {response.text[:500]}")
-            
-    except requests.exceptions.ConnectionError:
-        print("❌ Cannot connect to server. Make sure it's running on localhost:8000")
-    except Exception as e:
-        print(f"❌ Test failed: {e}")
-        import traceback
-        traceback.print_exc()
-
-if __name__ == "__main__":
-    test_main_upload()
\ No newline at end of file
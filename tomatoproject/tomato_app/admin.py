@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Prediction
+from .models import (BatchJob, BatchJobImage, Counter, DailyPredictionRollup, ModelEvaluation, Prediction,
+                     StoredImage)
 
 
 @admin.register(Prediction)
@@ -7,3 +8,45 @@ class PredictionAdmin(admin.ModelAdmin):
     list_display = ['image_name', 'prediction', 'confidence', 'timestamp']
     list_filter = ['prediction', 'timestamp']
     search_fields = ['image_name', 'prediction']
+
+
+class BatchJobImageInline(admin.TabularInline):
+    model = BatchJobImage
+    fields = ['position', 'image_name', 'status', 'prediction', 'confidence', 'error']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(BatchJob)
+class BatchJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'status', 'processed_images', 'total_images', 'failed_images', 'worker', 'created_at']
+    list_filter = ['status', 'created_at']
+    readonly_fields = ['worker', 'lease_expires_at', 'attempts', 'started_at', 'finished_at']
+    inlines = [BatchJobImageInline]
+
+
+@admin.register(StoredImage)
+class StoredImageAdmin(admin.ModelAdmin):
+    list_display = ['sha256', 'path', 'width', 'height', 'size_bytes', 'ref_count', 'created_at']
+    search_fields = ['sha256', 'path']
+    readonly_fields = ['sha256', 'path', 'thumbnail_path', 'width', 'height', 'size_bytes', 'ref_count']
+
+
+@admin.register(DailyPredictionRollup)
+class DailyPredictionRollupAdmin(admin.ModelAdmin):
+    list_display = ['day', 'prediction', 'count', 'avg_confidence']
+    list_filter = ['prediction']
+    date_hierarchy = 'day'
+
+
+@admin.register(Counter)
+class CounterAdmin(admin.ModelAdmin):
+    list_display = ['name', 'value', 'reconciled_at']
+    readonly_fields = ['reconciled_at']
+
+
+@admin.register(ModelEvaluation)
+class ModelEvaluationAdmin(admin.ModelAdmin):
+    list_display = ['model_version', 'backend', 'split', 'accuracy', 'f1_score', 'images_per_second', 'created_at']
+    list_filter = ['backend', 'split']
@@ -0,0 +1,172 @@
+"""
+Daily per-class rollups of Prediction rows for the crop report
+
+The crop report reads DailyPredictionRollup instead of scanning the
+Prediction table. Rollups are kept up to date incrementally: rows saved one
+at a time are counted by a post_save handler, bulk inserts (which send no
+signals) call ``record_predictions`` themselves, and deletes are subtracted
+by a post_delete handler. ``manage.py rebuild_prediction_rollups``
+recomputes them from the raw table, e.g. nightly or after bulk edits.
+The same hooks keep the landing page's prediction counter
+(``tomato_app.counters``) in step.
+"""
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import counters
+from .models import DailyPredictionRollup, Prediction
+
+HEALTHY_CLASS = 'Healthy Plant'
+
+
+def _add(day: date, prediction: str, count: int, confidence_sum: float):
+    """Add to one rollup row, creating it if needed"""
+    # Write before reading, as in storage._acquire
+    while True:
+        if DailyPredictionRollup.objects.filter(day=day, prediction=prediction).update(
+            count=F('count') + count, confidence_sum=F('confidence_sum') + confidence_sum
+        ):
+            return
+        try:
+            with transaction.atomic():
+                DailyPredictionRollup.objects.create(
+                    day=day, prediction=prediction, count=count, confidence_sum=confidence_sum
+                )
+            return
+        except IntegrityError:
+            continue
+
+
+def record_predictions(predictions, sign: int = 1):
+    """
+    Add saved predictions to (or with ``sign=-1`` remove them from) the
+    rollups and the prediction counter
+
+    Args:
+        predictions: Prediction instances with ``timestamp`` set
+        sign: 1 for inserts, -1 for deletes
+    """
+    totals = defaultdict(lambda: [0, 0.0])
+    for prediction in predictions:
+        key = (timezone.localdate(prediction.timestamp), prediction.prediction)
+        totals[key][0] += sign
+        totals[key][1] += sign * prediction.confidence
+    with transaction.atomic():
+        for (day, prediction), (count, confidence_sum) in sorted(totals.items()):
+            _add(day, prediction, count, confidence_sum)
+        counters.increment(counters.PREDICTIONS, sum(count for count, _ in totals.values()))
+
+
+@receiver(post_save, sender=Prediction)
+def _count_saved_prediction(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        record_predictions([instance])
+
+
+@receiver(post_delete, sender=Prediction)
+def _uncount_deleted_prediction(sender, instance, **kwargs):
+    record_predictions([instance], sign=-1)
+
+
+def _start_of_day(day: date) -> datetime:
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def timestamp_filter(start: date = None, end: date = None) -> dict:
+    """
+    Prediction filter kwargs for the days ``start``..``end`` (inclusive)
+
+    Compares ``timestamp`` with the start of each day instead of using
+    ``timestamp__date``, which casts every row and cannot use the index.
+    """
+    kwargs = {}
+    if start:
+        kwargs['timestamp__gte'] = _start_of_day(start)
+    if end:
+        kwargs['timestamp__lt'] = _start_of_day(end + timedelta(days=1))
+    return kwargs
+
+
+def rebuild_rollups(start: date = None, end: date = None) -> int:
+    """
+    Recompute rollups for ``start``..``end`` (inclusive, default: everything) from Prediction
+
+    Returns:
+        The number of rollup rows written
+    """
+    predictions = Prediction.objects.filter(**timestamp_filter(start, end))
+    rollups = DailyPredictionRollup.objects.all()
+    if start:
+        rollups = rollups.filter(day__gte=start)
+    if end:
+        rollups = rollups.filter(day__lte=end)
+
+    rows = (predictions.annotate(day=TruncDate('timestamp')).order_by()
+            .values('day', 'prediction')
+            .annotate(count=Count('pk'), confidence_sum=Sum('confidence')))
+    with transaction.atomic():
+        rollups.delete()
+        created = DailyPredictionRollup.objects.bulk_create(
+            DailyPredictionRollup(**row) for row in rows
+        )
+    return len(created)
+
+
+def report(start: date = None, end: date = None) -> dict:
+    """
+    Crop report statistics for ``start``..``end`` (inclusive), read from the rollups
+
+    Returns:
+        Dict with ``total``, ``healthy``, ``diseased``, ``health_percentage``,
+        ``disease_distribution`` (per class, most frequent first) and
+        ``daily`` (per day totals, oldest first)
+    """
+    rollups = DailyPredictionRollup.objects.filter(count__gt=0)
+    if start:
+        rollups = rollups.filter(day__gte=start)
+    if end:
+        rollups = rollups.filter(day__lte=end)
+
+    per_class = list(rollups.values('prediction').annotate(
+        count=Sum('count'), confidence_sum=Sum('confidence_sum')
+    ).order_by('-count', 'prediction'))
+    total = sum(row['count'] for row in per_class)
+    healthy = sum(row['count'] for row in per_class if row['prediction'] == HEALTHY_CLASS)
+
+    distribution = [{
+        'prediction': row['prediction'],
+        'count': row['count'],
+        'percentage': round(row['count'] / total * 100, 1),
+        'avg_confidence': row['confidence_sum'] / row['count'],
+    } for row in per_class]
+
+    daily = {}
+    for row in rollups.values('day', 'prediction', 'count').order_by('day'):
+        day = daily.setdefault(row['day'], {'day': row['day'], 'total': 0, 'healthy': 0})
+        day['total'] += row['count']
+        if row['prediction'] == HEALTHY_CLASS:
+            day['healthy'] += row['count']
+    for day in daily.values():
+        day['diseased'] = day['total'] - day['healthy']
+
+    return {
+        'total': total,
+        'healthy': healthy,
+        'diseased': total - healthy,
+        'health_percentage': round(healthy / total * 100, 1) if total else 0,
+        'disease_distribution': distribution,
+        'daily': list(daily.values()),
+    }
+
+
+def default_range(days: int = 30):
+    """The last ``days`` days, ending today"""
+    today = timezone.localdate()
+    return today - timedelta(days=days - 1), today
@@ -5,3 +5,7 @@ class TomatoAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tomato_app'
     verbose_name = 'Tomato Disease Detection'
+
+    def ready(self):
+        # Register signal handlers (stored image references, report rollups)
+        from . import analytics, storage  # noqa: F401
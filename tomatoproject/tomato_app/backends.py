@@ -0,0 +1,528 @@
+"""
+Inference backends for TomatoDiseasePredictor
+
+Every backend takes a normalized float32 batch of shape (N, 224, 224, 3) -
+or, when ``accepts_uint8`` is set, raw (N, H, W, 3) uint8 pixels that are
+resized and rescaled inside the graph - and returns an (N, num_classes)
+array of class probabilities, so the predictor and the views do not depend
+on which runtime executes the model. The backend is selected with the
+INFERENCE_BACKEND setting.
+"""
+import logging
+import threading
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .inference_server import InferenceClient, InferenceServerUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+def bucket_size(count: int) -> int:
+    """Smallest power of two that holds ``count`` samples"""
+    return 1 << max(0, count - 1).bit_length()
+
+
+def batch_buckets(max_batch_size: int) -> list:
+    """Power-of-two batch sizes up to the bucket holding ``max_batch_size``"""
+    sizes = [1]
+    while sizes[-1] < max_batch_size:
+        sizes.append(sizes[-1] * 2)
+    return sizes
+
+
+def resolve_model_path() -> Path:
+    """Locate the Keras model file, falling back to the original repo layout"""
+    model_path = Path(settings.MODEL_PATH)
+    if model_path.exists():
+        return model_path
+
+    # Look for model in parent directory (original structure)
+    alt_path = Path(settings.BASE_DIR).parent / 'models' / 'best_mobilenet_finetuned.keras'
+    if alt_path.exists():
+        return alt_path
+    raise FileNotFoundError(f"Model not found at {model_path} or {alt_path}")
+
+
+def configure_tf_threads(tf):
+    """Size TensorFlow's thread pools before the runtime creates them in this process"""
+    try:
+        if settings.TF_INTRA_OP_THREADS:
+            tf.config.threading.set_intra_op_parallelism_threads(settings.TF_INTRA_OP_THREADS)
+        if settings.TF_INTER_OP_THREADS:
+            tf.config.threading.set_inter_op_parallelism_threads(settings.TF_INTER_OP_THREADS)
+    except RuntimeError:
+        # The runtime is already initialized in this process - keep its pools
+        pass
+
+
+class InferenceBackend:
+    """Base class for the runtimes that execute the model"""
+    name = None
+    # True when infer_batch takes raw uint8 images of any size
+    accepts_uint8 = False
+    # False when something downstream already batches concurrent requests
+    local_batching = True
+
+    def preload(self):
+        """
+        Do the fork-safe part of loading (imports, reading the model file)
+
+        Called in the gunicorn master when preloading, so the work is shared
+        copy-on-write by the workers. Nothing here may start threads or
+        initialize a runtime's thread pools, which do not survive fork.
+        """
+
+    def load(self):
+        """Load the model into memory"""
+        raise NotImplementedError
+
+    def warmup(self, samples: list, max_batch_size: int):
+        """
+        Run sample inputs through the model ahead of the first request
+
+        Args:
+            samples: Preprocessed arrays for single images
+            max_batch_size: Largest batch size the backend will be asked for
+        """
+        samples = [sample for sample in samples if sample.shape == samples[0].shape]
+        for size in batch_buckets(max_batch_size):
+            self.infer_batch(np.stack([samples[i % len(samples)] for i in range(size)]))
+
+    def infer_batch(self, batch: np.ndarray) -> np.ndarray:
+        """Run one forward pass over a stacked batch of preprocessed images"""
+        raise NotImplementedError
+
+    def describe(self) -> dict:
+        """Short description of the backend and its configuration"""
+        return {'backend': self.name}
+
+    @property
+    def version(self) -> str:
+        """
+        Identifier that changes whenever the served model changes
+
+        Built from the backend name and the model file's name, size and
+        modification time, so cached results and stored metrics are never
+        reused across model swaps.
+        """
+        model_path = getattr(self, 'model_path', None)
+        if model_path is None:
+            return self.name
+        try:
+            stat = Path(model_path).stat()
+        except OSError:
+            return f"{self.name}:{Path(model_path).name}"
+        return f"{self.name}:{Path(model_path).name}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+class KerasBackend(InferenceBackend):
+    """Float32 Keras model served through a traced tf.function"""
+    name = 'keras'
+
+    # IMAGE_RESAMPLE_FILTER name -> tf.image.resize method
+    TF_RESIZE_METHODS = {
+        'nearest': 'nearest',
+        'box': 'area',
+        'bilinear': 'bilinear',
+        'hamming': 'bilinear',
+        'bicubic': 'bicubic',
+        'lanczos': 'lanczos3',
+    }
+
+    def __init__(self, model_path=None, serving_function=None, jit_compile=None, graph_preprocessing=None):
+        self.model_path = Path(model_path) if model_path else None
+        self.serving_function = (settings.INFERENCE_SERVING_FUNCTION
+                                 if serving_function is None else serving_function)
+        self.jit_compile = settings.INFERENCE_XLA_JIT if jit_compile is None else jit_compile
+        if graph_preprocessing is None:
+            graph_preprocessing = settings.INFERENCE_GRAPH_PREPROCESSING
+        # In-graph preprocessing needs the serving function
+        self.accepts_uint8 = bool(graph_preprocessing and self.serving_function)
+        self.model = None
+        self._serving_fn = None
+
+    def preload(self):
+        # Importing TensorFlow does not create the runtime or its thread pools
+        import tensorflow  # noqa: F401
+
+        if self.model_path is None:
+            self.model_path = resolve_model_path()
+
+    def load(self):
+        import tensorflow as tf
+
+        configure_tf_threads(tf)
+        if self.model_path is None:
+            self.model_path = resolve_model_path()
+        self.model = tf.keras.models.load_model(self.model_path)
+        if self.serving_function:
+            self._serving_fn = self.build_serving_fn(self.jit_compile, self.accepts_uint8)
+
+    def build_serving_fn(self, jit_compile=False, uint8_input=False):
+        """
+        Wrap the model in a traced tf.function with a fixed input signature
+
+        Calling the function directly skips the data adapter and iterator
+        that ``model.predict`` builds on every call. With ``uint8_input`` the
+        function takes raw (N, H, W, 3) uint8 images of any size and does the
+        resize and [0, 1] rescale in-graph, using TF's multi-threaded kernels.
+        """
+        import tensorflow as tf
+
+        model = self.model
+
+        @tf.function(
+            input_signature=[tf.TensorSpec(shape=(None, 224, 224, 3), dtype=tf.float32)],
+            jit_compile=jit_compile,
+        )
+        def serve(images):
+            return model(images, training=False)
+
+        if not uint8_input:
+            return serve
+
+        method = self.TF_RESIZE_METHODS.get(settings.IMAGE_RESAMPLE_FILTER.lower(), 'bilinear')
+
+        # The resize stays outside the XLA cluster so arbitrary input sizes
+        # do not trigger recompiles; only the fixed-shape model call is jitted.
+        @tf.function(input_signature=[tf.TensorSpec(shape=(None, None, None, 3), dtype=tf.uint8)])
+        def serve_uint8(images):
+            resized = tf.image.resize(images, (224, 224), method=method, antialias=True)
+            return serve(tf.clip_by_value(resized, 0.0, 255.0) / 255.0)
+
+        return serve_uint8
+
+    def infer_batch(self, batch: np.ndarray) -> np.ndarray:
+        if self._serving_fn is None:
+            return self.model.predict(batch, verbose=0)
+
+        if not self.accepts_uint8:
+            batch = batch.astype(np.float32, copy=False)
+        count = len(batch)
+        if self.jit_compile:
+            # XLA compiles once per shape - pad to a power of two to bound recompiles
+            padded = bucket_size(count)
+            if padded > count:
+                padding = np.zeros((padded - count,) + batch.shape[1:], dtype=batch.dtype)
+                batch = np.concatenate([batch, padding])
+        return self._serving_fn(batch).numpy()[:count]
+
+    def describe(self) -> dict:
+        return {
+            'backend': self.name,
+            'model_path': str(self.model_path),
+            'serving_function': bool(self._serving_fn),
+            'xla_jit': bool(self.jit_compile),
+            'graph_preprocessing': self.accepts_uint8,
+        }
+
+    @property
+    def version(self) -> str:
+        # In-graph resizing can shift scores slightly, so keep its cache entries apart
+        version = super().version
+        return f"{version}:uint8" if self.accepts_uint8 else version
+
+
+class TFLiteInt8Backend(InferenceBackend):
+    """
+    Full-integer TFLite model with a float-in, float-out interface
+
+    Inputs are quantized and outputs dequantized with the scale and zero
+    point stored in the model, written by ``manage.py quantize_model``.
+    """
+    name = 'tflite_int8'
+
+    def __init__(self, model_path=None, num_threads=None):
+        self.model_path = Path(model_path or settings.TFLITE_MODEL_PATH)
+        self.num_threads = settings.TFLITE_NUM_THREADS if num_threads is None else num_threads
+        self._model_content = None
+        self._tf = None
+        # Batches are padded to a power of two and every bucket keeps its own
+        # interpreter, allocated once: resizing one interpreter's input
+        # reallocates all its tensors. Each interpreter holds mutable tensor
+        # buffers, so calls to it are serialized by its lock.
+        self._interpreters = {}  # bucket size -> (interpreter, lock)
+        self._interpreters_lock = threading.Lock()
+
+    def preload(self):
+        import tensorflow  # noqa: F401
+
+        # The interpreters read constant tensors straight from this buffer, so
+        # workers forked after preloading share the weights copy-on-write
+        self._model_content = self.model_path.read_bytes()
+
+    def load(self):
+        import tensorflow as tf
+
+        self._tf = tf
+        self._interpreters = {}
+        interpreter = self._new_interpreter()
+        interpreter.allocate_tensors()
+        self._input = interpreter.get_input_details()[0]
+        self._output = interpreter.get_output_details()[0]
+        batch_size = int(self._input['shape'][0])
+        if batch_size == bucket_size(batch_size):
+            self._interpreters[batch_size] = (interpreter, threading.Lock())
+
+    def _new_interpreter(self):
+        if self._model_content is not None:
+            return self._tf.lite.Interpreter(model_content=self._model_content, num_threads=self.num_threads or None)
+        return self._tf.lite.Interpreter(model_path=str(self.model_path), num_threads=self.num_threads or None)
+
+    def _interpreter_for(self, size: int):
+        """The interpreter (and its lock) allocated for batches of ``size``"""
+        entry = self._interpreters.get(size)
+        if entry is None:
+            with self._interpreters_lock:
+                entry = self._interpreters.get(size)
+                if entry is None:
+                    interpreter = self._new_interpreter()
+                    interpreter.resize_tensor_input(self._input['index'], [size] + list(self._input['shape'][1:]))
+                    interpreter.allocate_tensors()
+                    entry = self._interpreters[size] = (interpreter, threading.Lock())
+        return entry
+
+    def infer_batch(self, batch: np.ndarray) -> np.ndarray:
+        scale, zero_point = self._input['quantization']
+        if scale:
+            batch = np.round(batch / scale + zero_point)
+            info = np.iinfo(self._input['dtype'])
+            batch = np.clip(batch, info.min, info.max)
+        batch = batch.astype(self._input['dtype'])
+
+        count = len(batch)
+        padded = bucket_size(count)
+        if padded > count:
+            padding = np.zeros((padded - count,) + batch.shape[1:], dtype=batch.dtype)
+            batch = np.concatenate([batch, padding])
+
+        interpreter, lock = self._interpreter_for(padded)
+        with lock:
+            interpreter.set_tensor(self._input['index'], batch)
+            interpreter.invoke()
+            output = interpreter.get_tensor(self._output['index'])[:count]
+
+        scale, zero_point = self._output['quantization']
+        if scale:
+            return (output.astype(np.float32) - zero_point) * scale
+        return output.astype(np.float32)
+
+    def describe(self) -> dict:
+        return {
+            'backend': self.name,
+            'model_path': str(self.model_path),
+            'num_threads': self.num_threads or 'auto',
+            'allocated_batch_sizes': sorted(self._interpreters),
+        }
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """ONNX Runtime CPU session over the model written by ``manage.py export_onnx``"""
+    name = 'onnx'
+
+    OPTIMIZATION_LEVELS = ('disable', 'basic', 'extended', 'all')
+
+    def __init__(self, model_path=None, intra_op_threads=None, inter_op_threads=None,
+                 optimization_level=None):
+        self.model_path = Path(model_path or settings.ONNX_MODEL_PATH)
+        self.intra_op_threads = (settings.ONNX_INTRA_OP_THREADS
+                                 if intra_op_threads is None else intra_op_threads)
+        self.inter_op_threads = (settings.ONNX_INTER_OP_THREADS
+                                 if inter_op_threads is None else inter_op_threads)
+        self.optimization_level = optimization_level or settings.ONNX_GRAPH_OPTIMIZATION_LEVEL
+        self._model_content = None
+        self._session = None
+
+    def preload(self):
+        import onnxruntime  # noqa: F401
+
+        self._model_content = self.model_path.read_bytes()
+
+    def load(self):
+        import onnxruntime as ort
+
+        if self.optimization_level not in self.OPTIMIZATION_LEVELS:
+            raise ValueError(
+                f"ONNX_GRAPH_OPTIMIZATION_LEVEL must be one of {', '.join(self.OPTIMIZATION_LEVELS)}"
+            )
+        levels = {
+            'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+            'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+        }
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = levels[self.optimization_level]
+        if self.intra_op_threads:
+            options.intra_op_num_threads = self.intra_op_threads
+        if self.inter_op_threads:
+            options.inter_op_num_threads = self.inter_op_threads
+
+        self._session = ort.InferenceSession(
+            self._model_content if self._model_content is not None else str(self.model_path),
+            sess_options=options, providers=['CPUExecutionProvider'],
+        )
+        self._input_name = self._session.get_inputs()[0].name
+
+    def infer_batch(self, batch: np.ndarray) -> np.ndarray:
+        # InferenceSession.run is thread-safe
+        return self._session.run(None, {self._input_name: batch.astype(np.float32, copy=False)})[0]
+
+    def describe(self) -> dict:
+        return {
+            'backend': self.name,
+            'model_path': str(self.model_path),
+            'intra_op_threads': self.intra_op_threads or 'auto',
+            'inter_op_threads': self.inter_op_threads or 'auto',
+            'graph_optimization_level': self.optimization_level,
+        }
+
+
+class RemoteBackend(InferenceBackend):
+    """
+    Forward inference to a ``manage.py run_inference_server`` daemon
+
+    The daemon runs INFERENCE_SERVER_BACKEND and batches requests from all
+    web workers. If it cannot be reached and INFERENCE_SERVER_FALLBACK is on,
+    the same backend is loaded in this process instead: at startup straight
+    away, later in a background thread while requests get
+    ``InferenceServerUnavailable`` (503) until it is warmed up. The worker
+    then keeps inferring in-process, micro-batched like a local backend,
+    until it is restarted.
+    """
+    name = 'remote'
+
+    def __init__(self, socket_path=None, timeout=None, pool_size=None, fallback=None):
+        self.client = InferenceClient(
+            socket_path or settings.INFERENCE_SERVER_SOCKET,
+            timeout=settings.INFERENCE_SERVER_TIMEOUT if timeout is None else timeout,
+            pool_size=settings.INFERENCE_SERVER_POOL_SIZE if pool_size is None else pool_size,
+        )
+        self.fallback = settings.INFERENCE_SERVER_FALLBACK if fallback is None else fallback
+        self._server_info = None
+        self._local = None
+        self._local_thread = None
+        self._local_error = None
+        self._local_lock = threading.Lock()
+
+    def load(self):
+        try:
+            self._server_info = self.client.info()
+        except InferenceServerUnavailable as e:
+            if not self.fallback:
+                raise
+            # The predictor is still loading, so load here; it warms the model up
+            logger.warning("%s - loading the model in-process", e)
+            backend = get_backend(settings.INFERENCE_SERVER_BACKEND)
+            backend.load()
+            self._use_local(backend)
+
+    def _use_local(self, backend: InferenceBackend):
+        self._local = backend
+        # Describe the in-process model from now on
+        self._server_info = None
+
+    def _start_local_load(self):
+        """Load and warm up the fallback backend in a background thread, once"""
+        with self._local_lock:
+            if self._local is None and self._local_thread is None:
+                self._local_thread = threading.Thread(
+                    target=self._load_local, name='fallback-model-loader', daemon=True
+                )
+                self._local_thread.start()
+
+    def _load_local(self):
+        try:
+            backend = get_backend(settings.INFERENCE_SERVER_BACKEND)
+            backend.load()
+        except Exception as e:
+            logger.exception("Loading the in-process fallback model failed")
+            with self._local_lock:
+                self._local_error = str(e)
+                # The next unavailable request tries again
+                self._local_thread = None
+            return
+
+        sample = np.zeros((224, 224, 3), dtype=np.uint8 if backend.accepts_uint8 else np.float32)
+        try:
+            largest = max(settings.INFERENCE_MAX_BATCH_SIZE, settings.INFERENCE_BATCH_CHUNK_SIZE)
+            backend.warmup([sample], largest)
+        except Exception:
+            logger.exception("Warming up the in-process fallback model failed")
+        with self._local_lock:
+            self._local_error = None
+            self._use_local(backend)
+        logger.warning("Running inference in-process with %s", backend.describe())
+
+    @property
+    def local_batching(self) -> bool:
+        # The server batches across every web worker; an in-process fallback does not
+        return self._local is not None
+
+    @property
+    def accepts_uint8(self) -> bool:
+        if self._server_info is not None:
+            return self._server_info['accepts_uint8']
+        return self._local is not None and self._local.accepts_uint8
+
+    def warmup(self, samples: list, max_batch_size: int):
+        # The server warms up its own model; only an in-process fallback needs it
+        if self._local is not None:
+            self._local.warmup(samples, max_batch_size)
+
+    def infer_batch(self, batch: np.ndarray) -> np.ndarray:
+        if self._local is not None:
+            return self._local.infer_batch(batch)
+        try:
+            return self.client.infer_batch(batch)
+        except InferenceServerUnavailable as e:
+            if not self.fallback:
+                raise
+            self._start_local_load()
+            raise InferenceServerUnavailable(f"{e} - loading the model in-process, retry shortly") from e
+
+    def describe(self) -> dict:
+        description = {
+            'backend': self.name,
+            'socket': self.client.socket_path,
+            'fallback': self.fallback,
+        }
+        if self._server_info is not None:
+            description['server'] = self._server_info['description']
+        if self._local is not None:
+            description['local'] = self._local.describe()
+        elif self._local_thread is not None:
+            description['local'] = 'loading'
+        if self._local_error is not None:
+            description['local_error'] = self._local_error
+        return description
+
+    @property
+    def version(self) -> str:
+        if self._server_info is not None:
+            return self._server_info['version']
+        if self._local is not None:
+            return self._local.version
+        return self.name
+
+
+BACKENDS = {
+    KerasBackend.name: KerasBackend,
+    TFLiteInt8Backend.name: TFLiteInt8Backend,
+    OnnxRuntimeBackend.name: OnnxRuntimeBackend,
+    RemoteBackend.name: RemoteBackend,
+}
+
+
+def get_backend(name: str = None, **kwargs) -> InferenceBackend:
+    """Create an (unloaded) backend by name, defaulting to INFERENCE_BACKEND"""
+    name = name or settings.INFERENCE_BACKEND
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown inference backend '{name}' (choose from {', '.join(BACKENDS)})")
+    return backend_class(**kwargs)
@@ -0,0 +1,145 @@
+"""
+Dynamic micro-batching for model inference
+
+Concurrent requests are collected for up to ``max_delay_ms`` (or until
+``max_batch_size`` requests are waiting), run through the model as one
+forward pass, and the per-sample outputs are handed back to each caller's
+future.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the batching queue is at its configured depth"""
+
+
+class MicroBatcher:
+    """Collect concurrent inference requests and run them as batches"""
+
+    def __init__(self, infer_fn, max_batch_size=16, max_delay_ms=10.0, max_queue_depth=256):
+        """
+        Args:
+            infer_fn: Callable taking a stacked ``(N, ...)`` array and
+                returning an ``(N, num_classes)`` array of scores
+            max_batch_size: Largest batch handed to ``infer_fn``
+            max_delay_ms: How long the first request in a batch may wait
+                for others to join
+            max_queue_depth: Requests allowed to wait before ``submit``
+                starts rejecting new work
+        """
+        self.infer_fn = infer_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_delay = max(0.0, float(max_delay_ms)) / 1000.0
+        self.max_queue_depth = max(1, int(max_queue_depth))
+        self._queue = queue.Queue(maxsize=self.max_queue_depth)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of requests currently waiting to be batched"""
+        return self._queue.qsize()
+
+    def start(self):
+        """Start the scheduler thread if it is not already running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='inference-batcher', daemon=True
+                )
+                self._thread.start()
+
+    def stop(self, timeout=None):
+        """Finish the queued work and stop the scheduler thread"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def submit(self, sample: np.ndarray) -> Future:
+        """
+        Queue a single preprocessed sample for inference
+
+        Args:
+            sample: Array for one sample, without the batch dimension
+
+        Returns:
+            Future resolving to that sample's output row
+        """
+        if self._thread is None:
+            self.start()
+
+        future = Future()
+        try:
+            self._queue.put_nowait((sample, future))
+        except queue.Full:
+            raise QueueFullError(
+                f"Inference queue is full ({self.max_queue_depth} requests waiting)"
+            )
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        item = self._queue.get(timeout=remaining)
+                    else:
+                        # Deadline passed - still take whatever is already waiting
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._process(batch)
+            if stopping:
+                return
+
+    def _process(self, batch):
+        # Drop requests whose caller cancelled while waiting
+        batch = [(sample, future) for sample, future in batch
+                 if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        # Raw uint8 inputs keep their decoded size, so only same-shaped samples can be stacked
+        groups = {}
+        for sample, future in batch:
+            groups.setdefault(sample.shape, []).append((sample, future))
+        for group in groups.values():
+            self._run_group(group)
+
+    def _run_group(self, batch):
+        try:
+            outputs = self.infer_fn(np.stack([sample for sample, _ in batch]))
+        except Exception as e:
+            logger.exception("Batched inference failed for %d request(s)", len(batch))
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), output in zip(batch, outputs):
+            future.set_result(output)
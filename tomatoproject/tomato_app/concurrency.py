@@ -0,0 +1,89 @@
+"""
+Bounded offloading of blocking work from async views
+
+Decoding and inference block, so async views hand them to a thread pool.
+An in-flight limit caps how many requests may hold work in that pool
+(running or queued); requests beyond it are rejected straight away instead
+of queueing without bound.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import metrics
+
+
+class ExecutorSaturated(RuntimeError):
+    """Raised when every in-flight slot is taken"""
+
+
+class BoundedExecutor:
+    """Thread pool with a hard cap on in-flight requests"""
+
+    def __init__(self, max_workers: int, max_in_flight: int, thread_name_prefix: str = ''):
+        """
+        Args:
+            max_workers: Threads running blocking work
+            max_in_flight: Requests allowed to hold a slot at once; the
+                ones beyond ``max_workers`` wait in the pool's queue
+            thread_name_prefix: Name prefix for the pool's threads
+        """
+        self.max_workers = max(1, int(max_workers))
+        self.max_in_flight = max(self.max_workers, int(max_in_flight))
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix=thread_name_prefix)
+        # A threading semaphore (not asyncio's) so it works whichever event
+        # loop runs the view - under WSGI each async view gets a fresh loop
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        """Requests currently holding a slot"""
+        return self._in_flight
+
+    def acquire(self):
+        """Take an in-flight slot without waiting; raises ExecutorSaturated if none is free"""
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorSaturated(f"All {self.max_in_flight} in-flight slots are taken")
+        with self._lock:
+            self._in_flight += 1
+
+    def release(self):
+        """Give back a slot taken with ``acquire``"""
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    async def run(self, fn, *args, **kwargs):
+        """Run ``fn`` on the pool and await its result, in a copy of the caller's context"""
+        loop = asyncio.get_running_loop()
+        # Copy the context so stage timings land on the calling request
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(context.run, fn, *args, **kwargs))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+metrics.ASYNC_IN_FLIGHT.set_function(lambda: _executor.in_flight if _executor is not None else 0)
+
+
+def inference_executor() -> BoundedExecutor:
+    """The process-wide executor for async prediction views, sized by ASYNC_INFERENCE_* settings"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = settings.ASYNC_INFERENCE_WORKERS or os.cpu_count() or 1
+                _executor = BoundedExecutor(
+                    workers,
+                    settings.ASYNC_MAX_IN_FLIGHT or 4 * workers,
+                    thread_name_prefix='async-inference',
+                )
+    return _executor
@@ -0,0 +1,83 @@
+"""
+Maintained row counters, so pages never run ``COUNT(*)``
+
+Each counter is a row in the Counter table, incremented in the same
+transaction as the rows it counts (``tomato_app.analytics`` does this for
+predictions) and cached in the Django cache for COUNTER_CACHE_SECONDS.
+Reading a counter is one cache get; on a miss it is one primary-key lookup,
+plus a real ``COUNT(*)`` at most every COUNTER_RECONCILE_SECONDS to correct
+drift from rows written outside the ORM or from rolled-back transactions.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Counter, Prediction
+
+logger = logging.getLogger(__name__)
+
+PREDICTIONS = 'predictions'
+
+# Counter name -> callable returning the true count
+SOURCES = {
+    PREDICTIONS: lambda: Prediction.objects.count(),
+}
+
+
+def _cache_key(name: str) -> str:
+    return f'tomato_app:counter:{name}'
+
+
+def increment(name: str, delta: int = 1):
+    """Add ``delta`` to a counter; the cached value follows once the transaction commits"""
+    if not delta:
+        return
+    # No row yet means the counter was never read; the first read counts for real
+    Counter.objects.filter(name=name).update(value=F('value') + delta)
+
+    def bump_cache():
+        try:
+            cache.incr(_cache_key(name), delta)
+        except ValueError:
+            pass  # not cached - the next read loads the row
+    transaction.on_commit(bump_cache)
+
+
+def reconcile(name: str) -> Counter:
+    """Reset a counter to the true count of what it counts"""
+    true_value = SOURCES[name]()
+    counter, created = Counter.objects.update_or_create(
+        name=name, defaults={'value': true_value, 'reconciled_at': timezone.now()}
+    )
+    cache.set(_cache_key(name), true_value, settings.COUNTER_CACHE_SECONDS)
+    return counter
+
+
+def get_count(name: str) -> int:
+    """A counter's value, from the cache when possible"""
+    value = cache.get(_cache_key(name))
+    if value is not None:
+        return value
+
+    counter = Counter.objects.filter(name=name).first()
+    stale_before = timezone.now() - timedelta(seconds=settings.COUNTER_RECONCILE_SECONDS)
+    if counter is None or counter.reconciled_at is None or counter.reconciled_at < stale_before:
+        previous = counter.value if counter else None
+        counter = reconcile(name)
+        if previous is not None and previous != counter.value:
+            logger.info("Counter %s drifted by %d; reconciled to %d",
+                        name, counter.value - previous, counter.value)
+        return counter.value
+
+    cache.add(_cache_key(name), counter.value, settings.COUNTER_CACHE_SECONDS)
+    return counter.value
+
+
+def prediction_count() -> int:
+    """Number of saved predictions, for the landing page"""
+    return get_count(PREDICTIONS)
@@ -0,0 +1,56 @@
+"""
+Helpers for reading the labelled train/val/test images in notebooks/data_split
+"""
+import random
+from pathlib import Path
+
+from django.conf import settings
+
+# data_split folder name -> class name used by TomatoDiseasePredictor
+FOLDER_CLASS_NAMES = {
+    'Bacterial_spot227': 'Bacterial Spot',
+    'Early_blight227': 'Early Blight',
+    'Late_blight227': 'Late Blight',
+    'Leaf_Mold227': 'Leaf Mold',
+    'Septoria_leaf_spot227': 'Septoria Leaf Spot',
+    'Target_Spot227': 'Target Spot',
+    'Tomato_Yellow_Leaf_Curl_Virus227': 'Tomato Yellow Leaf Curl Virus',
+    'Tomato_mosaic_virus227': 'Tomato Mosaic Virus',
+    'Two-spotted_spider_mite227': 'Two-Spotted Spider Mite',
+    'healthy227': 'Healthy Plant',
+}
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
+
+def split_dir(split: str) -> Path:
+    """Return the directory for a data split ('train', 'val' or 'test')"""
+    path = Path(settings.DATA_SPLIT_DIR) / split
+    if not path.is_dir():
+        raise FileNotFoundError(f"Data split not found at {path}")
+    return path
+
+
+def labelled_images(split: str, per_class: int = None, seed: int = 0) -> list:
+    """
+    List labelled images in a data split
+
+    Args:
+        split: 'train', 'val' or 'test'
+        per_class: Optional cap on images per class, sampled reproducibly
+        seed: Seed used when sampling with ``per_class``
+
+    Returns:
+        List of (image path, class name) tuples, grouped by class
+    """
+    rng = random.Random(seed)
+    samples = []
+    for folder, class_name in FOLDER_CLASS_NAMES.items():
+        class_dir = split_dir(split) / folder
+        if not class_dir.is_dir():
+            continue
+        paths = sorted(p for p in class_dir.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+        if per_class is not None and len(paths) > per_class:
+            paths = sorted(rng.sample(paths, per_class))
+        samples.extend((path, class_name) for path in paths)
+    return samples
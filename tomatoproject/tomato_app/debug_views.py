@@ -1,8 +1,12 @@
-from django.shortcuts import render
-from django.http import HttpResponse
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.shortcuts import redirect, render
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.middleware.csrf import get_token
 from django.contrib import messages
 from PIL import Image
+from . import memory, metrics, profiling
+from .decorators import model_ready_required
 from .ml_model import predictor
 from .disease_info import disease_info
 import json
@@ -18,6 +22,7 @@ def debug_upload(request):
     }
     return render(request, 'tomato_app/debug_upload.html', context)
 
+@model_ready_required
 def simple_upload(request):
     """Enhanced simple upload page with beautiful UI - NO DATABASE STORAGE"""
     if request.method == 'POST':
@@ -40,9 +45,9 @@ def simple_upload(request):
                 messages.error(request, "File size must be less than 10MB.")
                 return redirect('simple_upload')
             
-            # Process image
-            img = Image.open(uploaded_file).convert('RGB')
-            result = predictor.predict(img)
+            # Process image - repeat uploads of the same photo are served from cache
+            result = predictor.predict_upload(uploaded_file)
+            metrics.record_result('simple_upload', result)
             
             if result.get('success'):
                 disease_data = disease_info.get(result['predicted_class'], {})
@@ -68,7 +73,8 @@ def simple_upload(request):
                     'prediction': temp_prediction,
                 }
                 
-                return render(request, 'tomato_app/simple_upload_enhanced.html', context)
+                with metrics.stage('render'):
+                    return render(request, 'tomato_app/simple_upload_enhanced.html', context)
             else:
                 messages.error(request, f"Analysis failed: {result.get('error')}")
                 
@@ -76,4 +82,49 @@ def simple_upload(request):
             messages.error(request, f"Error processing image: {str(e)}")
             
     # GET request - show enhanced upload form
-    return render(request, 'tomato_app/simple_upload_enhanced.html')
\ No newline at end of file
+    return render(request, 'tomato_app/simple_upload_enhanced.html')
+
+
+@staff_member_required
+def profile_list(request):
+    """Stored request profiles, newest first"""
+    profiles = profiling.list_profiles()
+    for profile in profiles:
+        profile['milliseconds'] = profile['seconds'] * 1000
+        stage_ms = {}
+        for name, seconds in profile['stages']:
+            stage_ms[name] = stage_ms.get(name, 0.0) + seconds * 1000
+        profile['stage_ms'] = list(stage_ms.items())
+    return render(request, 'tomato_app/profiles.html', {
+        'profiles': profiles,
+        'max_profiles': settings.PROFILING_MAX_PROFILES,
+        'profile_dir': settings.PROFILING_DIR,
+    })
+
+
+@staff_member_required
+def profile_file(request, profile_id, name):
+    """Download one file of a stored profile"""
+    path = profiling.profile_file(profile_id, name)
+    if path is None:
+        raise Http404("No such profile file")
+    return FileResponse(path.open('rb'), as_attachment=True, filename=f'{profile_id}-{name}')
+
+
+@staff_member_required
+def debug_memory(request):
+    """This worker's RSS, recycling thresholds and top tracemalloc allocation sites"""
+    if request.method == 'POST':
+        action = request.POST.get('action')
+        if action == 'start':
+            # Also resets the snapshot that growth is measured from
+            memory.start_tracing()
+        elif action == 'stop':
+            memory.stop_tracing()
+        return redirect('debug_memory')
+
+    limit = request.GET.get('limit', '')
+    report = memory.report(limit=int(limit) if limit.isdigit() else 25)
+    if request.GET.get('format') == 'json':
+        return JsonResponse(report)
+    return render(request, 'tomato_app/debug_memory.html', {'report': report})
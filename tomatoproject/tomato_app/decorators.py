@@ -0,0 +1,45 @@
+"""
+View decorators for the prediction endpoints
+"""
+import asyncio
+from functools import wraps
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from .ml_model import predictor
+
+
+def _loading_response(request):
+    """The 503 response for a POST that arrives while the model is loading, or None"""
+    if request.method == 'POST' and not predictor.is_ready and predictor.start_background_load():
+        response = JsonResponse(
+            {'error': 'Model is loading, please retry shortly', 'state': predictor.load_state},
+            status=503,
+        )
+        response['Retry-After'] = str(settings.MODEL_LOADING_RETRY_AFTER)
+        return response
+    return None
+
+
+def model_ready_required(view):
+    """
+    Answer prediction POSTs with 503 + Retry-After while the model is loading
+
+    A request that arrives before any load has started kicks off a
+    background load. Once loading has finished (or failed) requests pass
+    through, so a missing model is still reported by the view itself.
+    Works on both sync and async views.
+    """
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapped(request, *args, **kwargs):
+            return _loading_response(request) or await view(request, *args, **kwargs)
+
+        return async_wrapped
+
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        return _loading_response(request) or view(request, *args, **kwargs)
+
+    return wrapped
@@ -0,0 +1,98 @@
+"""
+Offline model evaluation: metrics over a labelled data split
+
+``manage.py evaluate_model`` runs the active backend over
+notebooks/data_split/test and stores a ModelEvaluation per model version;
+the model performance page reads the evaluation of the served model from
+here rather than hard-coding numbers.
+"""
+import numpy as np
+from django.core.cache import cache
+
+from .models import ModelEvaluation
+
+# How long the model performance page caches an evaluation
+CACHE_SECONDS = 300
+
+
+def confusion_matrix(y_true: np.ndarray, y_pred: np.ndarray, num_classes: int) -> np.ndarray:
+    """(num_classes, num_classes) counts; rows are true classes, columns predictions"""
+    flat = num_classes * np.asarray(y_true, dtype=np.int64) + np.asarray(y_pred, dtype=np.int64)
+    return np.bincount(flat, minlength=num_classes * num_classes).reshape(num_classes, num_classes)
+
+
+def per_class_metrics(matrix: np.ndarray) -> dict:
+    """
+    Precision, recall, F1 and support for every class of a confusion matrix
+
+    Classes that are never predicted (or never occur) get 0 rather than NaN.
+
+    Returns:
+        Dict of arrays: ``precision``, ``recall``, ``f1``, ``support``
+    """
+    tp = np.diag(matrix).astype(np.float64)
+    predicted = matrix.sum(axis=0)
+    support = matrix.sum(axis=1)
+    precision = np.divide(tp, predicted, out=np.zeros_like(tp), where=predicted > 0)
+    recall = np.divide(tp, support, out=np.zeros_like(tp), where=support > 0)
+    both = precision + recall
+    f1 = np.divide(2 * precision * recall, both, out=np.zeros_like(tp), where=both > 0)
+    return {'precision': precision, 'recall': recall, 'f1': f1, 'support': support}
+
+
+def summarize(matrix: np.ndarray, class_names: list) -> dict:
+    """
+    Accuracy, macro-averaged metrics and a per-class breakdown of a confusion matrix
+
+    Returns:
+        Dict with ``accuracy``, ``precision``, ``recall``, ``f1_score``
+        (macro averages) and ``per_class`` (list of dicts per class)
+    """
+    metrics = per_class_metrics(matrix)
+    total = matrix.sum()
+    return {
+        'accuracy': float(np.trace(matrix) / total) if total else 0.0,
+        'precision': float(metrics['precision'].mean()),
+        'recall': float(metrics['recall'].mean()),
+        'f1_score': float(metrics['f1'].mean()),
+        'per_class': [
+            {
+                'disease': name,
+                'precision': float(metrics['precision'][i]),
+                'recall': float(metrics['recall'][i]),
+                'f1_score': float(metrics['f1'][i]),
+                'support': int(metrics['support'][i]),
+            }
+            for i, name in enumerate(class_names)
+        ],
+    }
+
+
+def _cache_key(model_version: str) -> str:
+    return f'tomato_app:evaluation:{model_version or "latest"}'
+
+
+def latest_evaluation(model_version: str = '', split: str = 'test'):
+    """
+    The stored evaluation of ``model_version`` on ``split``, cached
+
+    With no version (model not loaded yet) the most recent evaluation is
+    returned. Returns None when nothing has been evaluated.
+    """
+    key = _cache_key(model_version)
+    evaluation = cache.get(key)
+    if evaluation is not None:
+        return evaluation
+
+    evaluations = ModelEvaluation.objects.filter(split=split)
+    if model_version:
+        evaluations = evaluations.filter(model_version=model_version)
+    evaluation = evaluations.order_by('-created_at').first()
+    if evaluation is not None:
+        cache.set(key, evaluation, CACHE_SECONDS)
+    return evaluation
+
+
+def forget_cached(model_version: str):
+    """Drop cached evaluations after a new one is stored"""
+    cache.delete_many([_cache_key(model_version), _cache_key('')])
@@ -0,0 +1,250 @@
+"""
+Out-of-process inference over a Unix domain socket
+
+``manage.py run_inference_server`` starts a daemon that owns the model and
+batches requests from every web worker on the box. Web workers reach it with
+INFERENCE_BACKEND=remote, which uses InferenceClient below.
+
+Wire protocol - every message in either direction is one frame:
+
+    !BI    code (op or status), payload length
+    ...    payload
+
+Requests use OP_INFO (empty payload, JSON reply) or OP_PREDICT (an encoded
+array of preprocessed samples, array reply). Replies carry STATUS_OK,
+STATUS_BUSY (server queue full) or STATUS_ERROR, with a UTF-8 message as the
+payload for the last two. Arrays are encoded as:
+
+    !BB    dtype code, ndim
+    !nI    shape
+    ...    C-order data
+"""
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from .batching import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+OP_INFO = 1
+OP_PREDICT = 2
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_BUSY = 2
+
+DTYPES = {1: np.dtype(np.uint8), 2: np.dtype(np.float32)}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+
+# Guards against allocating garbage lengths from a corrupt or foreign peer
+MAX_PAYLOAD_BYTES = 256 * 1024 * 1024
+
+_FRAME = struct.Struct('!BI')
+_ARRAY = struct.Struct('!BB')
+
+
+class InferenceServerUnavailable(ConnectionError):
+    """The inference server could not be reached"""
+
+
+class InferenceServerError(RuntimeError):
+    """The inference server reported an error for a request"""
+
+
+def _recv_exactly(sock, size: int) -> bytearray:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError('Connection closed by peer')
+        received += count
+    return buffer
+
+
+def send_frame(sock, code: int, payload: bytes = b''):
+    sock.sendall(_FRAME.pack(code, len(payload)) + payload)
+
+
+def recv_frame(sock):
+    """Read one frame; returns ``(code, payload)``"""
+    code, size = _FRAME.unpack(_recv_exactly(sock, _FRAME.size))
+    if size > MAX_PAYLOAD_BYTES:
+        raise ConnectionError(f'Frame of {size} bytes exceeds the {MAX_PAYLOAD_BYTES} byte limit')
+    return code, _recv_exactly(sock, size)
+
+
+def encode_array(array: np.ndarray) -> bytes:
+    array = np.ascontiguousarray(array)
+    try:
+        code = DTYPE_CODES[array.dtype]
+    except KeyError:
+        raise ValueError(f'Unsupported array dtype {array.dtype}')
+    shape = struct.pack(f'!{array.ndim}I', *array.shape)
+    return _ARRAY.pack(code, array.ndim) + shape + array.tobytes()
+
+
+def decode_array(payload) -> np.ndarray:
+    code, ndim = _ARRAY.unpack_from(payload)
+    shape = struct.unpack_from(f'!{ndim}I', payload, _ARRAY.size)
+    offset = _ARRAY.size + 4 * ndim
+    dtype = DTYPES[code]
+    if len(payload) - offset != int(np.prod(shape)) * dtype.itemsize:
+        raise ValueError('Array payload does not match its shape')
+    return np.frombuffer(payload, dtype=dtype, offset=offset).reshape(shape)
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """Serve frames on one client connection until it closes"""
+
+    def handle(self):
+        while True:
+            try:
+                op, payload = recv_frame(self.request)
+            except ConnectionError:
+                return
+            status, reply = self.server.dispatch(op, payload)
+            try:
+                send_frame(self.request, status, reply)
+            except OSError:
+                return
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serve a loaded TomatoDiseasePredictor on a Unix socket
+
+    Each client connection gets a thread; samples from all connections go
+    through the predictor's micro-batcher, so requests from different web
+    workers share forward passes.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, predictor):
+        self.socket_path = str(socket_path)
+        self.predictor = predictor
+        # A socket file left behind by a previous run would make bind() fail
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        super().__init__(self.socket_path, _RequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def info(self) -> dict:
+        backend = self.predictor.backend
+        return {
+            'backend': backend.name,
+            'version': self.predictor.model_version,
+            'accepts_uint8': backend.accepts_uint8,
+            'description': backend.describe(),
+        }
+
+    def dispatch(self, op: int, payload):
+        """Handle one request; returns ``(status, reply payload)``"""
+        try:
+            if op == OP_INFO:
+                return STATUS_OK, json.dumps(self.info()).encode()
+            if op == OP_PREDICT:
+                return STATUS_OK, encode_array(self.predictor.score(decode_array(payload)))
+            return STATUS_ERROR, f'Unknown op {op}'.encode()
+        except QueueFullError as e:
+            return STATUS_BUSY, str(e).encode()
+        except FutureTimeoutError:
+            return STATUS_ERROR, b'Prediction timed out'
+        except Exception as e:
+            logger.exception('Inference request failed')
+            return STATUS_ERROR, str(e).encode()
+
+
+class InferenceClient:
+    """Pooled, thread-safe client for InferenceServer"""
+
+    def __init__(self, socket_path: str, timeout: float = 30.0, pool_size: int = 4):
+        """
+        Args:
+            socket_path: Path of the server's Unix socket
+            timeout: Seconds allowed for connecting and for each reply
+            pool_size: Idle connections kept open for reuse
+        """
+        self.socket_path = str(socket_path)
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=max(1, int(pool_size)))
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise InferenceServerUnavailable(
+                f'Cannot connect to inference server at {self.socket_path}: {e}'
+            ) from e
+        return sock
+
+    def _call(self, op: int, payload: bytes = b''):
+        """Send one request and return ``(status, payload)`` of the reply"""
+        for attempt in range(2):
+            try:
+                sock, pooled = self._pool.get_nowait(), True
+            except queue.Empty:
+                sock, pooled = self._connect(), False
+
+            try:
+                send_frame(sock, op, payload)
+                reply = recv_frame(sock)
+            except socket.timeout:
+                # The reply may still arrive, so this connection cannot be reused
+                sock.close()
+                raise
+            except OSError as e:
+                sock.close()
+                if pooled and attempt == 0:
+                    # The server may have restarted since this connection was
+                    # pooled - drop the other pooled ones too and reconnect
+                    self.close()
+                    continue
+                raise InferenceServerUnavailable(f'Inference server connection failed: {e}') from e
+
+            try:
+                self._pool.put_nowait(sock)
+            except queue.Full:
+                sock.close()
+            return reply
+
+    def info(self) -> dict:
+        """Backend name, model version and input format of the server"""
+        status, payload = self._call(OP_INFO)
+        if status != STATUS_OK:
+            raise InferenceServerError(bytes(payload).decode(errors='replace'))
+        return json.loads(bytes(payload))
+
+    def infer_batch(self, batch: np.ndarray) -> np.ndarray:
+        """Class scores for a stacked batch of preprocessed samples"""
+        status, payload = self._call(OP_PREDICT, encode_array(batch))
+        if status == STATUS_OK:
+            return decode_array(payload)
+        message = bytes(payload).decode(errors='replace')
+        if status == STATUS_BUSY:
+            raise QueueFullError(message)
+        raise InferenceServerError(message)
+
+    def close(self):
+        """Close the pooled connections"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
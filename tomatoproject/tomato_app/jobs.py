@@ -0,0 +1,261 @@
+"""
+Database-backed background batch jobs
+
+Jobs are submitted through the API and processed by ``manage.py
+run_batch_worker``; no external broker is needed. A worker claims a job by
+taking a time-limited lease on it:
+
+- On databases with ``SELECT ... FOR UPDATE SKIP LOCKED`` (PostgreSQL) the
+  claim locks the row, so concurrent workers skip each other's jobs.
+- On SQLite, which has no row locks, the claim is a conditional UPDATE that
+  only succeeds if the job still looks the way the worker read it, so only
+  one of several racing workers wins.
+
+The lease is renewed after every batch. If a worker dies its lease expires
+and another worker picks the job up, resuming from the first pending image.
+"""
+import logging
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .analytics import record_predictions
+from .models import BatchJob, BatchJobImage, Prediction
+from .storage import store_image
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLost(RuntimeError):
+    """Raised when another worker has taken over the job being processed"""
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _lease_expiry():
+    return timezone.now() + timedelta(seconds=settings.BATCH_JOB_LEASE_SECONDS)
+
+
+def _claimable():
+    return Q(status=BatchJob.STATUS_QUEUED) | Q(
+        status=BatchJob.STATUS_RUNNING, lease_expires_at__lt=timezone.now()
+    )
+
+
+def create_job(uploaded_files) -> BatchJob:
+    """
+    Store uploaded images as a new queued BatchJob
+
+    Everything is written in one transaction, so workers never see a job
+    whose images are still being saved.
+    """
+    with transaction.atomic():
+        job = BatchJob.objects.create(total_images=len(uploaded_files))
+        images = []
+        for position, uploaded_file in enumerate(uploaded_files):
+            image = BatchJobImage(job=job, position=position, image_name=uploaded_file.name)
+            image.image.save(uploaded_file.name, uploaded_file, save=False)
+            images.append(image)
+        BatchJobImage.objects.bulk_create(images)
+    return job
+
+
+def claim_job(worker_id: str):
+    """
+    Lease the oldest claimable job to ``worker_id``
+
+    Returns:
+        The claimed BatchJob, or None if there is nothing to do
+    """
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = (BatchJob.objects.select_for_update(skip_locked=True)
+                   .filter(_claimable()).order_by('created_at').first())
+            if job is None:
+                return None
+            job.status = BatchJob.STATUS_RUNNING
+            job.worker = worker_id
+            job.lease_expires_at = _lease_expiry()
+            job.started_at = job.started_at or timezone.now()
+            job.attempts += 1
+            job.save(update_fields=['status', 'worker', 'lease_expires_at', 'started_at', 'attempts'])
+            return job
+
+    # No row locks - compare-and-swap on the fields read, so a job that
+    # another worker claimed in the meantime no longer matches
+    candidates = BatchJob.objects.filter(_claimable()).order_by('created_at')[:10]
+    for candidate in candidates:
+        claimed = BatchJob.objects.filter(
+            pk=candidate.pk,
+            status=candidate.status,
+            worker=candidate.worker,
+            lease_expires_at=candidate.lease_expires_at,
+        ).update(
+            status=BatchJob.STATUS_RUNNING,
+            worker=worker_id,
+            lease_expires_at=_lease_expiry(),
+            started_at=candidate.started_at or timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return BatchJob.objects.get(pk=candidate.pk)
+    return None
+
+
+def _owned(job: BatchJob, worker_id: str):
+    """Queryset matching ``job`` only while ``worker_id`` still holds its lease"""
+    return BatchJob.objects.filter(pk=job.pk, worker=worker_id, status=BatchJob.STATUS_RUNNING)
+
+
+def release_job(job: BatchJob, worker_id: str):
+    """Hand a job back to the queue, e.g. when the worker shuts down"""
+    _owned(job, worker_id).update(status=BatchJob.STATUS_QUEUED, worker='', lease_expires_at=None)
+
+
+def _finish(job: BatchJob, worker_id: str, status: str, error: str = ''):
+    finished = _owned(job, worker_id).update(
+        status=status, error=error, finished_at=timezone.now(), lease_expires_at=None
+    )
+    if finished:
+        _delete_uploads(job)
+
+
+def _delete_uploads(job: BatchJob):
+    """Remove a finished job's uploaded files; its predictions keep compacted copies"""
+    storage = BatchJobImage._meta.get_field('image').storage
+    directories = set()
+    for name in job.images.exclude(image='').values_list('image', flat=True):
+        directories.add(os.path.dirname(name))
+        try:
+            storage.delete(name)
+        except OSError as e:
+            logger.warning("Could not delete %s: %s", name, e)
+    job.images.update(image='')
+
+    for directory in directories:
+        try:
+            os.rmdir(storage.path(directory))
+        except (NotImplementedError, OSError):
+            # Not a local filesystem, or not empty
+            pass
+
+
+def _process_batch(job: BatchJob, worker_id: str, images: list):
+    from .ml_model import predictor
+
+    files = [image.image for image in images]
+    try:
+        results = predictor.predict_uploads(files)
+    finally:
+        for file in files:
+            file.close()
+
+    predictions = []
+    failed = 0
+    for image, result in zip(images, results):
+        if result.get('success'):
+            image.status = BatchJobImage.STATUS_DONE
+            image.prediction = result['predicted_class']
+            image.confidence = result['confidence']
+            image.result = result
+            # Compacted outside the transaction below; if it rolls back the
+            # reference count is left one too high, which is safe
+            with image.image.open('rb') as f:
+                stored = store_image(f.read())
+            predictions.append(Prediction(
+                image=stored.path,
+                stored_image=stored,
+                image_name=image.image_name,
+                prediction=result['predicted_class'],
+                confidence=result['confidence'],
+            ))
+        else:
+            image.status = BatchJobImage.STATUS_FAILED
+            image.error = str(result.get('error', 'Prediction failed'))
+            failed += 1
+
+    with transaction.atomic():
+        # Renewing the lease in the same transaction makes the whole batch
+        # roll back if another worker has taken the job over
+        renewed = _owned(job, worker_id).update(
+            lease_expires_at=_lease_expiry(),
+            processed_images=F('processed_images') + len(images),
+            failed_images=F('failed_images') + failed,
+        )
+        if not renewed:
+            raise LeaseLost(f"Lost the lease on job {job.pk}")
+        BatchJobImage.objects.bulk_update(images, ['status', 'prediction', 'confidence', 'result', 'error'])
+        Prediction.objects.bulk_create(predictions)
+        record_predictions(predictions)
+
+
+def process_job(job: BatchJob, worker_id: str, batch_size: int = None, should_stop=lambda: False) -> str:
+    """
+    Predict a claimed job's pending images in batches, recording progress
+
+    Args:
+        job: BatchJob leased to ``worker_id``
+        worker_id: Lease owner
+        batch_size: Images per batch (default: INFERENCE_BATCH_CHUNK_SIZE)
+        should_stop: Checked between batches; when it returns True the job
+            is handed back to the queue
+
+    Returns:
+        The job's status afterwards
+    """
+    batch_size = max(1, batch_size or settings.INFERENCE_BATCH_CHUNK_SIZE)
+    pending = job.images.filter(status=BatchJobImage.STATUS_PENDING).order_by('position')
+    try:
+        while True:
+            if should_stop():
+                release_job(job, worker_id)
+                return BatchJob.STATUS_QUEUED
+
+            job.refresh_from_db(fields=['cancel_requested'])
+            if job.cancel_requested:
+                _finish(job, worker_id, BatchJob.STATUS_CANCELLED)
+                return BatchJob.STATUS_CANCELLED
+
+            images = list(pending[:batch_size])
+            if not images:
+                _finish(job, worker_id, BatchJob.STATUS_COMPLETED)
+                return BatchJob.STATUS_COMPLETED
+
+            _process_batch(job, worker_id, images)
+
+    except LeaseLost:
+        logger.warning("Job %s was taken over by another worker", job.pk)
+        return BatchJob.STATUS_RUNNING
+    except Exception as e:
+        logger.exception("Job %s failed on attempt %d", job.pk, job.attempts)
+        if job.attempts >= settings.BATCH_JOB_MAX_ATTEMPTS:
+            _finish(job, worker_id, BatchJob.STATUS_FAILED, error=str(e))
+            return BatchJob.STATUS_FAILED
+        _owned(job, worker_id).update(status=BatchJob.STATUS_QUEUED, worker='',
+                                      lease_expires_at=None, error=str(e))
+        return BatchJob.STATUS_QUEUED
+
+
+def cancel_job(job: BatchJob) -> BatchJob:
+    """
+    Cancel a job: queued jobs stop at once, running ones after their current batch
+
+    Returns:
+        The job, refreshed from the database
+    """
+    cancelled = BatchJob.objects.filter(pk=job.pk, status=BatchJob.STATUS_QUEUED).update(
+        status=BatchJob.STATUS_CANCELLED, cancel_requested=True, finished_at=timezone.now()
+    )
+    if cancelled:
+        _delete_uploads(job)
+    else:
+        BatchJob.objects.filter(pk=job.pk, status=BatchJob.STATUS_RUNNING).update(cancel_requested=True)
+    job.refresh_from_db()
+    return job
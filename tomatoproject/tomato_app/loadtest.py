@@ -0,0 +1,203 @@
+"""
+HTTP load generation against a running server
+
+Requests are multipart uploads built from raw bytes, sent with urllib from
+a pool of client threads. Two arrival models are supported:
+
+- Closed loop: a fixed number of clients, each sending its next request as
+  soon as the previous one answers. Throughput adapts to the server.
+- Open loop: requests arrive at a fixed average rate (Poisson arrivals)
+  whether or not earlier ones have finished. Latency is measured from each
+  request's scheduled arrival, so time spent waiting for a free client is
+  counted rather than hidden (no coordinated omission).
+"""
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+def multipart_body(files):
+    """
+    Encode file fields as multipart/form-data
+
+    Args:
+        files: ``(field name, filename, bytes)`` tuples; repeat a field name
+            to send several files under it
+
+    Returns:
+        ``(body, content_type)``
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, filename, data in files:
+        parts.append((
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            'Content-Type: image/jpeg\r\n\r\n'
+        ).encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def fetch_csrf_token(base_url: str) -> str:
+    """Fetch a CSRF cookie from a page that sets one"""
+    with urllib.request.urlopen(f'{base_url}/client-side-upload/') as response:
+        for header in response.headers.get_all('Set-Cookie') or []:
+            name, _, rest = header.partition('=')
+            if name.strip() == 'csrftoken':
+                return rest.split(';', 1)[0]
+    raise RuntimeError('Server did not set a csrftoken cookie')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects instead of following them - upload views redirect on errors"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+@dataclass
+class Endpoint:
+    """An upload endpoint and how to build a request for it"""
+    path: str
+    field: str = 'image'
+    files_per_request: int = 1
+    weight: float = 1.0
+
+
+@dataclass
+class EndpointStats:
+    latencies: list = field(default_factory=list)
+    statuses: dict = field(default_factory=lambda: defaultdict(int))
+
+    def summary(self, wall: float) -> dict:
+        total = sum(self.statuses.values())
+        ok = sum(count for status, count in self.statuses.items() if isinstance(status, int) and status < 300)
+        ms = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            'requests': total,
+            'ok': ok,
+            'error_rate': (total - ok) / total if total else 0.0,
+            'rps': ok / wall if wall else 0.0,
+            'p50_ms': float(np.percentile(ms, 50)),
+            'p90_ms': float(np.percentile(ms, 90)),
+            'p95_ms': float(np.percentile(ms, 95)),
+            'p99_ms': float(np.percentile(ms, 99)),
+            'max_ms': float(ms.max()),
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items(), key=str)},
+        }
+
+
+class LoadGenerator:
+    """Drive a mix of upload endpoints on one server and collect per-endpoint statistics"""
+
+    def __init__(self, base_url: str, endpoints: list, corpus: list, csrf_token: str,
+                 defeat_cache: bool = True, timeout: float = 60.0, seed: int = 0):
+        """
+        Args:
+            base_url: Server URL without a trailing slash
+            endpoints: Endpoint objects; requests are spread by their weights
+            corpus: Image bytes to upload, sampled at random
+            csrf_token: Sent as both cookie and header
+            defeat_cache: Append random bytes after the image data so the
+                prediction cache never hits (decoders ignore trailing bytes)
+            timeout: Per-request timeout in seconds
+            seed: Seed for endpoint and image choice
+        """
+        self.base_url = base_url
+        self.endpoints = endpoints
+        self.corpus = corpus
+        self.csrf_token = csrf_token
+        self.defeat_cache = defeat_cache
+        self.timeout = timeout
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._stats = defaultdict(EndpointStats)
+        self._stats_lock = threading.Lock()
+
+    def _next_request(self):
+        with self._rng_lock:
+            endpoint = self._rng.choices(self.endpoints, weights=[e.weight for e in self.endpoints])[0]
+            images = [self._rng.choice(self.corpus) for _ in range(endpoint.files_per_request)]
+        if self.defeat_cache:
+            images = [data + os.urandom(16) for data in images]
+        body, content_type = multipart_body(
+            [(endpoint.field, f'leaf{i}.jpg', data) for i, data in enumerate(images)]
+        )
+        request = urllib.request.Request(
+            f'{self.base_url}/{endpoint.path}', data=body, method='POST',
+            headers={'Content-Type': content_type, 'X-CSRFToken': self.csrf_token,
+                     'Cookie': f'csrftoken={self.csrf_token}', 'Referer': f'{self.base_url}/'},
+        )
+        return endpoint, request
+
+    def _send(self, endpoint: Endpoint, request, started: float):
+        try:
+            with _opener.open(request, timeout=self.timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            stats = self._stats[endpoint.path]
+            stats.statuses[status] += 1
+            if isinstance(status, int) and status < 300:
+                stats.latencies.append(elapsed)
+
+    def run_closed(self, concurrency: int, duration: float) -> dict:
+        """``concurrency`` clients send back-to-back requests for ``duration`` seconds"""
+        deadline = time.perf_counter() + duration
+
+        def client():
+            while time.perf_counter() < deadline:
+                endpoint, request = self._next_request()
+                self._send(endpoint, request, time.perf_counter())
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self._report(time.perf_counter() - start)
+
+    def run_open(self, rate: float, duration: float, max_in_flight: int) -> dict:
+        """Poisson arrivals at ``rate`` requests/s for ``duration`` seconds, up to ``max_in_flight`` at once"""
+        arrivals = random.Random(self._rng.random())
+        start = time.perf_counter()
+        scheduled = start
+        with ThreadPoolExecutor(max_in_flight, thread_name_prefix='loadtest') as pool:
+            while True:
+                scheduled += arrivals.expovariate(rate)
+                if scheduled - start >= duration:
+                    break
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                endpoint, request = self._next_request()
+                # Latency counts from the scheduled arrival, including any wait for a free thread
+                pool.submit(self._send, endpoint, request, scheduled)
+        return self._report(time.perf_counter() - start)
+
+    def _report(self, wall: float) -> dict:
+        with self._stats_lock:
+            stats, self._stats = self._stats, defaultdict(EndpointStats)
+        return {
+            'wall_seconds': wall,
+            'endpoints': {path: endpoint_stats.summary(wall) for path, endpoint_stats in stats.items()},
+        }
@@ -0,0 +1,108 @@
+"""
+Closed-loop concurrency benchmark for the sync and async prediction APIs
+"""
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tomato_app.datasets import labelled_images
+from tomato_app.loadtest import fetch_csrf_token, multipart_body
+
+
+class Command(BaseCommand):
+    help = ('Drive a running server with N concurrent clients and compare throughput, latency '
+            'and rejections of api/predict/ (WSGI or ASGI) and api/predict/async/')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='Server base URL')
+        parser.add_argument('--endpoints', default='api/predict/,api/predict/async/',
+                            help='Comma-separated endpoint paths to compare')
+        parser.add_argument('--concurrency', default='1,8,32,64',
+                            help='Comma-separated client counts (default: 1,8,32,64)')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per endpoint and concurrency level (default: 200)')
+        parser.add_argument('--image', help='JPEG to upload (default: a data_split/test image)')
+        parser.add_argument('--allow-cache-hits', action='store_true',
+                            help='Upload identical bytes every time instead of defeating the prediction cache')
+
+    def handle(self, *args, **options):
+        base_url = options['url'].rstrip('/')
+        if options['image']:
+            image_path = Path(options['image'])
+        else:
+            samples = labelled_images('test', per_class=1)
+            image_path = samples[0][0] if samples else \
+                Path(settings.INFERENCE_WARMUP_IMAGES_DIR) / 'healthy.jpg'
+        image = image_path.read_bytes()
+        try:
+            token = fetch_csrf_token(base_url)
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"Uploading {image_path.name} ({len(image) / 1024:.0f} KiB) to {base_url}")
+        self.stdout.write(f"\n{'endpoint':<22}{'clients':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+                          f"{'p99 ms':>9}{'ok':>6}{'429':>6}{'503':>6}{'other':>7}")
+        for endpoint in filter(None, options['endpoints'].split(',')):
+            for clients in (int(c) for c in options['concurrency'].split(',')):
+                self._run_level(base_url, endpoint.strip().lstrip('/'), clients,
+                                options['requests'], image, token, options['allow_cache_hits'])
+
+    def _run_level(self, base_url, endpoint, clients, total, image, token, allow_cache_hits):
+        latencies = []
+        statuses = Counter()
+        lock = threading.Lock()
+        remaining = [total]
+
+        def client():
+            while True:
+                with lock:
+                    if remaining[0] == 0:
+                        return
+                    remaining[0] -= 1
+                # Trailing bytes after the JPEG end marker are ignored by the
+                # decoder but change the content hash, so the cache misses
+                data = image if allow_cache_hits else image + os.urandom(16)
+                body, content_type = multipart_body([('image', 'leaf.jpg', data)])
+                request = urllib.request.Request(
+                    f'{base_url}/{endpoint}', data=body, method='POST',
+                    headers={'Content-Type': content_type, 'X-CSRFToken': token,
+                             'Cookie': f'csrftoken={token}'},
+                )
+                start = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(request) as response:
+                        response.read()
+                        status = response.status
+                except urllib.error.HTTPError as e:
+                    status = e.code
+                except OSError:
+                    status = 'error'
+                elapsed = time.perf_counter() - start
+                with lock:
+                    statuses[status] += 1
+                    if status == 200:
+                        latencies.append(elapsed)
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+
+        ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+        other = total - statuses[200] - statuses[429] - statuses[503]
+        self.stdout.write(
+            f"{endpoint:<22}{clients:>8}{statuses[200] / wall:>9.1f}{np.percentile(ms, 50):>9.1f}"
+            f"{np.percentile(ms, 95):>9.1f}{np.percentile(ms, 99):>9.1f}{statuses[200]:>6}"
+            f"{statuses[429]:>6}{statuses[503]:>6}{other:>7}"
+        )
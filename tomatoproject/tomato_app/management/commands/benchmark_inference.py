@@ -0,0 +1,251 @@
+"""
+Offline inference benchmark: latency and throughput across backends, batch sizes and thread counts
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tomato_app.datasets import labelled_images
+from tomato_app.preprocessing import load_image, to_model_input
+
+# Backend -> environment variable sizing its intra-op thread pool. Thread
+# pools can only be sized before a runtime starts, so every (backend,
+# threads) pair is measured in its own process.
+THREAD_SETTINGS = {
+    'keras': 'TF_INTRA_OP_THREADS',
+    'tflite_int8': 'TFLITE_NUM_THREADS',
+    'onnx': 'ONNX_INTRA_OP_THREADS',
+}
+
+
+def _percentiles(timings_ms) -> dict:
+    timings = np.asarray(timings_ms)
+    return {
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'p99_ms': float(np.percentile(timings, 99)),
+    }
+
+
+def _csv_ints(value: str) -> list:
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """
+    Match results on (backend, batch size, threads) and flag throughput regressions
+
+    Returns:
+        One dict per configuration present in both runs, with ``change``
+        (fractional throughput change) and ``regressed``
+    """
+    def key(row):
+        return row['backend'], row['batch_size'], row['threads']
+
+    before = {key(row): row for row in baseline['results']}
+    rows = []
+    for row in current['results']:
+        old = before.get(key(row))
+        if old is None:
+            continue
+        change = row['images_per_second'] / old['images_per_second'] - 1
+        rows.append(dict(zip(('backend', 'batch_size', 'threads'), key(row)),
+                         baseline=old['images_per_second'], current=row['images_per_second'],
+                         change=change, regressed=change < -threshold))
+    return rows
+
+
+class Command(BaseCommand):
+    help = ('Benchmark TomatoDiseasePredictor preprocessing and inference on data_split images: '
+            'p50/p95/p99 latency and images/s per backend, batch size and intra-op thread count, as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', default=None,
+                            help='Comma-separated backends (default: INFERENCE_BACKEND)')
+        parser.add_argument('--batch-sizes', default='1,8,32', help='Comma-separated batch sizes (default: 1,8,32)')
+        parser.add_argument('--threads', default='0',
+                            help='Comma-separated intra-op thread counts; 0 is the runtime default (default: 0)')
+        parser.add_argument('--split', default='test', help='Data split to take images from (default: test)')
+        parser.add_argument('--per-class', type=int, default=8, help='Images per class (default: 8)')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed batches per configuration (default: 50)')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed batches per configuration (default: 3)')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--compare', help='Baseline JSON report to compare throughput against')
+        parser.add_argument('--threshold', type=float, default=0.10,
+                            help='Fail --compare when throughput drops by more than this fraction (default: 0.10)')
+        # Internal: measure a single backend/threads pair and write raw results
+        parser.add_argument('--child-output', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        backends = (options['backends'] or settings.INFERENCE_BACKEND).split(',')
+        batch_sizes = _csv_ints(options['batch_sizes'])
+        threads = _csv_ints(options['threads'])
+        if not batch_sizes or not threads:
+            raise CommandError('--batch-sizes and --threads need at least one value')
+
+        if options['child_output']:
+            results = self._measure(backends[0], threads[0], batch_sizes, options)
+            Path(options['child_output']).write_text(json.dumps(results))
+            return
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'config': {
+                'split': options['split'],
+                'per_class': options['per_class'],
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+            },
+            'preprocessing': self._measure_preprocessing(options),
+            'results': [],
+        }
+        for backend in backends:
+            # Thread counts are set by the inference server for the remote backend
+            for thread_count in (threads if backend in THREAD_SETTINGS else [0]):
+                self.stderr.write(f"Measuring {backend} with threads={thread_count or 'default'}...")
+                report['results'].extend(self._run_child(backend, thread_count, options))
+
+        self._print_table(report)
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(text)
+            self.stderr.write(f"Wrote {options['output']}")
+        else:
+            self.stdout.write(text)
+
+        if options['compare']:
+            self._compare(report, options['compare'], options['threshold'])
+
+    def _images(self, options) -> list:
+        try:
+            samples = labelled_images(options['split'], per_class=options['per_class'])
+        except FileNotFoundError as e:
+            raise CommandError(str(e))
+        if not samples:
+            raise CommandError(f"No images found in data_split/{options['split']}")
+        return [path.read_bytes() for path, _ in samples]
+
+    def _measure_preprocessing(self, options) -> dict:
+        """Decode + resize + normalize time per image, from bytes in memory"""
+        encoded = self._images(options)
+        timings = []
+        for data in encoded:
+            start = time.perf_counter()
+            to_model_input(load_image(io.BytesIO(data)))
+            timings.append((time.perf_counter() - start) * 1000)
+        return dict(_percentiles(timings), images=len(encoded),
+                    images_per_second=len(encoded) / (sum(timings) / 1000))
+
+    def _run_child(self, backend: str, thread_count: int, options) -> list:
+        env = dict(os.environ)
+        if backend in THREAD_SETTINGS:
+            env[THREAD_SETTINGS[backend]] = str(thread_count)
+        # Measure the backend alone: no background load, no micro-batcher
+        env.update(MODEL_LOAD_ON_STARTUP='False', INFERENCE_BATCHING='False')
+        with tempfile.NamedTemporaryFile(suffix='.json') as out:
+            command = [
+                sys.executable, 'manage.py', 'benchmark_inference',
+                '--backends', backend, '--threads', str(thread_count),
+                '--batch-sizes', ','.join(map(str, _csv_ints(options['batch_sizes']))),
+                '--split', options['split'], '--per-class', str(options['per_class']),
+                '--iterations', str(options['iterations']), '--warmup', str(options['warmup']),
+                '--child-output', out.name,
+            ]
+            completed = subprocess.run(command, env=env, cwd=settings.BASE_DIR)
+            if completed.returncode != 0:
+                raise CommandError(f"Benchmark of {backend} (threads={thread_count}) failed")
+            return json.loads(Path(out.name).read_text())
+
+    def _measure(self, backend_name: str, thread_count: int, batch_sizes: list, options) -> list:
+        from tomato_app.ml_model import predictor
+
+        predictor.load_model(backend_name)
+        if not predictor.is_loaded:
+            raise CommandError(f"Could not load the {backend_name} backend")
+        backend = predictor.backend
+
+        # Inference inputs exactly as the predictor builds them
+        samples = [predictor.preprocess(load_image(io.BytesIO(data))) for data in self._images(options)]
+        if backend.accepts_uint8:
+            # Raw inputs keep their decoded size; batch only same-shaped images
+            shape = max({s.shape for s in samples}, key=lambda sh: sum(s.shape == sh for s in samples))
+            samples = [s for s in samples if s.shape == shape]
+
+        results = []
+        for batch_size in batch_sizes:
+            # Cycle through the images so every batch is full and different
+            batches = [
+                np.stack([samples[(i * batch_size + j) % len(samples)] for j in range(batch_size)])
+                for i in range(options['warmup'] + options['iterations'])
+            ]
+            for batch in batches[:options['warmup']]:
+                backend.infer_batch(batch)
+
+            timings = []
+            for batch in batches[options['warmup']:]:
+                start = time.perf_counter()
+                backend.infer_batch(batch)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            stats = _percentiles(timings)
+            results.append(dict(
+                backend=backend_name,
+                model_version=predictor.model_version,
+                batch_size=batch_size,
+                threads=thread_count,
+                iterations=len(timings),
+                images_per_second=batch_size * len(timings) / (sum(timings) / 1000),
+                **stats,
+            ))
+        return results
+
+    def _print_table(self, report):
+        pre = report['preprocessing']
+        self.stderr.write(f"\npreprocessing: {pre['p50_ms']:.2f} ms/image p50, {pre['p99_ms']:.2f} ms p99 "
+                          f"({pre['images_per_second']:.0f} images/s on one thread)")
+        self.stderr.write(f"\n{'backend':<14}{'batch':>6}{'threads':>8}{'p50 ms':>9}{'p95 ms':>9}"
+                          f"{'p99 ms':>9}{'img/s':>9}")
+        for row in report['results']:
+            self.stderr.write(
+                f"{row['backend']:<14}{row['batch_size']:>6}{row['threads'] or 'auto':>8}{row['p50_ms']:>9.2f}"
+                f"{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}{row['images_per_second']:>9.1f}"
+            )
+
+    def _compare(self, report, baseline_path, threshold):
+        try:
+            baseline = json.loads(Path(baseline_path).read_text())
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read baseline {baseline_path}: {e}")
+
+        rows = compare(baseline, report, threshold)
+        if not rows:
+            raise CommandError('No configuration in common with the baseline')
+        self.stderr.write(f"\n{'backend':<14}{'batch':>6}{'threads':>8}{'baseline':>10}{'current':>10}{'change':>9}")
+        for row in rows:
+            line = (f"{row['backend']:<14}{row['batch_size']:>6}{row['threads'] or 'auto':>8}"
+                    f"{row['baseline']:>10.1f}{row['current']:>10.1f}{row['change']:>+9.1%}")
+            self.stderr.write(self.style.ERROR(line) if row['regressed'] else line)
+
+        regressed = [row for row in rows if row['regressed']]
+        if regressed:
+            raise CommandError(f"{len(regressed)} configuration(s) lost more than {threshold:.0%} throughput")
+        self.stderr.write(self.style.SUCCESS(f"No throughput regression beyond {threshold:.0%}"))
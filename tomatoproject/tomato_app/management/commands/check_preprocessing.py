@@ -0,0 +1,106 @@
+"""
+Accuracy guard and micro-benchmark for the image preprocessing settings
+"""
+import io
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from tomato_app.datasets import labelled_images
+from tomato_app.preprocessing import MODEL_INPUT_SIZE, load_image, resize_image
+
+
+def _phone_sized_jpeg(path, megapixels: float) -> bytes:
+    """Upscale a data_split image to roughly ``megapixels`` and encode it as a JPEG"""
+    img = Image.open(path).convert('RGB')
+    scale = (megapixels * 1e6 / (img.width * img.height)) ** 0.5
+    if scale > 1:
+        img = img.resize((round(img.width * scale), round(img.height * scale)), Image.Resampling.BICUBIC)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def _baseline(data: bytes) -> Image.Image:
+    """The original pipeline: full decode followed by Image.resize defaults"""
+    return Image.open(io.BytesIO(data)).convert('RGB').resize(MODEL_INPUT_SIZE)
+
+
+def _configured(data: bytes) -> Image.Image:
+    """The pipeline as configured by IMAGE_JPEG_DRAFT / IMAGE_RESAMPLE_FILTER / IMAGE_REDUCING_GAP"""
+    return resize_image(load_image(io.BytesIO(data)))
+
+
+class Command(BaseCommand):
+    help = ('Check that the configured decode/resize pipeline does not change predictions on '
+            'data_split/test, and time decode+resize per megapixel against the full-decode baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-class', type=int, default=10,
+                            help='Test images sampled per class (default: 10)')
+        parser.add_argument('--megapixels', type=float, default=12.0,
+                            help='Upscale test images to this size to mimic phone photos (default: 12)')
+        parser.add_argument('--min-agreement', type=float, default=0.99,
+                            help='Fail if fewer predictions than this fraction match the baseline (default: 0.99)')
+        parser.add_argument('--skip-accuracy', action='store_true',
+                            help='Only run the micro-benchmark (no model needed)')
+
+    def handle(self, *args, **options):
+        samples = labelled_images('test', per_class=options['per_class'])
+        self.stdout.write(
+            f"Preparing {len(samples)} ~{options['megapixels']:g} MP JPEGs from data_split/test "
+            f"(draft={settings.IMAGE_JPEG_DRAFT}, resample={settings.IMAGE_RESAMPLE_FILTER}, "
+            f"reducing_gap={settings.IMAGE_REDUCING_GAP or 'off'})"
+        )
+        encoded = [_phone_sized_jpeg(path, options['megapixels']) for path, _ in samples]
+        total_megapixels = sum(
+            np.prod(Image.open(io.BytesIO(data)).size) / 1e6 for data in encoded
+        )
+
+        timings = {}
+        images = {}
+        for label, pipeline in (('baseline', _baseline), ('configured', _configured)):
+            start = time.perf_counter()
+            images[label] = [pipeline(data) for data in encoded]
+            timings[label] = time.perf_counter() - start
+
+        self.stdout.write(f"\n{'pipeline':<12}{'ms/image':>10}{'ms/MP':>10}")
+        for label, seconds in timings.items():
+            self.stdout.write(
+                f"{label:<12}{seconds / len(encoded) * 1000:>10.2f}{seconds / total_megapixels * 1000:>10.2f}"
+            )
+        self.stdout.write(f"Speed-up: {timings['baseline'] / timings['configured']:.1f}x")
+
+        if options['skip_accuracy']:
+            return
+
+        from tomato_app.ml_model import predictor
+
+        if not predictor.ensure_loaded():
+            raise CommandError('Model not loaded - use --skip-accuracy to only run the benchmark')
+
+        class_names = predictor.class_names
+        labels = np.array([class_names.index(name) for _, name in samples])
+        chunk_size = max(1, settings.INFERENCE_BATCH_CHUNK_SIZE)
+        preds = {}
+        for label, imgs in images.items():
+            # The arrays the served model takes: uint8 with INFERENCE_GRAPH_PREPROCESSING, float32 otherwise
+            batch = np.stack([predictor.preprocess(img) for img in imgs])
+            scores = np.concatenate([
+                predictor.score(batch[i:i + chunk_size]) for i in range(0, len(batch), chunk_size)
+            ])
+            preds[label] = np.argmax(scores, axis=1)
+
+        agreement = float(np.mean(preds['baseline'] == preds['configured']))
+        self.stdout.write(f"\nAccuracy (baseline):   {np.mean(preds['baseline'] == labels):.4f}")
+        self.stdout.write(f"Accuracy (configured): {np.mean(preds['configured'] == labels):.4f}")
+        self.stdout.write(f"Prediction agreement:  {agreement:.4f}")
+
+        if agreement < options['min_agreement']:
+            raise CommandError(
+                f"Predictions drifted: agreement {agreement:.4f} is below {options['min_agreement']:.4f}"
+            )
+        self.stdout.write(self.style.SUCCESS('Preprocessing accuracy guard passed'))
@@ -0,0 +1,61 @@
+"""
+Move existing prediction images into the content-addressed store
+"""
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from tomato_app.models import BatchJobImage, Prediction
+from tomato_app.storage import store_image
+
+
+class Command(BaseCommand):
+    help = ('Compact and deduplicate prediction images saved before content-addressed storage, '
+            'deleting the original files once nothing references them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Predictions per query (default: 200)')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be migrated without writing')
+
+    def handle(self, *args, **options):
+        legacy = (Prediction.objects.filter(stored_image__isnull=True)
+                  .exclude(image='').exclude(image__isnull=True).order_by('pk'))
+        total = legacy.count()
+        self.stdout.write(f"{total} predictions reference legacy image files")
+        if options['dry_run'] or not total:
+            return
+
+        migrated = missing = 0
+        bytes_before = bytes_after = 0
+        last_pk = 0
+        while True:
+            batch = list(legacy.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            for prediction in batch:
+                old_name = prediction.image.name
+                if not default_storage.exists(old_name):
+                    missing += 1
+                    continue
+                with default_storage.open(old_name, 'rb') as f:
+                    data = f.read()
+                stored = store_image(data)
+                Prediction.objects.filter(pk=prediction.pk).update(stored_image=stored, image=stored.path)
+                migrated += 1
+                bytes_before += len(data)
+
+                still_used = (Prediction.objects.filter(image=old_name).exists()
+                              or BatchJobImage.objects.filter(image=old_name).exists())
+                if not still_used and old_name != stored.path:
+                    default_storage.delete(old_name)
+
+        for path in set(Prediction.objects.filter(stored_image__isnull=False)
+                        .values_list('stored_image__path', flat=True)):
+            if default_storage.exists(path):
+                bytes_after += default_storage.size(path)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Migrated {migrated} predictions ({missing} missing files skipped); "
+            f"legacy files {bytes_before / 1024 / 1024:.1f} MiB, "
+            f"content-addressed store now {bytes_after / 1024 / 1024:.1f} MiB"
+        ))
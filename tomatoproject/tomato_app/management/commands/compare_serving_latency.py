@@ -0,0 +1,83 @@
+"""
+Compare single-image latency of Keras model.predict against the compiled serving function
+"""
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from tomato_app.backends import KerasBackend
+from tomato_app.datasets import labelled_images
+from tomato_app.preprocessing import load_image, to_model_input
+
+
+def _summarize(timings_ms):
+    timings = np.asarray(timings_ms)
+    return {
+        'mean': float(timings.mean()),
+        'p50': float(np.percentile(timings, 50)),
+        'p95': float(np.percentile(timings, 95)),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare model.predict and the traced serving function on images from data_split/test'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=100,
+                            help='Number of test images to time (default: 100)')
+        parser.add_argument('--split', default='test',
+                            help='Data split to sample images from (default: test)')
+        parser.add_argument('--xla', action='store_true',
+                            help='Also time the serving function compiled with XLA')
+
+    def handle(self, *args, **options):
+        backend = KerasBackend(serving_function=False)
+        try:
+            backend.load()
+        except Exception as e:
+            raise CommandError(f'Model not loaded: {e}')
+
+        per_class = max(1, options['images'] // 10)
+        paths = [path for path, _ in labelled_images(options['split'], per_class=per_class)]
+        samples = [
+            np.expand_dims(to_model_input(load_image(p)), axis=0)
+            for p in paths
+        ]
+        self.stdout.write(f"Timing {len(samples)} single-image predictions from data_split/{options['split']}")
+
+        modes = [('model.predict', None), ('serving function', False)]
+        if options['xla']:
+            modes.append(('serving function (XLA)', True))
+
+        rows = []
+        for label, jit_compile in modes:
+            if jit_compile is None:
+                run = lambda batch: backend.model.predict(batch, verbose=0)
+            else:
+                serve = backend.build_serving_fn(jit_compile=jit_compile)
+                run = lambda batch, serve=serve: serve(batch).numpy()
+
+            # First call includes tracing / compilation for a fresh function
+            start = time.perf_counter()
+            run(samples[0])
+            first_ms = (time.perf_counter() - start) * 1000
+
+            timings = []
+            for batch in samples:
+                start = time.perf_counter()
+                run(batch)
+                timings.append((time.perf_counter() - start) * 1000)
+            rows.append((label, first_ms, _summarize(timings)))
+
+        self.stdout.write(f"\n{'mode':<26}{'first call':>12}{'mean':>10}{'p50':>10}{'p95':>10}   (ms)")
+        for label, first_ms, stats in rows:
+            self.stdout.write(
+                f"{label:<26}{first_ms:>12.2f}{stats['mean']:>10.2f}{stats['p50']:>10.2f}{stats['p95']:>10.2f}"
+            )
+
+        baseline = rows[0][2]['p50']
+        for label, _, stats in rows[1:]:
+            self.stdout.write(self.style.SUCCESS(
+                f"{label}: {baseline / stats['p50']:.1f}x faster than model.predict at p50"
+            ))
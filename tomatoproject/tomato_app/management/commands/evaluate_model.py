@@ -0,0 +1,176 @@
+"""
+Evaluate the active backend on a labelled data split and store the metrics
+"""
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from tomato_app.datasets import labelled_images
+from tomato_app.evaluation import confusion_matrix, forget_cached, summarize
+from tomato_app.models import ModelEvaluation
+from tomato_app.preprocessing import load_image
+
+
+def _tf_batches(paths, decode, batch_size: int):
+    """
+    Decode with a tf.data pipeline: parallel map and prefetch
+
+    Decoding goes through ``decode`` (the serving preprocessing) inside
+    ``tf.numpy_function``, so the metrics describe exactly what the app serves.
+    """
+    import tensorflow as tf
+
+    dtype = tf.as_dtype(decode(str(paths[0])).dtype)
+    dataset = tf.data.Dataset.from_tensor_slices([str(p) for p in paths])
+    dataset = dataset.map(
+        lambda path: tf.numpy_function(lambda p: decode(p.decode()), [path], dtype),
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=True,
+    )
+    # Batched here rather than by tf.data: raw uint8 inputs keep their decoded size
+    samples = dataset.prefetch(2 * batch_size).as_numpy_iterator()
+    while True:
+        batch = list(islice(samples, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _threaded_batches(paths, decode, batch_size: int, threads: int, prefetch: int = 2):
+    """Decode on a thread pool, keeping ``prefetch`` batches ahead of inference"""
+    with ThreadPoolExecutor(threads, thread_name_prefix='evaluate-decode') as pool:
+        pending = deque()
+        for start in range(0, len(paths), batch_size):
+            pending.append([pool.submit(decode, str(p)) for p in paths[start:start + batch_size]])
+            if len(pending) > prefetch:
+                yield [future.result() for future in pending.popleft()]
+        while pending:
+            yield [future.result() for future in pending.popleft()]
+
+
+def _score(backend, samples: list) -> np.ndarray:
+    """Class scores for decoded samples, one forward pass per input shape like ``predict_batch``"""
+    groups = {}  # shape -> indices
+    for i, sample in enumerate(samples):
+        groups.setdefault(sample.shape, []).append(i)
+    scores = [None] * len(samples)
+    for indices in groups.values():
+        for i, row in zip(indices, backend.infer_batch(np.stack([samples[i] for i in indices]))):
+            scores[i] = row
+    return np.stack(scores)
+
+
+class Command(BaseCommand):
+    help = ('Evaluate the active inference backend on data_split/test: confusion matrix, '
+            'per-class precision/recall/F1 and throughput, stored for the model performance page')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--split', default='test', help='Data split to evaluate on (default: test)')
+        parser.add_argument('--backend', help='Backend to evaluate (default: INFERENCE_BACKEND)')
+        parser.add_argument('--batch-size', type=int, default=32, help='Images per forward pass (default: 32)')
+        parser.add_argument('--per-class', type=int, help='Cap images per class, for a quick run')
+        parser.add_argument('--pipeline', choices=['auto', 'tf', 'threads'], default='auto',
+                            help='Decode pipeline: tf.data, a thread pool, or tf.data when TensorFlow is installed')
+        parser.add_argument('--decode-threads', type=int, default=os.cpu_count() or 1,
+                            help='Threads for the thread-pool pipeline (default: CPU count)')
+        parser.add_argument('--no-save', action='store_true', help='Print the metrics without storing them')
+
+    def handle(self, *args, **options):
+        from tomato_app.ml_model import predictor
+
+        if options['backend']:
+            predictor.load_model(options['backend'])
+        if not predictor.ensure_loaded():
+            raise CommandError('Model not loaded')
+        backend = predictor.backend
+
+        try:
+            samples = labelled_images(options['split'], per_class=options['per_class'])
+        except FileNotFoundError as e:
+            raise CommandError(str(e))
+        if not samples:
+            raise CommandError(f"No images found in data_split/{options['split']}")
+
+        class_names = predictor.class_names
+        paths = [path for path, _ in samples]
+        labels = np.array([class_names.index(name) for _, name in samples])
+
+        # The arrays the served model gets: raw uint8 pixels with in-graph resizing, or float32
+        decode = lambda path: predictor.preprocess(load_image(path))
+
+        pipeline = options['pipeline']
+        if pipeline == 'auto':
+            try:
+                import tensorflow  # noqa: F401
+                pipeline = 'tf'
+            except ImportError:
+                pipeline = 'threads'
+        batch_size = max(1, options['batch_size'])
+        if pipeline == 'tf':
+            batches = _tf_batches(paths, decode, batch_size)
+        else:
+            batches = _threaded_batches(paths, decode, batch_size, max(1, options['decode_threads']))
+
+        self.stdout.write(
+            f"Evaluating {backend.describe()['backend']} ({predictor.model_version}) on "
+            f"{len(paths)} images from data_split/{options['split']} "
+            f"(batch size {batch_size}, {pipeline} pipeline)"
+        )
+
+        predictions = []
+        batch_latencies = []
+        start = time.perf_counter()
+        for batch in batches:
+            batch_start = time.perf_counter()
+            scores = _score(backend, batch)
+            batch_latencies.append(time.perf_counter() - batch_start)
+            predictions.append(np.argmax(scores, axis=1))
+        wall = time.perf_counter() - start
+
+        predicted = np.concatenate(predictions)
+        matrix = confusion_matrix(labels, predicted, len(class_names))
+        summary = summarize(matrix, class_names)
+        latencies_ms = np.array(batch_latencies) * 1000
+        throughput = len(paths) / wall
+
+        self.stdout.write(f"\n{'class':<32}{'precision':>10}{'recall':>10}{'f1':>10}{'support':>9}")
+        for row in summary['per_class']:
+            self.stdout.write(f"{row['disease']:<32}{row['precision']:>10.3f}{row['recall']:>10.3f}"
+                              f"{row['f1_score']:>10.3f}{row['support']:>9}")
+        self.stdout.write(
+            f"\naccuracy {summary['accuracy']:.4f}  macro P {summary['precision']:.4f}  "
+            f"R {summary['recall']:.4f}  F1 {summary['f1_score']:.4f}"
+        )
+        self.stdout.write(
+            f"{throughput:.1f} images/s end to end; batch latency p50 "
+            f"{np.percentile(latencies_ms, 50):.1f} ms, p95 {np.percentile(latencies_ms, 95):.1f} ms"
+        )
+
+        if options['no_save']:
+            return
+        ModelEvaluation.objects.update_or_create(
+            model_version=predictor.model_version,
+            split=options['split'],
+            defaults={
+                'backend': backend.describe()['backend'],
+                'images': len(paths),
+                'accuracy': summary['accuracy'],
+                'precision': summary['precision'],
+                'recall': summary['recall'],
+                'f1_score': summary['f1_score'],
+                'per_class': summary['per_class'],
+                'class_names': class_names,
+                'confusion_matrix': matrix.tolist(),
+                'batch_size': batch_size,
+                'images_per_second': throughput,
+                'batch_latency_p50_ms': float(np.percentile(latencies_ms, 50)),
+                'batch_latency_p95_ms': float(np.percentile(latencies_ms, 95)),
+            },
+        )
+        forget_cached(predictor.model_version)
+        self.stdout.write(self.style.SUCCESS(f"Stored evaluation for {predictor.model_version}"))
@@ -0,0 +1,41 @@
+"""
+Convert the Keras model to ONNX for the onnx inference backend
+"""
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tomato_app.backends import resolve_model_path
+
+
+class Command(BaseCommand):
+    help = 'Export the Keras model to ONNX (requires tf2onnx) for INFERENCE_BACKEND=onnx'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.ONNX_MODEL_PATH,
+                            help='Where to write the .onnx model (default: ONNX_MODEL_PATH)')
+        parser.add_argument('--opset', type=int, default=13,
+                            help='ONNX opset version (default: 13)')
+
+    def handle(self, *args, **options):
+        import tensorflow as tf
+        try:
+            import tf2onnx
+        except ImportError:
+            raise CommandError('tf2onnx is not installed - run `pip install tf2onnx onnxruntime`')
+
+        model_path = resolve_model_path()
+        model = tf.keras.models.load_model(model_path)
+
+        output = Path(options['output'])
+        output.parent.mkdir(parents=True, exist_ok=True)
+        input_signature = [tf.TensorSpec((None, 224, 224, 3), tf.float32, name='images')]
+        tf2onnx.convert.from_keras(
+            model, input_signature=input_signature, opset=options['opset'], output_path=str(output)
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {model_path} to {output} ({output.stat().st_size / 1e6:.1f} MB)"
+        ))
+        self.stdout.write("Set INFERENCE_BACKEND=onnx to serve it with ONNX Runtime.")
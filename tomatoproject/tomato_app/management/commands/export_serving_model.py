@@ -0,0 +1,38 @@
+"""
+Export a SavedModel that takes raw uint8 images and resizes/rescales in-graph
+"""
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tomato_app.backends import KerasBackend
+
+
+class Command(BaseCommand):
+    help = ('Export the Keras model as a SavedModel whose serving_default signature takes '
+            'uint8 images of any size and does the resize and [0, 1] rescale in-graph')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=str(Path(settings.MODEL_PATH).with_name('serving_uint8')),
+                            help='SavedModel directory to write (default: next to MODEL_PATH)')
+        parser.add_argument('--xla', action='store_true',
+                            help='Compile the model part of the graph with XLA')
+
+    def handle(self, *args, **options):
+        import tensorflow as tf
+
+        backend = KerasBackend(serving_function=False)
+        backend.load()
+        serve = backend.build_serving_fn(jit_compile=options['xla'], uint8_input=True)
+
+        module = tf.Module()
+        module.model = backend.model
+        module.serve = serve
+
+        output = Path(options['output'])
+        tf.saved_model.save(module, str(output), signatures={'serving_default': serve})
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote uint8 serving model to {output} "
+            "(input: uint8 [batch, height, width, 3], output: class probabilities)"
+        ))
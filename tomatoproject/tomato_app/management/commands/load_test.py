@@ -0,0 +1,176 @@
+"""
+Boot the app and load-test its upload and API paths with a data_split corpus
+"""
+import importlib.util
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tomato_app.datasets import labelled_images
+from tomato_app.loadtest import Endpoint, LoadGenerator, fetch_csrf_token
+
+# Form field and images per request for each path that can be load-tested
+ENDPOINT_FIELDS = {
+    'api/predict/': 'image',
+    'api/predict/async/': 'image',
+    'simple-upload/': 'image',
+    'batch-predict/': 'images',
+}
+
+
+def _parse_endpoints(value: str, batch_images: int) -> list:
+    """``path=weight,...`` -> Endpoint list"""
+    endpoints = []
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        path, _, weight = item.partition('=')
+        path = path.strip('/') + '/'
+        if path not in ENDPOINT_FIELDS:
+            raise CommandError(f"Cannot load-test '{path}' (choose from {', '.join(ENDPOINT_FIELDS)})")
+        field = ENDPOINT_FIELDS[path]
+        endpoints.append(Endpoint(
+            path=path, field=field, weight=float(weight or 1),
+            files_per_request=batch_images if field == 'images' else 1,
+        ))
+    return endpoints
+
+
+class Command(BaseCommand):
+    help = ('Start the app (gunicorn or runserver) and drive api/predict/, simple-upload/ and '
+            'batch-predict/ concurrently in closed or open loop; reports RPS, latency percentiles '
+            'and error rates per endpoint')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Test an already running server instead of starting one')
+        parser.add_argument('--server', choices=['gunicorn', 'runserver'], default='gunicorn',
+                            help='Server to start (default: gunicorn with gunicorn.conf.py)')
+        parser.add_argument('--port', type=int, default=8765, help='Port for the started server (default: 8765)')
+        parser.add_argument('--boot-timeout', type=float, default=300,
+                            help='Seconds to wait for /readyz after starting (default: 300)')
+        parser.add_argument('--endpoints', default='api/predict/=6,simple-upload/=3,batch-predict/=1',
+                            help='Comma-separated path=weight mix (default: api/predict/=6,simple-upload/=3,batch-predict/=1)')
+        parser.add_argument('--batch-images', type=int, default=5,
+                            help='Images per batch-predict/ request (default: 5)')
+        parser.add_argument('--mode', choices=['closed', 'open'], default='closed',
+                            help='closed: fixed clients back to back; open: fixed arrival rate (default: closed)')
+        parser.add_argument('--concurrency', default='1,8,32',
+                            help='Closed loop: comma-separated client counts, one level each (default: 1,8,32)')
+        parser.add_argument('--rate', default='5,10,20',
+                            help='Open loop: comma-separated arrival rates in requests/s (default: 5,10,20)')
+        parser.add_argument('--max-in-flight', type=int, default=256,
+                            help='Open loop: most requests outstanding at once (default: 256)')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds per level (default: 30)')
+        parser.add_argument('--per-class', type=int, default=10,
+                            help='Corpus images sampled per class from data_split/test (default: 10)')
+        parser.add_argument('--allow-cache-hits', action='store_true',
+                            help='Upload corpus bytes unchanged instead of defeating the prediction cache')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        endpoints = _parse_endpoints(options['endpoints'], max(1, options['batch_images']))
+        if not endpoints:
+            raise CommandError('No endpoints to test')
+        corpus = [path.read_bytes() for path, _ in labelled_images('test', per_class=options['per_class'])]
+        if not corpus:
+            raise CommandError('No images found in data_split/test')
+
+        server = None
+        base_url = (options['url'] or '').rstrip('/')
+        if not base_url:
+            base_url = f"http://127.0.0.1:{options['port']}"
+            server = self._start_server(options['server'], options['port'])
+        try:
+            self._wait_ready(base_url, server, options['boot_timeout'])
+            report = self._run(base_url, endpoints, corpus, options)
+        finally:
+            if server is not None:
+                self._stop_server(server)
+
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(text)
+            self.stdout.write(f"\nWrote {options['output']}")
+
+    def _start_server(self, kind: str, port: int):
+        if kind == 'gunicorn':
+            if importlib.util.find_spec('gunicorn') is None:
+                raise CommandError('gunicorn is not installed; use --server runserver')
+            command = [sys.executable, '-m', 'gunicorn', 'tomato_disease.wsgi', '-c', 'gunicorn.conf.py',
+                       '--bind', f'127.0.0.1:{port}']
+        else:
+            command = [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{port}']
+
+        env = dict(os.environ, SECURE_SSL_REDIRECT='False')
+        hosts = env.get('ALLOWED_HOSTS', '')
+        if '127.0.0.1' not in hosts.split(','):
+            env['ALLOWED_HOSTS'] = ','.join(filter(None, [hosts, '127.0.0.1']))
+        self.stdout.write(f"Starting {kind} on port {port}...")
+        # Own process group, so the master and all its workers are stopped together
+        return subprocess.Popen(command, cwd=settings.BASE_DIR, env=env, start_new_session=True,
+                                stdout=subprocess.DEVNULL)
+
+    def _wait_ready(self, base_url: str, server, timeout: float):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server is not None and server.poll() is not None:
+                raise CommandError(f'Server exited with status {server.returncode} before becoming ready')
+            try:
+                with urllib.request.urlopen(f'{base_url}/readyz', timeout=5):
+                    return
+            except (urllib.error.URLError, OSError):
+                time.sleep(1)
+        raise CommandError(f'{base_url}/readyz did not return 200 within {timeout:.0f}s')
+
+    def _stop_server(self, server):
+        try:
+            os.killpg(server.pid, signal.SIGTERM)
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(server.pid, signal.SIGKILL)
+            server.wait()
+        except ProcessLookupError:
+            pass
+
+    def _run(self, base_url: str, endpoints: list, corpus: list, options) -> dict:
+        try:
+            token = fetch_csrf_token(base_url)
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        generator = LoadGenerator(base_url, endpoints, corpus, token,
+                                  defeat_cache=not options['allow_cache_hits'])
+        if options['mode'] == 'closed':
+            levels = [int(c) for c in options['concurrency'].split(',') if c.strip()]
+        else:
+            levels = [float(r) for r in options['rate'].split(',') if r.strip()]
+
+        report = {
+            'url': base_url,
+            'mode': options['mode'],
+            'duration': options['duration'],
+            'corpus_images': len(corpus),
+            'endpoints': {e.path: {'weight': e.weight, 'files_per_request': e.files_per_request} for e in endpoints},
+            'levels': [],
+        }
+        label = 'clients' if options['mode'] == 'closed' else 'rate/s'
+        self.stdout.write(f"\n{label:>8}  {'endpoint':<16}{'reqs':>7}{'rps':>8}{'p50 ms':>9}{'p90 ms':>9}"
+                          f"{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+        for level in levels:
+            if options['mode'] == 'closed':
+                result = generator.run_closed(level, options['duration'])
+            else:
+                result = generator.run_open(level, options['duration'], options['max_in_flight'])
+            report['levels'].append(dict(result, level=level))
+            for path, stats in sorted(result['endpoints'].items()):
+                line = (f"{level:>8g}  {path:<16}{stats['requests']:>7}{stats['rps']:>8.1f}{stats['p50_ms']:>9.0f}"
+                        f"{stats['p90_ms']:>9.0f}{stats['p95_ms']:>9.0f}{stats['p99_ms']:>9.0f}"
+                        f"{stats['error_rate']:>8.1%}")
+                self.stdout.write(self.style.ERROR(line) if stats['error_rate'] else line)
+        return report
@@ -0,0 +1,76 @@
+"""
+Merge the sampling profiler's collapsed-stack dumps into one flame graph
+"""
+import json
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tomato_app.profiling import collapsed, parse_collapsed, speedscope
+
+
+class Command(BaseCommand):
+    help = ('Merge the collapsed-stack files written by every worker\'s sampling profiler '
+            '(SAMPLING_PROFILER_DIR) into one collapsed file or speedscope profile')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Directory of dumps (default: SAMPLING_PROFILER_DIR)')
+        parser.add_argument('--minutes', type=float, default=0,
+                            help='Only merge dumps written in the last N minutes (default: all)')
+        parser.add_argument('--pid', type=int, action='append', help='Only merge dumps of this worker PID (repeatable)')
+        parser.add_argument('--format', choices=['collapsed', 'speedscope'], default='collapsed',
+                            help='collapsed: flamegraph.pl / speedscope input; speedscope: speedscope JSON '
+                                 '(default: collapsed)')
+        parser.add_argument('--output', help='Write the merged profile to this file (default: stdout)')
+        parser.add_argument('--top', type=int, default=20,
+                            help='Print the N functions with the most self samples (default: 20, 0 to skip)')
+
+    def handle(self, *args, **options):
+        directory = Path(options['dir'] or settings.SAMPLING_PROFILER_DIR)
+        if not directory.is_dir():
+            raise CommandError(f'{directory} does not exist')
+
+        paths = sorted(directory.glob('*.collapsed'))
+        if options['minutes']:
+            cutoff = time.time() - options['minutes'] * 60
+            paths = [path for path in paths if path.stat().st_mtime >= cutoff]
+        if options['pid']:
+            # Files are named <host>-<pid>-<date>-<time>.collapsed
+            paths = [path for path in paths if int(path.stem.rsplit('-', 3)[1]) in options['pid']]
+        if not paths:
+            raise CommandError(f'No matching dumps in {directory}')
+
+        counts = Counter()
+        for path in paths:
+            counts.update(parse_collapsed(path.read_text()))
+        total = sum(counts.values())
+        interval = settings.SAMPLING_PROFILER_INTERVAL_MS / 1000
+        self.stderr.write(f"Merged {len(paths)} dump(s): {total} samples, {len(counts)} distinct stacks "
+                          f"(~{total * interval:.0f} thread-seconds)")
+
+        if options['format'] == 'speedscope':
+            text = json.dumps(speedscope(counts, f'merged {len(paths)} dumps', interval))
+        else:
+            text = collapsed(counts)
+        if options['output']:
+            Path(options['output']).write_text(text)
+            self.stderr.write(f"Wrote {options['output']}")
+        else:
+            self.stdout.write(text, ending='')
+
+        if options['top']:
+            self._print_top(counts, total, options['top'])
+
+    def _print_top(self, counts: Counter, total: int, top: int):
+        own, inclusive = Counter(), Counter()
+        for stack, count in counts.items():
+            own[stack[-1]] += count
+            # Count recursive functions once per stack
+            for frame in set(stack):
+                inclusive[frame] += count
+        self.stderr.write(f"\n{'self':>7}{'total':>8}  function")
+        for frame, count in own.most_common(top):
+            self.stderr.write(f"{count / total:>7.1%}{inclusive[frame] / total:>8.1%}  {frame}")
@@ -0,0 +1,21 @@
+"""
+Print a signed X-Profile-Token header value for on-demand request profiling
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tomato_app.profiling import MODES, make_token
+
+
+class Command(BaseCommand):
+    help = ('Print an X-Profile-Token value; a request to a PROFILING_VIEWS endpoint carrying it '
+            'is profiled and stored (see /debug/profiles/)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=MODES, default='sampling',
+                            help='sampling: stack samples only; cprofile: also cProfile statistics (default: sampling)')
+
+    def handle(self, *args, **options):
+        self.stderr.write(f"Valid for {settings.PROFILING_TOKEN_MAX_AGE}s, e.g.\n"
+                          f"  curl -H 'X-Profile-Token: <token>' -F image=@leaf.jpg http://localhost:8000/api/predict/")
+        self.stdout.write(make_token(options['mode']))
@@ -0,0 +1,106 @@
+"""
+Convert the Keras model to a full-integer (INT8) TFLite model
+"""
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tomato_app.backends import TFLiteInt8Backend, resolve_model_path
+from tomato_app.datasets import labelled_images
+from tomato_app.preprocessing import load_image, to_model_input
+
+
+class Command(BaseCommand):
+    help = ('Quantize the Keras model to a full-integer TFLite model calibrated on data_split/train '
+            'and report the accuracy delta on data_split/test')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.TFLITE_MODEL_PATH,
+                            help='Where to write the .tflite model (default: TFLITE_MODEL_PATH)')
+        parser.add_argument('--calibration-images', type=int, default=300,
+                            help='Representative images drawn from data_split/train (default: 300)')
+        parser.add_argument('--eval-per-class', type=int, default=None,
+                            help='Cap test images per class during evaluation (default: all)')
+        parser.add_argument('--batch-size', type=int, default=32,
+                            help='Batch size used during evaluation (default: 32)')
+        parser.add_argument('--skip-eval', action='store_true',
+                            help='Only convert, do not evaluate against data_split/test')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        import tensorflow as tf
+        from tomato_app.ml_model import predictor
+
+        model_path = resolve_model_path()
+        keras_model = tf.keras.models.load_model(model_path)
+        self.stdout.write(f"Loaded Keras reference model from {model_path}")
+
+        per_class = max(1, options['calibration_images'] // 10)
+        calibration = labelled_images('train', per_class=per_class, seed=options['seed'])
+        self.stdout.write(f"Calibrating on {len(calibration)} images from data_split/train")
+
+        def representative_dataset():
+            for path, _ in calibration:
+                sample = to_model_input(load_image(path))
+                yield [np.expand_dims(sample, axis=0).astype(np.float32)]
+
+        converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.uint8
+        tflite_bytes = converter.convert()
+
+        output = Path(options['output'])
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_bytes(tflite_bytes)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote INT8 model to {output} ({len(tflite_bytes) / 1e6:.1f} MB, "
+            f"Keras model is {model_path.stat().st_size / 1e6:.1f} MB)"
+        ))
+
+        if options['skip_eval']:
+            return
+
+        tflite_backend = TFLiteInt8Backend(output)
+        tflite_backend.load()
+        test_images = labelled_images('test', per_class=options['eval_per_class'], seed=options['seed'])
+        self.stdout.write(f"Evaluating on {len(test_images)} images from data_split/test")
+
+        class_names = predictor.class_names
+        labels = np.array([class_names.index(name) for _, name in test_images])
+        keras_preds, tflite_preds = [], []
+        keras_seconds = tflite_seconds = 0.0
+
+        batch_size = max(1, options['batch_size'])
+        for start in range(0, len(test_images), batch_size):
+            batch = np.stack([
+                to_model_input(load_image(path))
+                for path, _ in test_images[start:start + batch_size]
+            ]).astype(np.float32)
+
+            began = time.perf_counter()
+            keras_preds.append(np.argmax(keras_model(batch, training=False).numpy(), axis=1))
+            keras_seconds += time.perf_counter() - began
+
+            began = time.perf_counter()
+            tflite_preds.append(np.argmax(tflite_backend.infer_batch(batch), axis=1))
+            tflite_seconds += time.perf_counter() - began
+
+        keras_preds = np.concatenate(keras_preds)
+        tflite_preds = np.concatenate(tflite_preds)
+        keras_accuracy = float(np.mean(keras_preds == labels))
+        tflite_accuracy = float(np.mean(tflite_preds == labels))
+        agreement = float(np.mean(keras_preds == tflite_preds))
+        count = len(labels)
+
+        self.stdout.write(f"\n{'model':<14}{'accuracy':>10}{'ms/image':>12}")
+        self.stdout.write(f"{'keras fp32':<14}{keras_accuracy:>10.4f}{keras_seconds / count * 1000:>12.2f}")
+        self.stdout.write(f"{'tflite int8':<14}{tflite_accuracy:>10.4f}{tflite_seconds / count * 1000:>12.2f}")
+        self.stdout.write(f"\nAccuracy delta (int8 - fp32): {tflite_accuracy - keras_accuracy:+.4f}")
+        self.stdout.write(f"Top-1 agreement with Keras reference: {agreement:.4f}")
+        self.stdout.write("Set INFERENCE_BACKEND=tflite_int8 to serve the quantized model.")
@@ -0,0 +1,33 @@
+"""
+Recompute the crop report's daily rollups from the Prediction table
+"""
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tomato_app.analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = ('Recompute DailyPredictionRollup rows from Prediction, for all days or a range. '
+            'Rollups are normally maintained as predictions are saved; run this after bulk edits or from cron')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Last day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--days', type=int, help='Rebuild the last N days (overrides --start/--end)')
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['start']) if options['start'] else None
+            end = date.fromisoformat(options['end']) if options['end'] else None
+        except ValueError as e:
+            raise CommandError(f"Invalid date: {e}")
+        if options['days']:
+            end = timezone.localdate()
+            start = end - timedelta(days=options['days'] - 1)
+
+        written = rebuild_rollups(start, end)
+        span = f"{start or 'the beginning'} to {end or 'today'}"
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} rollup rows from {span}"))
@@ -0,0 +1,52 @@
+"""
+Process queued batch prediction jobs
+"""
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tomato_app.jobs import claim_job, default_worker_id, process_job
+
+
+class Command(BaseCommand):
+    help = ('Claim queued batch jobs (submitted to api/jobs/) and predict their images in '
+            'batches, recording progress. Run as many workers as the box has capacity for.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.INFERENCE_BATCH_CHUNK_SIZE,
+                            help='Images per batch (default: INFERENCE_BATCH_CHUNK_SIZE)')
+        parser.add_argument('--poll-interval', type=float, default=settings.BATCH_JOB_POLL_INTERVAL,
+                            help='Seconds to wait when the queue is empty (default: BATCH_JOB_POLL_INTERVAL)')
+        parser.add_argument('--worker-id', default=default_worker_id(),
+                            help='Lease owner name (default: hostname:pid)')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when the queue is empty instead of polling')
+
+    def handle(self, *args, **options):
+        from tomato_app.ml_model import predictor
+
+        if not predictor.ensure_loaded():
+            raise CommandError(f"Model failed to load: {predictor.describe().get('error')}")
+
+        # Finish the current batch, then hand the job back to the queue
+        stopping = []
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stopping.append(True))
+
+        worker_id = options['worker_id']
+        self.stdout.write(f"Batch worker {worker_id} started")
+        while not stopping:
+            job = claim_job(worker_id)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f"Claimed job {job.pk} ({job.total_images} images, attempt {job.attempts})")
+            status = process_job(job, worker_id, options['batch_size'], should_stop=lambda: bool(stopping))
+            self.stdout.write(f"Job {job.pk}: {status}")
+
+        self.stdout.write(f"Batch worker {worker_id} stopped")
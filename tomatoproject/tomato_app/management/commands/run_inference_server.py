@@ -0,0 +1,45 @@
+"""
+Run the out-of-process inference server on a Unix socket
+"""
+import signal
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tomato_app.backends import BACKENDS, RemoteBackend
+from tomato_app.inference_server import InferenceServer
+
+
+class Command(BaseCommand):
+    help = ('Load the model once and serve predictions to web workers over a Unix socket '
+            '(set INFERENCE_BACKEND=remote in the web workers to use it)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.INFERENCE_SERVER_SOCKET,
+                            help='Unix socket path (default: INFERENCE_SERVER_SOCKET)')
+        parser.add_argument('--backend', default=settings.INFERENCE_SERVER_BACKEND,
+                            choices=[name for name in BACKENDS if name != RemoteBackend.name],
+                            help='Backend that runs the model (default: INFERENCE_SERVER_BACKEND)')
+
+    def handle(self, *args, **options):
+        from tomato_app.ml_model import predictor
+
+        self.stdout.write(f"Loading {options['backend']} backend...")
+        predictor.load_model(options['backend'])
+        if not predictor.is_loaded:
+            raise CommandError(f"Model failed to load: {predictor.describe().get('error')}")
+
+        server = InferenceServer(options['socket'], predictor)
+        # Exit through serve_forever's caller so the socket file is removed
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        self.stdout.write(self.style.SUCCESS(
+            f"Serving {predictor.model_version} on {options['socket']} "
+            f"(batching={'on' if predictor._batcher is not None else 'off'})"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
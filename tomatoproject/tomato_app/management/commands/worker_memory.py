@@ -0,0 +1,74 @@
+"""
+Report per-process memory for a gunicorn master and its workers
+"""
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def read_smaps_rollup(pid: int) -> dict:
+    """Memory counters for a process from /proc/<pid>/smaps_rollup, in MiB"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in SMAPS_FIELDS:
+                values[key] = int(rest.split()[0]) / 1024
+    # Unique set size: memory that would be freed if this process exited
+    values['Uss'] = values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    return values
+
+
+def child_pids(parent: int) -> list:
+    """PIDs whose parent is ``parent``"""
+    children = []
+    for stat in Path('/proc').glob('[0-9]*/stat'):
+        try:
+            # The command name may contain spaces, so split after its closing paren
+            fields = stat.read_text().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == parent:
+            children.append(int(stat.parent.name))
+    return sorted(children)
+
+
+class Command(BaseCommand):
+    help = ('Show RSS, PSS and USS for a gunicorn master and its workers (Linux only), '
+            'to measure how much memory preload mode shares between workers')
+
+    def add_arguments(self, parser):
+        parser.add_argument('pid', type=int, nargs='?',
+                            help='gunicorn master PID (default: read from --pidfile)')
+        parser.add_argument('--pidfile', help='gunicorn pidfile (gunicorn --pid)')
+
+    def handle(self, *args, **options):
+        pid = options['pid']
+        if pid is None:
+            if not options['pidfile']:
+                raise CommandError('Pass the gunicorn master PID or --pidfile')
+            pid = int(Path(options['pidfile']).read_text().strip())
+        if not Path(f'/proc/{pid}/smaps_rollup').exists():
+            raise CommandError(f'/proc/{pid}/smaps_rollup not found (Linux 4.14+ required)')
+
+        rows = [('master', pid)] + [('worker', child) for child in child_pids(pid)]
+        self.stdout.write(f"{'role':<8}{'pid':>8}{'RSS MiB':>10}{'PSS MiB':>10}"
+                          f"{'USS MiB':>10}{'shared MiB':>12}")
+        totals = {'Rss': 0.0, 'Pss': 0.0, 'Uss': 0.0}
+        for role, process in rows:
+            try:
+                mem = read_smaps_rollup(process)
+            except OSError:
+                continue
+            shared = mem.get('Shared_Clean', 0) + mem.get('Shared_Dirty', 0)
+            for key in totals:
+                totals[key] += mem.get(key, 0)
+            self.stdout.write(f"{role:<8}{process:>8}{mem['Rss']:>10.1f}{mem['Pss']:>10.1f}"
+                              f"{mem['Uss']:>10.1f}{shared:>12.1f}")
+
+        # Summed RSS counts shared pages once per process; summed PSS does not
+        self.stdout.write(f"\nTotal RSS: {totals['Rss']:.1f} MiB (double-counts shared pages)")
+        self.stdout.write(f"Total PSS: {totals['Pss']:.1f} MiB (actual footprint)")
+        self.stdout.write(f"Total USS: {totals['Uss']:.1f} MiB")
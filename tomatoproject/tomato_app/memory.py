@@ -0,0 +1,177 @@
+"""
+Worker memory tracking: RSS, tracemalloc and the RSS recycling policy
+
+Long-lived TensorFlow processes grow RSS with repeated forward passes.
+``MemoryMiddleware`` measures each request's RSS growth (and, while
+tracemalloc is tracing, its growth in Python allocations) per view. The
+gunicorn ``post_request`` hook asks ``recycle_reason`` after every request
+and, like ``max_requests``, lets the worker finish the request and exit
+once its RSS is past MEMORY_MAX_RSS_MB, or has grown MEMORY_MAX_RSS_GROWTH_MB
+since the model became ready; the master starts a fresh worker.
+"""
+import logging
+import os
+import threading
+import tracemalloc
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def rss_bytes():
+    """Current resident set size of this process, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+metrics.PROCESS_RSS.set_function(lambda: rss_bytes() or 0)
+
+
+class _State:
+    pid = None
+    baseline_rss = None  # RSS once the model was ready
+    requests = 0
+
+
+_state = _State()
+_state_lock = threading.Lock()
+
+
+def _current_state() -> _State:
+    # Forked workers start over
+    if _state.pid != os.getpid():
+        with _state_lock:
+            if _state.pid != os.getpid():
+                _state.pid = os.getpid()
+                _state.baseline_rss = None
+                _state.requests = 0
+    return _state
+
+
+def baseline_rss():
+    """RSS recorded after the first request once the model was ready, or None"""
+    return _current_state().baseline_rss
+
+
+def record_request(view: str, rss_before, rss_after, traced_before=None, traced_after=None):
+    """Count one request's memory growth; the first request after model load sets the baseline"""
+    from .ml_model import predictor
+
+    state = _current_state()
+    state.requests += 1
+    if state.baseline_rss is None and rss_after is not None and predictor.is_ready:
+        state.baseline_rss = rss_after
+
+    if rss_before is not None and rss_after is not None:
+        growth = rss_after - rss_before
+        if growth > 0:
+            metrics.REQUEST_RSS_GROWTH.inc(growth, view=view)
+        if settings.MEMORY_REQUEST_WARN_MB and growth >= settings.MEMORY_REQUEST_WARN_MB * MB:
+            logger.warning("%s grew RSS by %.1f MiB to %.1f MiB", view, growth / MB, rss_after / MB)
+    if traced_before is not None and traced_after is not None and traced_after > traced_before:
+        metrics.REQUEST_TRACED_GROWTH.inc(traced_after - traced_before, view=view)
+
+
+def recycle_reason():
+    """``(reason, message)`` if this worker should be recycled now, else None"""
+    rss = rss_bytes()
+    if rss is None:
+        return None
+    if settings.MEMORY_MAX_RSS_MB and rss > settings.MEMORY_MAX_RSS_MB * MB:
+        return 'rss', f"RSS {rss / MB:.0f} MiB is over MEMORY_MAX_RSS_MB={settings.MEMORY_MAX_RSS_MB}"
+    baseline = baseline_rss()
+    if settings.MEMORY_MAX_RSS_GROWTH_MB and baseline is not None \
+            and rss - baseline > settings.MEMORY_MAX_RSS_GROWTH_MB * MB:
+        return 'growth', (f"RSS grew {(rss - baseline) / MB:.0f} MiB since the model was ready, "
+                          f"over MEMORY_MAX_RSS_GROWTH_MB={settings.MEMORY_MAX_RSS_GROWTH_MB}")
+    return None
+
+
+def note_recycle(reason: str):
+    """Count a recycle and write metrics out before the worker exits"""
+    metrics.WORKER_RECYCLES.inc(reason=reason)
+    metrics.write_snapshot()
+
+
+# --- tracemalloc ---------------------------------------------------------------
+
+_snapshot = None  # Taken by start_tracing; allocation growth is measured from it
+
+
+def start_tracing():
+    """Start tracemalloc (no-op if running) and take the snapshot later diffs compare to"""
+    global _snapshot
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(settings.MEMORY_TRACEMALLOC_FRAMES)
+    _snapshot = tracemalloc.take_snapshot()
+
+
+def stop_tracing():
+    global _snapshot
+    tracemalloc.stop()
+    _snapshot = None
+
+
+def top_allocations(limit: int = 25, group_by: str = 'lineno') -> dict:
+    """
+    The largest allocation sites, and the ones that grew most since ``start_tracing``
+
+    Returns:
+        ``{'top': [...], 'growth': [...]}`` of dicts with ``site``, ``size``
+        and ``count`` (plus ``size_diff`` and ``count_diff`` for growth); empty
+        lists while tracemalloc is not tracing
+    """
+    if not tracemalloc.is_tracing():
+        return {'top': [], 'growth': []}
+    # Leave out tracemalloc's own bookkeeping
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    snapshot = tracemalloc.take_snapshot().filter_traces(filters)
+
+    def site(traceback) -> str:
+        frame = traceback[0]
+        return f"{frame.filename}:{frame.lineno}"
+
+    top = [{'site': site(stat.traceback), 'size': stat.size, 'count': stat.count}
+           for stat in snapshot.statistics(group_by)[:limit]]
+    growth = []
+    if _snapshot is not None:
+        # Sorted by absolute change; only growth matters here
+        grown = [stat for stat in snapshot.compare_to(_snapshot.filter_traces(filters), group_by)
+                 if stat.size_diff > 0]
+        growth = [{'site': site(stat.traceback), 'size': stat.size, 'count': stat.count,
+                   'size_diff': stat.size_diff, 'count_diff': stat.count_diff}
+                  for stat in grown[:limit]]
+    return {'top': top, 'growth': growth}
+
+
+def report(limit: int = 25) -> dict:
+    """This worker's memory state for the /debug/memory page"""
+    rss = rss_bytes()
+    baseline = baseline_rss()
+    traced, traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    return dict(
+        top_allocations(limit),
+        pid=os.getpid(),
+        requests=_current_state().requests,
+        rss_mb=rss / MB if rss is not None else None,
+        baseline_rss_mb=baseline / MB if baseline is not None else None,
+        growth_mb=(rss - baseline) / MB if rss is not None and baseline is not None else None,
+        max_rss_mb=settings.MEMORY_MAX_RSS_MB,
+        max_rss_growth_mb=settings.MEMORY_MAX_RSS_GROWTH_MB,
+        tracing=tracemalloc.is_tracing(),
+        traced_mb=traced / MB,
+        traced_peak_mb=traced_peak / MB,
+    )
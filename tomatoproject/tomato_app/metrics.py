@@ -0,0 +1,417 @@
+"""
+Prometheus-format metrics: counters, gauges, histograms and per-request stage timing
+
+Metrics live in process memory. With METRICS_MULTIPROCESS_DIR set (as the
+gunicorn config does), every process also writes a snapshot of its values
+to ``<dir>/<pid>.json`` - at most every METRICS_FLUSH_INTERVAL seconds, from
+a background thread - and ``/metrics`` merges the snapshots, so any worker
+can answer a scrape for all of them:
+
+- Counters and histograms are summed over every process, including exited
+  ones, so they never go backwards when a worker is recycled. The gunicorn
+  master folds an exited worker's file into ``archive.json``.
+- Gauges are summed over live processes only. Gauges backed by a callback
+  (queue depth, RSS) are re-read on every flush, so while any are registered
+  a process rewrites its snapshot every METRICS_FLUSH_INTERVAL even when idle.
+
+``stage(name)`` times one step of request handling into the
+``tomato_stage_seconds`` histogram and, inside a request, into the
+response's ``Server-Timing`` header (see ``tomato_app.middleware``).
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ARCHIVE_FILE = 'archive.json'
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values tuple -> value
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry[name] = self
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, summed across processes"""
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        _ensure_process()
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _mark_dirty()
+
+
+class Gauge(_Metric):
+    """Current value, summed across live processes; may be backed by a callback"""
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value: float, **labels):
+        _ensure_process()
+        with self._lock:
+            self._values[self._key(labels)] = value
+        _mark_dirty()
+
+    def inc(self, amount: float = 1, **labels):
+        _ensure_process()
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _mark_dirty()
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn, **labels):
+        """Read the value from ``fn()`` whenever metrics are snapshotted"""
+        self._functions[self._key(labels)] = fn
+
+    def snapshot(self) -> dict:
+        for key, fn in list(self._functions.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            with self._lock:
+                self._values[key] = value
+        return super().snapshot()
+
+
+class Histogram(_Metric):
+    """Bucketed observations; values are per-bucket counts followed by the sum"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        _ensure_process()
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+        _mark_dirty()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {json.dumps(key): list(counts) for key, counts in self._values.items()}
+
+
+# --- Metrics recorded by the app -------------------------------------------
+
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    'tomato_http_requests_in_flight', 'Requests being handled')
+HTTP_REQUEST_SECONDS = Histogram(
+    'tomato_http_request_duration_seconds', 'Request handling time by view', ['view', 'method', 'status'])
+STAGE_SECONDS = Histogram(
+    'tomato_stage_seconds', 'Time spent in each stage of handling a prediction', ['stage'])
+PREDICTIONS = Counter(
+    'tomato_predictions_total', 'Prediction results by endpoint and outcome', ['endpoint', 'outcome'])
+INFERENCE_BATCH_SIZE = Histogram(
+    'tomato_inference_batch_size', 'Images per forward pass', buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+INFERENCE_SECONDS = Histogram(
+    'tomato_inference_seconds', 'Time of one forward pass', ['backend'])
+INFERENCE_ERRORS = Counter(
+    'tomato_inference_errors_total', 'Forward passes that raised', ['backend'])
+CACHE_LOOKUPS = Counter(
+    'tomato_prediction_cache_lookups_total', 'Prediction cache lookups by result', ['result'])
+BATCHER_QUEUE_DEPTH = Gauge(
+    'tomato_batcher_queue_depth', 'Samples waiting in the micro-batcher')
+ASYNC_IN_FLIGHT = Gauge(
+    'tomato_async_inference_in_flight', 'Async prediction requests holding an executor slot')
+PROCESS_RSS = Gauge(
+    'tomato_process_rss_bytes', 'Resident set size of the live processes')
+REQUEST_RSS_GROWTH = Counter(
+    'tomato_request_rss_growth_bytes_total', 'RSS growth while handling requests, by view', ['view'])
+REQUEST_TRACED_GROWTH = Counter(
+    'tomato_request_traced_growth_bytes_total', 'Growth of tracemalloc-traced memory during requests, by view',
+    ['view'])
+WORKER_RECYCLES = Counter(
+    'tomato_worker_recycles_total', 'Workers recycled for their memory use', ['reason'])
+PROFILER_SAMPLING_SECONDS = Counter(
+    'tomato_profiler_sampling_seconds_total', 'Time the always-on sampling profiler spent taking samples')
+
+
+def record_result(endpoint: str, result: dict):
+    """Count one prediction result under ``endpoint``"""
+    PREDICTIONS.inc(endpoint=endpoint, outcome='success' if result.get('success') else 'error')
+
+
+# --- Per-request stage timing ----------------------------------------------
+
+_request_timings = contextvars.ContextVar('tomato_request_timings', default=None)
+
+
+def start_request_timing():
+    """Begin collecting stage timings for the current request; returns a reset token"""
+    return _request_timings.set([])
+
+
+def finish_request_timing(token) -> list:
+    """Stop collecting and return the ``(stage, seconds)`` pairs recorded"""
+    timings = _request_timings.get() or []
+    _request_timings.reset(token)
+    return timings
+
+
+def current_timings() -> list:
+    """The ``(stage, seconds)`` pairs recorded so far in the current request"""
+    return list(_request_timings.get() or [])
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block into ``tomato_stage_seconds`` and the current request's Server-Timing"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if settings.METRICS_ENABLED:
+            STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+# --- Multi-process snapshots -----------------------------------------------
+
+_process_pid = None
+_process_lock = threading.Lock()
+_dirty = threading.Event()
+_flush_pause = threading.Event()  # never set
+
+
+def _multiprocess_dir():
+    path = settings.METRICS_MULTIPROCESS_DIR
+    return Path(path) if path else None
+
+
+def _ensure_process():
+    """After a fork, drop values inherited from the parent and start this process's flusher"""
+    global _process_pid
+    pid = os.getpid()
+    if _process_pid == pid:
+        return
+    with _process_lock:
+        if _process_pid == pid:
+            return
+        if _process_pid is not None:
+            for metric in list(_registry.values()):
+                metric.reset()
+        _process_pid = pid
+        if _multiprocess_dir() is not None:
+            threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _mark_dirty():
+    _dirty.set()
+
+
+def _snapshot() -> dict:
+    return {name: metric.snapshot() for name, metric in list(_registry.items())}
+
+
+def _write_json(path: Path, data: dict):
+    # Atomic replace, so readers never see a half-written file
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def write_snapshot():
+    """Write this process's values to the multiprocess directory, if configured"""
+    directory = _multiprocess_dir()
+    if directory is None or _process_pid != os.getpid():
+        return
+    directory.mkdir(parents=True, exist_ok=True)
+    _write_json(directory / f'{os.getpid()}.json', _snapshot())
+
+
+def _has_callbacks() -> bool:
+    return any(getattr(metric, '_functions', None) for metric in list(_registry.values()))
+
+
+def _flush_loop():
+    pid = os.getpid()
+    while _process_pid == pid:
+        # Callback gauges change without marking anything dirty
+        if not _has_callbacks():
+            _dirty.wait()
+        _dirty.clear()
+        try:
+            write_snapshot()
+        except OSError:
+            logger.exception("Could not write metrics snapshot")
+        # An event wait rather than a sleep, so the sampling profiler sees an idle thread
+        _flush_pause.wait(settings.METRICS_FLUSH_INTERVAL)
+
+
+atexit.register(lambda: write_snapshot() if _multiprocess_dir() else None)
+
+
+def _read_json(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(into: dict, snapshot: dict, include_gauges: bool):
+    for name, samples in snapshot.items():
+        metric = _registry.get(name)
+        if metric is None or (metric.type == 'gauge' and not include_gauges):
+            continue
+        merged = into.setdefault(name, {})
+        for key, value in samples.items():
+            if metric.type == 'histogram':
+                current = merged.get(key)
+                merged[key] = value if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                merged[key] = merged.get(key, 0) + value
+
+
+def mark_process_dead(pid: int):
+    """
+    Fold an exited process's counters and histograms into the archive
+
+    Called from the gunicorn master's ``child_exit`` hook, which runs one
+    at a time, so the archive is never updated concurrently.
+    """
+    directory = _multiprocess_dir()
+    if directory is None:
+        return
+    path = directory / f'{pid}.json'
+    if not path.exists():
+        return
+    archive = _read_json(directory / ARCHIVE_FILE)
+    _merge(archive, _read_json(path), include_gauges=False)
+    _write_json(directory / ARCHIVE_FILE, archive)
+    path.unlink(missing_ok=True)
+
+
+def reset_multiprocess_dir():
+    """Remove snapshots from a previous run (called when the gunicorn master starts)"""
+    directory = _multiprocess_dir()
+    if directory is None:
+        return
+    directory.mkdir(parents=True, exist_ok=True)
+    for path in directory.glob('*.json'):
+        path.unlink(missing_ok=True)
+
+
+def collect() -> dict:
+    """Current values of every metric, merged across processes when configured"""
+    _ensure_process()
+    directory = _multiprocess_dir()
+    if directory is None:
+        return _snapshot()
+
+    write_snapshot()
+    merged = {}
+    _merge(merged, _read_json(directory / ARCHIVE_FILE), include_gauges=False)
+    for path in directory.glob('*.json'):
+        if path.name == ARCHIVE_FILE:
+            continue
+        try:
+            pid = int(path.stem)
+        except ValueError:
+            continue
+        # A dead worker not yet archived still counts, but its gauges do not
+        _merge(merged, _read_json(path), include_gauges=_pid_alive(pid))
+    return merged
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+    values = collect()
+    lines = []
+    for name, metric in sorted(_registry.items()):
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        for key, value in sorted(values.get(name, {}).items()):
+            label_values = json.loads(key)
+            if metric.type != 'histogram':
+                lines.append(f'{name}{_format_labels(metric.labelnames, label_values)} {_format_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets, value):
+                cumulative += count
+                labels = _format_labels(metric.labelnames, label_values, [('le', _format_number(float(bound)))])
+                lines.append(f'{name}_bucket{labels} {cumulative}')
+            labels = _format_labels(metric.labelnames, label_values)
+            lines.append(f'{name}_sum{labels} {_format_number(value[-1])}')
+            lines.append(f'{name}_count{labels} {cumulative}')
+    return '\n'.join(lines) + '\n'
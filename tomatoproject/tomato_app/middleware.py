@@ -0,0 +1,158 @@
+"""
+Request metrics, memory and profiling middleware
+"""
+import asyncio
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.urls import reverse
+
+from . import memory, metrics, profiling
+
+
+class MetricsMiddleware:
+    """
+    Time every request and report its stages in a ``Server-Timing`` header
+
+    Requests are counted into ``tomato_http_request_duration_seconds`` by
+    URL name. Stages timed with ``metrics.stage`` while the view runs are
+    summed per name into the header, e.g.
+    ``Server-Timing: read;dur=0.4, decode;dur=6.1, inference;dur=41.0, total;dur=52.3``.
+    Streaming responses are counted when their first chunk is produced (or
+    when they end, if empty); their header, sent before any content, only
+    covers the time until the view returned.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        token = metrics.start_request_timing()
+        metrics.HTTP_REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.HTTP_REQUESTS_IN_FLIGHT.dec()
+            timings = metrics.finish_request_timing(token)
+
+        match = getattr(request, 'resolver_match', None)
+        labels = {
+            'view': match.url_name if match is not None and match.url_name else 'unmatched',
+            'method': request.method,
+            'status': response.status_code,
+        }
+        if response.streaming:
+            observe = _first_chunk_observer(start, labels)
+            if response.is_async:
+                response.streaming_content = _observe_async(response.streaming_content, observe)
+            else:
+                response.streaming_content = _observe_sync(response.streaming_content, observe)
+        else:
+            metrics.HTTP_REQUEST_SECONDS.observe(elapsed, **labels)
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = _server_timing(timings, elapsed)
+        return response
+
+
+def _first_chunk_observer(start: float, labels: dict):
+    """Callable that records the request duration the first time it is called"""
+    observed = False
+
+    def observe():
+        nonlocal observed
+        if not observed:
+            observed = True
+            metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, **labels)
+
+    return observe
+
+
+def _observe_sync(content, observe):
+    try:
+        for chunk in content:
+            observe()
+            yield chunk
+    finally:
+        observe()
+
+
+async def _observe_async(content, observe):
+    try:
+        async for chunk in content:
+            observe()
+            yield chunk
+    finally:
+        observe()
+
+
+def _server_timing(timings: list, total: float) -> str:
+    """``name;dur=ms`` entries, one per stage in first-seen order, then the total"""
+    durations = {}
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0.0) + seconds
+    durations['total'] = total
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in durations.items())
+
+
+class ProfilingMiddleware:
+    """
+    Profile single requests to PROFILING_VIEWS on demand (see ``tomato_app.profiling``)
+
+    Profiled responses carry ``X-Profile-Id`` and ``X-Profile-Url``, the
+    stored profile on the staff-only listing page. Must come after
+    AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.PROFILING_ENABLED or request.resolver_match.url_name not in settings.PROFILING_VIEWS:
+            return None
+        if asyncio.iscoroutinefunction(view_func):
+            return None
+        mode = profiling.requested_mode(request)
+        if mode is None:
+            return None
+
+        response, profile_id = profiling.profile_view(request, view_func, view_args, view_kwargs, mode)
+        response['X-Profile-Id'] = profile_id
+        response['X-Profile-Url'] = reverse('profile_list') + f'#{profile_id}'
+        return response
+
+
+class MemoryMiddleware:
+    """
+    Count each request's RSS growth, and tracemalloc growth while tracing, by view
+
+    See ``tomato_app.memory``; the first request after the model is ready
+    also records the baseline RSS the recycling policy compares to.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.MEMORY_TRACKING_ENABLED:
+            return self.get_response(request)
+
+        tracing = tracemalloc.is_tracing()
+        traced_before = tracemalloc.get_traced_memory()[0] if tracing else None
+        rss_before = memory.rss_bytes()
+        response = self.get_response(request)
+        rss_after = memory.rss_bytes()
+        traced_after = tracemalloc.get_traced_memory()[0] if tracing and tracemalloc.is_tracing() else None
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match is not None and match.url_name else 'unmatched'
+        memory.record_request(view, rss_before, rss_after, traced_before, traced_after)
+        return response
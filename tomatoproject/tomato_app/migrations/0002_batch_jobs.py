@@ -0,0 +1,80 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import tomato_app.models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tomato_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='queued', max_length=20)),
+                ('total_images', models.PositiveIntegerField(default=0)),
+                ('processed_images', models.PositiveIntegerField(default=0)),
+                ('failed_images', models.PositiveIntegerField(default=0)),
+                ('cancel_requested', models.BooleanField(default=False)),
+                ('error', models.TextField(blank=True)),
+                ('worker', models.CharField(blank=True, max_length=255)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Batch Job',
+                'verbose_name_plural': 'Batch Jobs',
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='prediction',
+            options={'ordering': ['-timestamp'], 'verbose_name': 'Prediction', 'verbose_name_plural': 'Predictions'},
+        ),
+        migrations.AddField(
+            model_name='prediction',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to=tomato_app.models.prediction_image_path),
+        ),
+        migrations.CreateModel(
+            name='BatchJobImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('image', models.ImageField(upload_to=tomato_app.models.batch_job_image_path)),
+                ('image_name', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('prediction', models.CharField(blank=True, max_length=100)),
+                ('confidence', models.FloatField(blank=True, null=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='tomato_app.batchjob')),
+            ],
+            options={
+                'verbose_name': 'Batch Job Image',
+                'verbose_name_plural': 'Batch Job Images',
+                'ordering': ['job', 'position'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='batchjob',
+            index=models.Index(fields=['status', 'created_at'], name='tomato_app__status_2612f8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='batchjobimage',
+            index=models.Index(fields=['job', 'status', 'position'], name='tomato_app__job_id_6ff989_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='batchjobimage',
+            constraint=models.UniqueConstraint(fields=('job', 'position'), name='unique_batch_job_image_position'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:26
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def build_rollups(apps, schema_editor):
+    Prediction = apps.get_model('tomato_app', 'Prediction')
+    DailyPredictionRollup = apps.get_model('tomato_app', 'DailyPredictionRollup')
+    rows = (Prediction.objects.annotate(day=TruncDate('timestamp')).order_by()
+            .values('day', 'prediction')
+            .annotate(count=Count('pk'), confidence_sum=Sum('confidence')))
+    DailyPredictionRollup.objects.bulk_create(DailyPredictionRollup(**row) for row in rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tomato_app', '0003_stored_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyPredictionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('prediction', models.CharField(max_length=100)),
+                ('count', models.IntegerField(default=0)),
+                ('confidence_sum', models.FloatField(default=0.0)),
+            ],
+            options={
+                'verbose_name': 'Daily Prediction Rollup',
+                'verbose_name_plural': 'Daily Prediction Rollups',
+                'ordering': ['-day', 'prediction'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='prediction',
+            index=models.Index(fields=['timestamp'], name='tomato_app__timesta_978c3a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prediction',
+            index=models.Index(fields=['prediction', 'timestamp'], name='tomato_app__predict_54e604_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailypredictionrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'prediction'), name='unique_rollup_day_prediction'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tomato_app', '0005_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModelEvaluation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_version', models.CharField(max_length=255)),
+                ('backend', models.CharField(max_length=50)),
+                ('split', models.CharField(default='test', max_length=20)),
+                ('images', models.PositiveIntegerField()),
+                ('accuracy', models.FloatField()),
+                ('precision', models.FloatField(help_text='Macro average')),
+                ('recall', models.FloatField(help_text='Macro average')),
+                ('f1_score', models.FloatField(help_text='Macro average')),
+                ('per_class', models.JSONField(default=list)),
+                ('class_names', models.JSONField(default=list)),
+                ('confusion_matrix', models.JSONField(default=list)),
+                ('batch_size', models.PositiveIntegerField()),
+                ('images_per_second', models.FloatField()),
+                ('batch_latency_p50_ms', models.FloatField()),
+                ('batch_latency_p95_ms', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Model Evaluation',
+                'verbose_name_plural': 'Model Evaluations',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='modelevaluation',
+            constraint=models.UniqueConstraint(fields=('model_version', 'split'), name='unique_evaluation_version_split'),
+        ),
+    ]
@@ -1,19 +1,37 @@
 """
 Machine Learning Model Handler for Tomato Disease Detection
 """
+import io
 import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from pathlib import Path
 from django.conf import settings
-import tensorflow as tf
-from tensorflow.keras.preprocessing import image
 import numpy as np
 from PIL import Image
 
+from . import metrics
+from .backends import get_backend
+from .metrics import stage
+from .batching import MicroBatcher, QueueFullError
+from .inference_server import InferenceServerUnavailable
+from .prediction_cache import PredictionCache
+from .preprocessing import load_image, to_model_input, to_uint8_array
+
 
 class TomatoDiseasePredictor:
     """Singleton class to handle model loading and predictions"""
     _instance = None
-    _model = None
+    _backend = None
+    _preloaded_backend = None
+    _batcher = None
+    _cache = None
+    _ready = False
+    _load_error = None
+    _load_thread = None
+    _load_lock = threading.Lock()
+    _state_lock = threading.Lock()
     _class_names = [
         "Bacterial Spot", "Early Blight", "Late Blight", "Leaf Mold",
         "Septoria Leaf Spot", "Two-Spotted Spider Mite", "Target Spot",
@@ -26,27 +44,245 @@ class TomatoDiseasePredictor:
         return cls._instance
 
     def __init__(self):
-        if self._model is None:
-            self.load_model()
+        if self._cache is None and settings.PREDICTION_CACHE_ENABLED:
+            self._cache = PredictionCache(
+                max_entries=settings.PREDICTION_CACHE_MAX_ENTRIES,
+                ttl=settings.PREDICTION_CACHE_TTL,
+                disk_dir=settings.PREDICTION_CACHE_DIR or None,
+                disk_max_entries=settings.PREDICTION_CACHE_DISK_MAX_ENTRIES,
+            )
+        # The model (and TensorFlow) is only loaded on first use or by
+        # start_background_load(), so importing this module stays cheap
+
+    @property
+    def is_ready(self) -> bool:
+        """Whether the model is loaded and warmed up"""
+        return self._ready
+
+    @property
+    def load_state(self) -> str:
+        """One of 'idle', 'loading', 'ready' or 'failed'"""
+        if self._ready:
+            return 'ready'
+        if self._load_error is not None:
+            return 'failed'
+        if self._load_thread is not None and self._load_thread.is_alive():
+            return 'loading'
+        return 'idle'
+
+    def ensure_loaded(self) -> bool:
+        """Load the model now if no load has been attempted; returns whether it is loaded"""
+        if not self._ready and self._load_error is None:
+            with self._load_lock:
+                if not self._ready and self._load_error is None:
+                    self.load_model()
+        return self.is_loaded
+
+    def start_background_load(self) -> bool:
+        """
+        Load the model in a background thread
+
+        Returns:
+            True while a load is in progress, False once it has finished
+            (successfully or not)
+        """
+        with self._state_lock:
+            if self._ready or self._load_error is not None:
+                return False
+            if self._load_thread is None or not self._load_thread.is_alive():
+                self._load_thread = threading.Thread(
+                    target=self.ensure_loaded, name='model-loader', daemon=True
+                )
+                self._load_thread.start()
+            return True
+
+    def preload_for_fork(self):
+        """
+        Do the fork-safe part of model loading in the gunicorn master
+
+        Imports the runtime and reads the model file so forked workers share
+        those pages copy-on-write. The runtime itself (and its thread pools)
+        is created in each worker by ``after_fork`` + ``ensure_loaded``.
+        """
+        try:
+            backend = get_backend(settings.INFERENCE_BACKEND)
+            backend.preload()
+        except Exception as e:
+            # Workers will retry the full load and report the error on /readyz
+            print(f"Model preload failed: {e}")
+            return False
+        self._preloaded_backend = backend
+        return True
+
+    def after_fork(self):
+        """Reset per-process state in a freshly forked worker"""
+        # Locks may have been held and threads do not survive fork
+        self._load_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._load_thread = None
+        self._batcher = None
+        if self._cache is not None:
+            self._cache.after_fork()
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether a model is available for predictions"""
+        return self._backend is not None
+
+    @property
+    def backend(self):
+        """The loaded InferenceBackend, or None"""
+        return self._backend
 
-    def load_model(self):
-        """Load the trained model"""
+    @property
+    def model_version(self) -> str:
+        """Identifier of the served model, used to key cached results"""
+        if not self.is_loaded:
+            return ''
+        return self._backend.version
+
+    @property
+    def class_names(self) -> list:
+        """Disease names in the order of the model's output scores"""
+        return list(self._class_names)
+
+    @property
+    def cache(self):
+        """The PredictionCache, or None when PREDICTION_CACHE_ENABLED is off"""
+        return self._cache
+
+    def load_model(self, backend_name: str = None):
+        """Load the trained model with ``backend_name`` (default: INFERENCE_BACKEND)"""
+        self._ready = False
+        if self._batcher is not None:
+            self._batcher.stop()
+            self._batcher = None
+        self._load_error = None
         try:
-            model_path = Path(settings.MODEL_PATH)
-            if model_path.exists():
-                self._model = tf.keras.models.load_model(model_path)
-                print(f"Model loaded successfully from {model_path}")
-            else:
-                # Look for model in parent directory (original structure)
-                alt_path = Path(settings.BASE_DIR).parent / 'models' / 'best_mobilenet_finetuned.keras'
-                if alt_path.exists():
-                    self._model = tf.keras.models.load_model(alt_path)
-                    print(f"Model loaded from alternative path: {alt_path}")
-                else:
-                    raise FileNotFoundError(f"Model not found at {model_path} or {alt_path}")
+            backend = self._preloaded_backend or get_backend(backend_name or settings.INFERENCE_BACKEND)
+            self._preloaded_backend = None
+            backend.load()
+            self._backend = backend
+            print(f"Model loaded successfully: {backend.describe()}")
         except Exception as e:
             print(f"Error loading model: {e}")
-            self._model = None
+            self._backend = None
+            self._load_error = str(e)
+            return
+
+        self.warmup()
+        self._start_batcher()
+        self._ready = True
+
+    def _start_batcher(self):
+        """Create the micro-batcher if batching is on and nothing downstream batches; returns it or None"""
+        with self._state_lock:
+            if self._batcher is None and settings.INFERENCE_BATCHING and self._backend.local_batching:
+                self._batcher = MicroBatcher(
+                    self._infer,
+                    max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+                    max_delay_ms=settings.INFERENCE_MAX_QUEUE_DELAY_MS,
+                    max_queue_depth=settings.INFERENCE_MAX_QUEUE_DEPTH,
+                )
+            return self._batcher
+
+    def warmup(self):
+        """Run the bundled sample images through the model so tracing happens at load time"""
+        warmup_dir = Path(settings.INFERENCE_WARMUP_IMAGES_DIR)
+        paths = sorted(warmup_dir.glob('*.jpg')) if warmup_dir.is_dir() else []
+        if paths:
+            samples = [self.preprocess(load_image(p)) for p in paths]
+        else:
+            samples = [self.preprocess(Image.new('RGB', (224, 224)))]
+
+        try:
+            # Cover every batch size the batcher and predict_batch can produce
+            largest = max(settings.INFERENCE_MAX_BATCH_SIZE, settings.INFERENCE_BATCH_CHUNK_SIZE)
+            self._backend.warmup(samples, largest)
+            print(f"Model warmed up with {len(paths)} sample image(s)")
+        except Exception as e:
+            print(f"Model warm-up failed: {e}")
+
+    def describe(self) -> dict:
+        """Describe the active backend and its load state"""
+        if not self.is_loaded:
+            description = {'backend': settings.INFERENCE_BACKEND, 'loaded': False, 'state': self.load_state}
+            if self._load_error is not None:
+                description['error'] = self._load_error
+            return description
+        return dict(self._backend.describe(), loaded=True, state=self.load_state)
+
+    def _infer(self, batch: np.ndarray) -> np.ndarray:
+        """Run one forward pass over a stacked batch of preprocessed images"""
+        backend = self._backend.name
+        metrics.INFERENCE_BATCH_SIZE.observe(len(batch))
+        start = time.perf_counter()
+        try:
+            return self._backend.infer_batch(batch)
+        except Exception:
+            metrics.INFERENCE_ERRORS.inc(backend=backend)
+            raise
+        finally:
+            metrics.INFERENCE_SECONDS.observe(time.perf_counter() - start, backend=backend)
+
+    def score(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Class scores for a stack of preprocessed samples
+
+        With batching enabled each sample goes through the micro-batcher, so
+        concurrent callers share forward passes.
+        """
+        batcher = self._batcher
+        if batcher is None and settings.INFERENCE_BATCHING and self._backend.local_batching:
+            # A remote backend that fell back to an in-process model
+            batcher = self._start_batcher()
+        if batcher is None:
+            return self._infer(samples)
+
+        futures = [batcher.submit(sample) for sample in samples]
+        try:
+            return np.stack([
+                future.result(timeout=settings.INFERENCE_REQUEST_TIMEOUT) for future in futures
+            ])
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def preprocess(self, img: Image.Image) -> np.ndarray:
+        """Turn an image into the array the active backend consumes"""
+        if self._backend is not None and self._backend.accepts_uint8:
+            # Resize and rescale happen inside the serving graph
+            return to_uint8_array(img)
+        return to_model_input(img)
+
+    def _format_result(self, predictions: np.ndarray) -> dict:
+        """Turn one row of class scores into the prediction result dictionary"""
+        # Get top prediction
+        pred_idx = np.argmax(predictions)
+        pred_name = self._class_names[pred_idx]
+        confidence = float(predictions[pred_idx])
+
+        # Get all predictions with confidence scores
+        all_predictions = [
+            {
+                'disease': str(name),
+                'confidence': float(score),
+                'is_predicted': bool(i == pred_idx)
+            }
+            for i, (name, score) in enumerate(zip(self._class_names, predictions))
+            if float(score) > 0.01  # Filter out very low confidence predictions
+        ]
+
+        # Sort by confidence
+        all_predictions.sort(key=lambda x: x['confidence'], reverse=True)
+
+        return {
+            'success': True,
+            'predicted_class': str(pred_name),
+            'confidence': float(confidence),
+            'all_predictions': all_predictions
+        }
 
     def predict(self, img: Image.Image) -> dict:
         """
@@ -58,50 +294,207 @@ class TomatoDiseasePredictor:
         Returns:
             Dictionary with prediction results
         """
-        if self._model is None:
+        if not self.ensure_loaded():
             return {"success": False, "error": "Model not loaded"}
 
         try:
             # Preprocess image
-            img_resized = img.resize((224, 224))
-            img_array = image.img_to_array(img_resized)
-            img_array = np.expand_dims(img_array, axis=0) / 255.0
-
-            # Make prediction
-            predictions = self._model.predict(img_array, verbose=0)[0]
-
-            # Get top prediction
-            pred_idx = np.argmax(predictions)
-            pred_name = self._class_names[pred_idx]
-            confidence = float(predictions[pred_idx])
-
-            # Get all predictions with confidence scores
-            all_predictions = [
-                {
-                    'disease': str(name),
-                    'confidence': float(score),
-                    'is_predicted': bool(i == pred_idx)
-                }
-                for i, (name, score) in enumerate(zip(self._class_names, predictions))
-                if float(score) > 0.01  # Filter out very low confidence predictions
-            ]
-
-            # Sort by confidence
-            all_predictions.sort(key=lambda x: x['confidence'], reverse=True)
+            with stage('preprocess'):
+                img_array = self.preprocess(img)
 
+            # Make prediction - concurrent callers share one forward pass
+            with stage('inference'):
+                predictions = self.score(np.expand_dims(img_array, axis=0))[0]
+
+            return self._format_result(predictions)
+
+        except QueueFullError as e:
             return {
-                'success': True,
-                'predicted_class': str(pred_name),
-                'confidence': float(confidence),
-                'all_predictions': all_predictions
+                'success': False,
+                'error': f"Server busy: {e}"
+            }
+        except (FutureTimeoutError, TimeoutError):
+            return {
+                'success': False,
+                'error': 'Prediction timed out'
+            }
+        except InferenceServerUnavailable as e:
+            # The in-process fallback model is loading
+            return {
+                'success': False,
+                'error': str(e),
+                'retry_after': settings.MODEL_LOADING_RETRY_AFTER
             }
-
         except Exception as e:
             return {
                 'success': False,
                 'error': str(e)
             }
 
+    def predict_batch(self, images) -> list:
+        """
+        Predict diseases for many images with batched forward passes
+
+        Images are preprocessed, stacked and run through the model in chunks
+        of ``INFERENCE_BATCH_CHUNK_SIZE``. A failure while preprocessing one
+        image, or while running one chunk, only affects those images.
+
+        Args:
+            images: Sequence of PIL Image objects
+
+        Returns:
+            List of prediction result dictionaries, in input order
+        """
+        if not self.ensure_loaded():
+            return [{"success": False, "error": "Model not loaded"} for _ in images]
+
+        results = [None] * len(images)
+        # Group by array shape - raw uint8 inputs keep their decoded size
+        groups = {}  # shape -> (indices, arrays)
+        for i, img in enumerate(images):
+            try:
+                with stage('preprocess'):
+                    array = self.preprocess(img)
+                indices, arrays = groups.setdefault(array.shape, ([], []))
+                indices.append(i)
+                arrays.append(array)
+            except Exception as e:
+                results[i] = {'success': False, 'error': str(e)}
+
+        chunk_size = max(1, settings.INFERENCE_BATCH_CHUNK_SIZE)
+        for indices, arrays in groups.values():
+            for start in range(0, len(arrays), chunk_size):
+                chunk_indices = indices[start:start + chunk_size]
+                try:
+                    with stage('inference'):
+                        scores = self._infer(np.stack(arrays[start:start + chunk_size]))
+                except Exception as e:
+                    for i in chunk_indices:
+                        results[i] = {'success': False, 'error': str(e)}
+                    continue
+
+                for i, predictions in zip(chunk_indices, scores):
+                    results[i] = self._format_result(predictions)
+
+        return results
+
+    def predict_upload(self, uploaded_file) -> dict:
+        """
+        Predict disease from an uploaded image file
+
+        Results are cached by a hash of the file's bytes, so a re-upload of
+        the same photo skips decoding and inference, and identical concurrent
+        uploads share one inference. Raises if the file is not a valid image.
+
+        Args:
+            uploaded_file: Django UploadedFile (or any file-like object)
+
+        Returns:
+            Dictionary with prediction results
+        """
+        with stage('read'):
+            data = _read_upload(uploaded_file)
+        self.ensure_loaded()
+        compute = lambda: self.predict(_decode(data))
+        if self._cache is None or not self.is_loaded:
+            return compute()
+        return self._cache.get_or_compute(PredictionCache.make_key(data, self.model_version), compute)
+
+    def predict_uploads(self, uploaded_files) -> list:
+        """
+        Predict diseases for many uploaded files with batched inference
+
+        Cached files are answered from the cache; the rest are decoded and
+        run through ``predict_batch``. Duplicate files within one call are
+        only predicted once. Files that fail to decode get an error result.
+
+        Args:
+            uploaded_files: Sequence of Django UploadedFile objects
+
+        Returns:
+            List of prediction result dictionaries, in input order
+        """
+        results = [None] * len(uploaded_files)
+        for i, result in self.iter_predict_uploads(uploaded_files):
+            results[i] = result
+        return results
+
+    def iter_predict_uploads(self, uploaded_files, chunk_size: int = None):
+        """
+        Predict many uploaded files chunk by chunk, yielding results as they finish
+
+        Only one chunk of decoded images is held at a time, and each chunk's
+        results are yielded as soon as its forward pass finishes, so memory
+        stays flat and callers can stream results. Cache hits are yielded
+        straight away, which means results do not arrive in input order.
+
+        Args:
+            uploaded_files: Iterable of Django UploadedFile objects
+            chunk_size: Images per forward pass (default: INFERENCE_BATCH_CHUNK_SIZE)
+
+        Yields:
+            ``(index, result)`` pairs, one per input file
+        """
+        self.ensure_loaded()
+        chunk_size = max(1, chunk_size or settings.INFERENCE_BATCH_CHUNK_SIZE)
+        pending = {}  # cache key (or position) -> (image, positions)
+        for i, uploaded_file in enumerate(uploaded_files):
+            try:
+                with stage('read'):
+                    data = _read_upload(uploaded_file)
+                key = i
+                if self._cache is not None and self.is_loaded:
+                    key = PredictionCache.make_key(data, self.model_version)
+                    if key in pending:
+                        pending[key][1].append(i)
+                        continue
+                    cached = self._cache.get(key)
+                    if cached is not None:
+                        yield i, cached
+                        continue
+                pending[key] = (_decode(data), [i])
+            except Exception as e:
+                yield i, {'success': False, 'error': str(e)}
+                continue
+
+            if len(pending) >= chunk_size:
+                yield from self._predict_pending(pending)
+                pending = {}
+
+        yield from self._predict_pending(pending)
+
+    def _predict_pending(self, pending: dict):
+        """Run decoded images through ``predict_batch`` and cache the results"""
+        keys = list(pending)
+        batch_results = self.predict_batch([pending[key][0] for key in keys])
+        for key, result in zip(keys, batch_results):
+            if self._cache is not None and isinstance(key, str):
+                self._cache.set(key, result)
+            for i in pending[key][1]:
+                yield i, result
+
+
+def _decode(data: bytes) -> Image.Image:
+    with stage('decode'):
+        return load_image(io.BytesIO(data))
+
+
+def _read_upload(uploaded_file) -> bytes:
+    """Read the full contents of an uploaded file, leaving it rewound for later saves"""
+    if hasattr(uploaded_file, 'seek'):
+        uploaded_file.seek(0)
+    if hasattr(uploaded_file, 'chunks'):
+        data = b''.join(uploaded_file.chunks())
+    else:
+        data = uploaded_file.read()
+    if hasattr(uploaded_file, 'seek'):
+        uploaded_file.seek(0)
+    return data
+
 
 # Global instance
 predictor = TomatoDiseasePredictor()
+
+metrics.BATCHER_QUEUE_DEPTH.set_function(
+    lambda: predictor._batcher.queue_depth if predictor._batcher is not None else 0
+)
@@ -1,5 +1,7 @@
+from django.core.files.storage import default_storage
 from django.db import models
 import os
+import uuid
 
 
 def prediction_image_path(instance, filename):
@@ -10,9 +12,45 @@ def prediction_image_path(instance, filename):
     return os.path.join('predictions', now.strftime('%Y/%m/%d'), filename)
 
 
+class StoredImage(models.Model):
+    """
+    One image file in the content-addressed store (see ``tomato_app/storage.py``)
+
+    Identical uploads share a row and file; ``ref_count`` counts the
+    predictions pointing at it, and the file is only deleted at zero.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    path = models.CharField(max_length=255)
+    thumbnail_path = models.CharField(max_length=255, blank=True)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    size_bytes = models.PositiveIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.path} ({self.ref_count} refs)"
+
+    @property
+    def url(self) -> str:
+        return default_storage.url(self.path)
+
+    @property
+    def thumbnail_url(self) -> str:
+        """URL of the thumbnail, or of the full image until the thumbnail is generated"""
+        return default_storage.url(self.thumbnail_path or self.path)
+
+    class Meta:
+        verbose_name = 'Stored Image'
+        verbose_name_plural = 'Stored Images'
+
+
 class Prediction(models.Model):
     """Store prediction results for analytics"""
     image = models.ImageField(upload_to=prediction_image_path, null=True, blank=True)
+    stored_image = models.ForeignKey(
+        StoredImage, related_name='predictions', null=True, blank=True, on_delete=models.PROTECT
+    )
     image_name = models.CharField(max_length=255)
     prediction = models.CharField(max_length=100)
     confidence = models.FloatField()
@@ -25,3 +63,167 @@ class Prediction(models.Model):
         ordering = ['-timestamp']
         verbose_name = 'Prediction'
         verbose_name_plural = 'Predictions'
+        indexes = [
+            models.Index(fields=['timestamp']),
+            models.Index(fields=['prediction', 'timestamp']),
+        ]
+
+
+class DailyPredictionRollup(models.Model):
+    """Prediction count and confidence sum per class per day, maintained by ``tomato_app.analytics``"""
+    day = models.DateField()
+    prediction = models.CharField(max_length=100)
+    count = models.IntegerField(default=0)
+    confidence_sum = models.FloatField(default=0.0)
+
+    def __str__(self):
+        return f"{self.day} {self.prediction}: {self.count}"
+
+    @property
+    def avg_confidence(self) -> float:
+        return self.confidence_sum / self.count if self.count else 0.0
+
+    class Meta:
+        ordering = ['-day', 'prediction']
+        verbose_name = 'Daily Prediction Rollup'
+        verbose_name_plural = 'Daily Prediction Rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'prediction'], name='unique_rollup_day_prediction'),
+        ]
+
+
+class Counter(models.Model):
+    """A maintained row count, read by ``tomato_app.counters`` instead of ``COUNT(*)``"""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    reconciled_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class ModelEvaluation(models.Model):
+    """Metrics of one model version on a labelled data split, from ``manage.py evaluate_model``"""
+    model_version = models.CharField(max_length=255)
+    backend = models.CharField(max_length=50)
+    split = models.CharField(max_length=20, default='test')
+    images = models.PositiveIntegerField()
+    accuracy = models.FloatField()
+    precision = models.FloatField(help_text='Macro average')
+    recall = models.FloatField(help_text='Macro average')
+    f1_score = models.FloatField(help_text='Macro average')
+    per_class = models.JSONField(default=list)
+    class_names = models.JSONField(default=list)
+    confusion_matrix = models.JSONField(default=list)
+    batch_size = models.PositiveIntegerField()
+    images_per_second = models.FloatField()
+    batch_latency_p50_ms = models.FloatField()
+    batch_latency_p95_ms = models.FloatField()
+    created_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.model_version} on {self.split}: {self.accuracy:.1%}"
+
+    @property
+    def confusion_rows(self) -> list:
+        """(class name, row of counts) pairs for templates"""
+        return list(zip(self.class_names, self.confusion_matrix))
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Model Evaluation'
+        verbose_name_plural = 'Model Evaluations'
+        constraints = [
+            models.UniqueConstraint(fields=['model_version', 'split'], name='unique_evaluation_version_split'),
+        ]
+
+
+def batch_job_image_path(instance, filename):
+    """Generate upload path for batch job images"""
+    # Create path: batch_jobs/<job id>/filename
+    return os.path.join('batch_jobs', str(instance.job_id), filename)
+
+
+class BatchJob(models.Model):
+    """A batch of images predicted in the background by ``manage.py run_batch_worker``"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_CANCELLED, 'Cancelled'),
+    ]
+    FINISHED_STATUSES = (STATUS_COMPLETED, STATUS_FAILED, STATUS_CANCELLED)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    total_images = models.PositiveIntegerField(default=0)
+    processed_images = models.PositiveIntegerField(default=0)
+    failed_images = models.PositiveIntegerField(default=0)
+    cancel_requested = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+    # Lease held by the worker processing the job; an expired lease means
+    # the worker died and the job can be claimed again
+    worker = models.CharField(max_length=255, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.id} - {self.status} ({self.processed_images}/{self.total_images})"
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in self.FINISHED_STATUSES
+
+    @property
+    def progress(self) -> float:
+        """Fraction of images processed, from 0 to 1"""
+        return self.processed_images / self.total_images if self.total_images else 1.0
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+        verbose_name = 'Batch Job'
+        verbose_name_plural = 'Batch Jobs'
+
+
+class BatchJobImage(models.Model):
+    """One image of a BatchJob and its prediction result"""
+    STATUS_PENDING = 'pending'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    job = models.ForeignKey(BatchJob, related_name='images', on_delete=models.CASCADE)
+    position = models.PositiveIntegerField()
+    image = models.ImageField(upload_to=batch_job_image_path)
+    image_name = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    prediction = models.CharField(max_length=100, blank=True)
+    confidence = models.FloatField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.image_name} - {self.status}"
+
+    class Meta:
+        ordering = ['job', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'position'], name='unique_batch_job_image_position'),
+        ]
+        indexes = [models.Index(fields=['job', 'status', 'position'])]
+        verbose_name = 'Batch Job Image'
+        verbose_name_plural = 'Batch Job Images'
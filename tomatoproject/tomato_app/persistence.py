@@ -0,0 +1,230 @@
+"""
+Write-behind persistence for Prediction rows
+
+Views hand finished predictions to a PredictionWriter instead of calling
+``Prediction.objects.create``. Images are compacted into the
+content-addressed store (``tomato_app/storage.py``) by a small I/O thread
+pool before the view renders them, and rows are buffered and inserted with
+one ``bulk_create`` per transaction every PREDICTION_FLUSH_ROWS rows or
+PREDICTION_FLUSH_INTERVAL_MS milliseconds, whichever comes first. The
+buffer is flushed at interpreter exit. With PREDICTION_WRITE_BEHIND off,
+rows and files are written synchronously as before.
+"""
+import atexit
+import copy
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from .analytics import record_predictions
+from .models import Prediction
+from .storage import store_image
+
+logger = logging.getLogger(__name__)
+
+
+class PredictionWriter:
+    """Buffer Prediction rows and insert them in batches from a background thread"""
+
+    def __init__(self, flush_rows: int = 100, flush_interval_ms: float = 200.0, io_threads: int = 2):
+        """
+        Args:
+            flush_rows: Buffered rows that trigger an immediate flush
+            flush_interval_ms: Longest a row waits in the buffer
+            io_threads: Threads writing image files
+        """
+        self.flush_rows = max(1, int(flush_rows))
+        self.flush_interval = max(1.0, float(flush_interval_ms)) / 1000.0
+        self._io = ThreadPoolExecutor(max(1, int(io_threads)), thread_name_prefix='prediction-io')
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='prediction-writer', daemon=True)
+        self._thread.start()
+
+    def save(self, prediction: Prediction, image_file=None) -> Prediction:
+        """
+        Store a Prediction's image now and queue its row for the next bulk insert
+
+        Args:
+            prediction: Unsaved Prediction
+            image_file: Uploaded file to store as ``prediction.image``
+
+        Returns:
+            The same Prediction, see ``save_many``
+        """
+        return self.save_many([(prediction, image_file)])[0]
+
+    def save_many(self, items) -> list:
+        """
+        ``save`` for several predictions, compacting their images in parallel
+
+        The images are written by the I/O pool before this returns, so
+        ``prediction.image.url`` can be rendered straight away; only the
+        rows are deferred. The writer buffers its own copy of each
+        Prediction, so the caller's objects are never touched by another
+        thread and keep ``pk=None``.
+
+        Args:
+            items: ``(prediction, image_file)`` pairs; ``image_file`` may be None
+
+        Returns:
+            The predictions, in order
+        """
+        if self._closed:
+            return [save_prediction_now(prediction, image_file) for prediction, image_file in items]
+
+        futures = [self._submit(_read_file(image_file)) if image_file is not None else None
+                   for _, image_file in items]
+        for (prediction, _), future in zip(items, futures):
+            if future is not None:
+                try:
+                    stored = future.result()
+                    prediction.stored_image = stored
+                    prediction.image.name = stored.path
+                except Exception:
+                    logger.exception("Could not store image for %s; saving the prediction without it",
+                                     prediction.image_name)
+                    prediction.image = None
+            self._enqueue(copy.copy(prediction))
+        if self._closed:
+            # Closed meanwhile - its final flush may already have run
+            self.flush()
+        return [prediction for prediction, _ in items]
+
+    def _submit(self, data: bytes) -> Future:
+        try:
+            return self._io.submit(self._store_image, data)
+        except RuntimeError:
+            # The writer was closed meanwhile; store on this thread instead
+            future = Future()
+            try:
+                future.set_result(store_image(data))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+    @staticmethod
+    def _store_image(data: bytes):
+        try:
+            return store_image(data)
+        finally:
+            close_old_connections()
+
+    def _enqueue(self, prediction: Prediction):
+        with self._lock:
+            self._buffer.append(prediction)
+            full = len(self._buffer) >= self.flush_rows
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+        # This thread's DB connection is not reused by request handling
+        connection.close()
+
+    def flush(self) -> int:
+        """Insert everything buffered so far; returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+
+            close_old_connections()
+            try:
+                with transaction.atomic():
+                    Prediction.objects.bulk_create(batch)
+                    record_predictions(batch)
+                return len(batch)
+            except Exception:
+                logger.exception("Bulk insert of %d predictions failed; retrying row by row", len(batch))
+
+            written = 0
+            for prediction in batch:
+                try:
+                    prediction.save()
+                    written += 1
+                except Exception:
+                    logger.exception("Dropping prediction for %s", prediction.image_name)
+            return written
+
+    def close(self, timeout: float = None):
+        """Finish pending image writes, flush the buffer and stop the writer thread"""
+        if self._closed:
+            return
+        self._io.shutdown(wait=True)
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self.flush()
+
+
+def _read_file(image_file) -> bytes:
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    return image_file.read()
+
+
+def save_prediction_now(prediction: Prediction, image_file=None) -> Prediction:
+    """Write a Prediction and its image synchronously"""
+    if image_file is not None:
+        stored = store_image(_read_file(image_file))
+        prediction.stored_image = stored
+        prediction.image.name = stored.path
+    prediction.save()
+    return prediction
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_prediction_writer():
+    """The process-wide PredictionWriter, or None when PREDICTION_WRITE_BEHIND is off"""
+    global _writer
+    if not settings.PREDICTION_WRITE_BEHIND:
+        return None
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = PredictionWriter(
+                    flush_rows=settings.PREDICTION_FLUSH_ROWS,
+                    flush_interval_ms=settings.PREDICTION_FLUSH_INTERVAL_MS,
+                    io_threads=settings.PREDICTION_IMAGE_IO_THREADS,
+                )
+                atexit.register(_writer.close)
+    return _writer
+
+
+def save_prediction(prediction: Prediction, image_file=None) -> Prediction:
+    """Persist a Prediction write-behind, or synchronously when PREDICTION_WRITE_BEHIND is off"""
+    writer = get_prediction_writer()
+    if writer is None:
+        return save_prediction_now(prediction, image_file)
+    return writer.save(prediction, image_file)
+
+
+def save_predictions(items) -> list:
+    """``save_prediction`` for ``(prediction, image_file)`` pairs, storing their images in parallel"""
+    writer = get_prediction_writer()
+    if writer is None:
+        return [save_prediction_now(prediction, image_file) for prediction, image_file in items]
+    return writer.save_many(items)
+
+
+def flush_predictions():
+    """Write out buffered predictions and stop the writer (e.g. when a worker exits)"""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
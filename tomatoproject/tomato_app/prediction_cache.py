@@ -0,0 +1,257 @@
+"""
+Content-hash cache for prediction results
+
+Results are keyed by a SHA-256 of the uploaded bytes plus the model version,
+so re-uploads of the same photo skip decoding and inference. The cache has an
+in-process LRU tier and an optional on-disk tier shared by every gunicorn
+worker on the host. Identical concurrent uploads are coalesced so only one of
+them runs inference.
+"""
+import copy
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PredictionCache:
+    """Two-tier (memory + optional disk) prediction result cache with single-flight"""
+
+    # Disk eviction scans the directory, so only do it every N writes
+    DISK_EVICTION_INTERVAL = 100
+
+    def __init__(self, max_entries=1024, ttl=3600, disk_dir=None, disk_max_entries=10000):
+        """
+        Args:
+            max_entries: Results kept in the in-process LRU tier
+            ttl: Seconds a result stays valid in either tier (0 disables expiry)
+            disk_dir: Directory for the shared on-disk tier, or None to disable it
+            disk_max_entries: Files kept in the on-disk tier before the oldest are evicted
+        """
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_entries = max(1, int(disk_max_entries))
+
+        self._memory = OrderedDict()  # key -> (stored_at, result)
+        self._inflight = {}           # key -> Future of the request computing it
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(data: bytes, model_version: str) -> str:
+        """Cache key for an upload's raw bytes under a given model version"""
+        digest = hashlib.sha256(model_version.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """Return a cached result or None, checking memory then disk"""
+        result = self._lookup(key)
+        if result is None:
+            self._count_miss()
+        return result
+
+    def _lookup(self, key: str):
+        """``get`` without counting a miss"""
+        with self._lock:
+            result = self._get_memory(key)
+            if result is not None:
+                self.hits += 1
+                metrics.CACHE_LOOKUPS.inc(result='hit')
+                return copy.deepcopy(result)
+
+        result = self._get_disk(key)
+        with self._lock:
+            if result is not None:
+                self.disk_hits += 1
+                metrics.CACHE_LOOKUPS.inc(result='disk_hit')
+                self._set_memory(key, result)
+                return copy.deepcopy(result)
+        return None
+
+    def _count_miss(self):
+        with self._lock:
+            self.misses += 1
+        metrics.CACHE_LOOKUPS.inc(result='miss')
+
+    def set(self, key: str, result: dict):
+        """Store a successful result in both tiers"""
+        if not result.get('success'):
+            return
+        with self._lock:
+            self._set_memory(key, result)
+        self._set_disk(key, result)
+
+    def get_or_compute(self, key: str, compute) -> dict:
+        """
+        Return the cached result for ``key`` or compute it exactly once
+
+        Concurrent callers with the same key wait for the first caller's
+        ``compute()`` instead of running their own.
+        """
+        result = self._lookup(key)
+        if result is not None:
+            return result
+
+        with self._lock:
+            # Another request may have finished computing it since the lookup
+            result = self._get_memory(key)
+            if result is not None:
+                self.hits += 1
+                metrics.CACHE_LOOKUPS.inc(result='hit')
+                return copy.deepcopy(result)
+
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced += 1
+                metrics.CACHE_LOOKUPS.inc(result='coalesced')
+
+        if not owner:
+            return copy.deepcopy(future.result())
+
+        # Only the request that computes the result counts as a miss
+        self._count_miss()
+
+        try:
+            result = compute()
+            self.set(key, result)
+            future.set_result(result)
+            # The memory tier holds ``result`` itself
+            return copy.deepcopy(result)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        """Hit/miss counters and tier sizes for sizing the cache"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'entries': len(self._memory),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'disk_enabled': self.disk_dir is not None,
+            }
+
+    def after_fork(self):
+        """Reset locks and in-flight requests inherited from the parent process"""
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def clear(self):
+        """Drop the in-process tier"""
+        with self._lock:
+            self._memory.clear()
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl > 0 and time.time() - stored_at > self.ttl
+
+    def _get_memory(self, key):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        stored_at, result = entry
+        if self._expired(stored_at):
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return result
+
+    def _set_memory(self, key, result):
+        self._memory[key] = (time.time(), result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_path(self, key) -> Path:
+        return self.disk_dir / key[:2] / f'{key}.json'
+
+    def _get_disk(self, key):
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            if self._expired(path.stat().st_mtime):
+                path.unlink(missing_ok=True)
+                return None
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _set_disk(self, key, result):
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key)
+        tmp_path = None
+        try:
+            path.parent.mkdir(exist_ok=True)
+            # Write then rename so other workers never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(result, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            # TypeError/ValueError: the result is not JSON-serializable
+            logger.warning("Could not write prediction cache entry %s: %s", path, e)
+            if tmp_path is not None:
+                Path(tmp_path).unlink(missing_ok=True)
+            return
+
+        with self._lock:
+            self._disk_writes += 1
+            evict = self._disk_writes % self.DISK_EVICTION_INTERVAL == 0
+        if evict:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Remove expired files and the oldest files beyond disk_max_entries"""
+        entries = []
+        for path in self.disk_dir.glob('*/*.json'):
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+
+        entries.sort()
+        excess = len(entries) - self.disk_max_entries
+        for i, (mtime, path) in enumerate(entries):
+            if i < excess or self._expired(mtime):
+                path.unlink(missing_ok=True)
+            else:
+                break
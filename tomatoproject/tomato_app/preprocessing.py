@@ -0,0 +1,85 @@
+"""
+Image decoding and resizing for model input
+
+Phone photos are often 12+ megapixels but the model only needs 224x224.
+With IMAGE_JPEG_DRAFT enabled, JPEGs are decoded with PIL's draft mode, which
+lets libjpeg downscale by 1/2, 1/4 or 1/8 in the DCT domain while decoding,
+so most of the full-resolution decode work is never done.
+"""
+import numpy as np
+from PIL import Image
+from django.conf import settings
+
+MODEL_INPUT_SIZE = (224, 224)
+
+RESAMPLE_FILTERS = {
+    'nearest': Image.Resampling.NEAREST,
+    'box': Image.Resampling.BOX,
+    'bilinear': Image.Resampling.BILINEAR,
+    'hamming': Image.Resampling.HAMMING,
+    'bicubic': Image.Resampling.BICUBIC,
+    'lanczos': Image.Resampling.LANCZOS,
+}
+
+
+def resample_filter(name: str = None):
+    """Map a filter name (default IMAGE_RESAMPLE_FILTER) to a PIL resampling filter"""
+    name = (name or settings.IMAGE_RESAMPLE_FILTER).lower()
+    try:
+        return RESAMPLE_FILTERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown resample filter '{name}' (choose from {', '.join(RESAMPLE_FILTERS)})")
+
+
+def load_image(source, target_size=MODEL_INPUT_SIZE, draft=None) -> Image.Image:
+    """
+    Decode an image file to RGB, decoding JPEGs close to ``target_size``
+
+    Draft mode never goes below ``target_size``, so the final resize still
+    downsamples.
+
+    Args:
+        source: Path or binary file-like object
+        target_size: Size the image will be resized to afterwards
+        draft: Use JPEG draft mode (default: IMAGE_JPEG_DRAFT)
+    """
+    if draft is None:
+        draft = settings.IMAGE_JPEG_DRAFT
+
+    img = Image.open(source)
+    if draft and img.format == 'JPEG':
+        img.draft('RGB', target_size)
+    return img.convert('RGB')
+
+
+def resize_image(img: Image.Image, size=MODEL_INPUT_SIZE, resample=None, reducing_gap=None) -> Image.Image:
+    """
+    Resize an image to the model input size
+
+    Args:
+        img: PIL Image
+        size: Output size
+        resample: Filter name (default: IMAGE_RESAMPLE_FILTER)
+        reducing_gap: Pillow ``reducing_gap`` (default: IMAGE_REDUCING_GAP,
+            where 0 disables it). Larger values are closer to a full
+            resample; smaller values are faster.
+    """
+    if reducing_gap is None:
+        reducing_gap = settings.IMAGE_REDUCING_GAP
+    if img.size == tuple(size):
+        return img
+    return img.resize(size, resample=resample_filter(resample), reducing_gap=reducing_gap or None)
+
+
+def to_model_input(img: Image.Image) -> np.ndarray:
+    """Resize and normalize an image into a (224, 224, 3) float32 array in [0, 1]"""
+    return np.asarray(resize_image(img), dtype=np.float32) / 255.0
+
+
+def to_uint8_array(img: Image.Image) -> np.ndarray:
+    """
+    Raw (H, W, 3) uint8 pixels for backends that resize and rescale in-graph
+
+    No float copy is made; the array is what the serving graph consumes.
+    """
+    return np.asarray(img, dtype=np.uint8)
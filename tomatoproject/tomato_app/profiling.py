@@ -0,0 +1,398 @@
+"""
+On-demand profiling of single prediction requests, and an always-on sampler
+
+A request to one of PROFILING_VIEWS is profiled when it is made by a staff
+user with ``?profile=sampling`` (or ``cprofile``), or when it carries an
+``X-Profile-Token`` header made by ``make_token``. The view runs under the
+profiler and the result is written to a directory in PROFILING_DIR, which
+keeps the newest PROFILING_MAX_PROFILES profiles:
+
+- ``meta.json``: view, timings of the request's stages, response status
+- ``stacks.collapsed``: sampled stacks, one ``frame;frame;... count`` per line
+  (flamegraph.pl / speedscope input)
+- ``speedscope.json``: the same samples in speedscope's own format
+- ``cprofile.txt``: cProfile statistics (``cprofile`` mode only)
+- ``tf/``: TensorFlow profiler trace of the forward pass, for TensorBoard
+  (keras backend only)
+
+With SAMPLING_PROFILER_ENABLED, every gunicorn worker also runs a
+``ContinuousProfiler`` that samples all of its threads at a low rate and
+writes a collapsed-stack file every SAMPLING_PROFILER_ROTATE_SECONDS;
+``manage.py merge_profiles`` combines them into one flame graph.
+"""
+import cProfile
+import functools
+import importlib.util
+import io
+import json
+import logging
+import os
+import pstats
+import shutil
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+MODES = ('sampling', 'cprofile')
+TOKEN_SALT = 'tomato_app.profiling'
+PROFILE_FILES = ('meta.json', 'stacks.collapsed', 'speedscope.json', 'cprofile.txt')
+
+# The TensorFlow profiler is process-wide, so only one request traces at a time
+_tf_trace_lock = threading.Lock()
+
+# (file name, function) of Python frames that block waiting for work. Threads
+# whose innermost frame is one of these are idle and left out of samples.
+IDLE_FRAMES = {
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    ('selectors.py', 'select'),
+    ('socket.py', 'accept'),
+    ('socket.py', 'readinto'),
+    ('sync.py', 'wait'),  # gunicorn sync worker between requests
+}
+
+
+class StackSampler:
+    """Samples thread stacks from a background thread and counts identical stacks"""
+
+    def __init__(self, interval: float, thread_ids=None, include_idle: bool = True):
+        """
+        Args:
+            interval: Seconds between samples
+            thread_ids: Threads to sample (``threading.get_ident()`` values),
+                or None for every thread except the sampler itself
+            include_idle: Also count threads blocked in one of IDLE_FRAMES
+        """
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.include_idle = include_idle
+        self.counts = Counter()  # stack tuple (root first) -> samples
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def take(self) -> Counter:
+        """Return the stacks counted so far and start counting afresh"""
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        return counts
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.sample(own)
+
+    def sample(self, own: int = None):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        frames = sys._current_frames()
+        with self._lock:
+            for ident, frame in frames.items():
+                if ident == own or (self.thread_ids is not None and ident not in self.thread_ids):
+                    continue
+                if not self.include_idle and _is_idle(frame):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                if self.thread_ids is None:
+                    # Keep threads apart in whole-process profiles
+                    stack.append(names.get(ident, 'thread'))
+                self.counts[tuple(reversed(stack))] += 1
+                self.samples += 1
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+class ContinuousProfiler(StackSampler):
+    """
+    Low-rate sampler of every thread that dumps collapsed stacks periodically
+
+    Each dump goes to ``<directory>/<host>-<pid>-<time>.collapsed``; only the
+    newest ``max_files`` dumps (of all processes) are kept.
+    """
+
+    def __init__(self, directory, interval: float, rotate_seconds: float, max_files: int, include_idle=False):
+        super().__init__(interval, include_idle=include_idle)
+        self.directory = Path(directory)
+        self.rotate_seconds = rotate_seconds
+        self.max_files = max_files
+        self.pid = os.getpid()
+
+    def _run(self):
+        own = threading.get_ident()
+        next_dump = time.monotonic() + self.rotate_seconds
+        while not self._stop.wait(self.interval):
+            start = time.perf_counter()
+            self.sample(own)
+            metrics.PROFILER_SAMPLING_SECONDS.inc(time.perf_counter() - start)
+            if time.monotonic() >= next_dump:
+                self.dump()
+                next_dump = time.monotonic() + self.rotate_seconds
+
+    def stop(self):
+        super().stop()
+        self.dump()
+
+    def dump(self):
+        """Write the stacks counted since the last dump, then prune old dumps"""
+        counts = self.take()
+        if not counts:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            name = f"{socket.gethostname()}-{self.pid}-{timezone.now():%Y%m%d-%H%M%S}.collapsed"
+            tmp = self.directory / f'.{name}.tmp'
+            tmp.write_text(collapsed(counts))
+            os.replace(tmp, self.directory / name)
+            dumps = sorted(self.directory.glob('*.collapsed'), key=lambda p: p.stat().st_mtime, reverse=True)
+            for path in dumps[self.max_files:]:
+                path.unlink(missing_ok=True)
+        except OSError:
+            logger.exception("Could not write sampling profiler dump")
+
+
+_continuous_profiler = None
+
+
+def start_sampling_profiler() -> bool:
+    """Start this process's ContinuousProfiler if SAMPLING_PROFILER_ENABLED; True if it runs"""
+    global _continuous_profiler
+    if not settings.SAMPLING_PROFILER_ENABLED:
+        return False
+    if _continuous_profiler is None or _continuous_profiler.pid != os.getpid():
+        _continuous_profiler = ContinuousProfiler(
+            settings.SAMPLING_PROFILER_DIR,
+            interval=settings.SAMPLING_PROFILER_INTERVAL_MS / 1000,
+            rotate_seconds=settings.SAMPLING_PROFILER_ROTATE_SECONDS,
+            max_files=settings.SAMPLING_PROFILER_MAX_FILES,
+            include_idle=settings.SAMPLING_PROFILER_INCLUDE_IDLE,
+        )
+        _continuous_profiler.start()
+    return True
+
+
+def stop_sampling_profiler():
+    """Stop this process's ContinuousProfiler, writing out its last samples"""
+    global _continuous_profiler
+    if _continuous_profiler is not None and _continuous_profiler.pid == os.getpid():
+        _continuous_profiler.stop()
+    _continuous_profiler = None
+
+
+def frame_name(frame) -> str:
+    """``function (file:line)`` with the file relative to the project or sys.path"""
+    code = frame.f_code
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+@functools.lru_cache(maxsize=4096)
+def _short_path(filename: str) -> str:
+    prefixes = [str(settings.BASE_DIR)] + [p for p in sys.path if p]
+    # Longest first, so site-packages wins over the stdlib directory above it
+    for prefix in sorted((p + os.sep for p in prefixes), key=len, reverse=True):
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    return filename
+
+
+def collapsed(counts: Counter) -> str:
+    """Stacks in the collapsed format read by flamegraph.pl and speedscope"""
+    return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in counts.most_common())
+
+
+def parse_collapsed(text: str) -> Counter:
+    """Inverse of ``collapsed``"""
+    counts = Counter()
+    for line in text.splitlines():
+        stack, _, count = line.rpartition(' ')
+        if stack and count.isdigit():
+            counts[tuple(stack.split(';'))] += int(count)
+    return counts
+
+
+def speedscope(counts: Counter, name: str, interval: float) -> dict:
+    """Stacks as a speedscope "sampled" profile, weighted in milliseconds"""
+    frames, index = [], {}
+    samples, weights = [], []
+    for stack, count in counts.most_common():
+        indices = []
+        for frame in stack:
+            if frame not in index:
+                index[frame] = len(frames)
+                frames.append({'name': frame})
+            indices.append(index[frame])
+        samples.append(indices)
+        weights.append(count * interval * 1000)
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'tomato_app.profiling',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled', 'name': name, 'unit': 'milliseconds',
+            'startValue': 0, 'endValue': sum(weights),
+            'samples': samples, 'weights': weights,
+        }],
+    }
+
+
+# --- Triggering --------------------------------------------------------------
+
+def make_token(mode: str = 'sampling') -> str:
+    """A signed ``X-Profile-Token`` value, valid for PROFILING_TOKEN_MAX_AGE seconds"""
+    return signing.dumps({'mode': mode}, salt=TOKEN_SALT)
+
+
+def requested_mode(request):
+    """The profiling mode requested for this request, or None"""
+    token = request.headers.get('X-Profile-Token')
+    if token:
+        try:
+            mode = signing.loads(token, salt=TOKEN_SALT, max_age=settings.PROFILING_TOKEN_MAX_AGE)['mode']
+        except (signing.BadSignature, KeyError, TypeError):
+            logger.warning("Ignoring invalid X-Profile-Token")
+            return None
+        return mode if mode in MODES else None
+
+    mode = request.GET.get('profile')
+    user = getattr(request, 'user', None)
+    if mode and user is not None and user.is_staff:
+        return mode if mode in MODES else 'sampling'
+    return None
+
+
+# --- Profiling a view ----------------------------------------------------------
+
+def _tf_trace_available() -> bool:
+    from .ml_model import predictor
+
+    return (settings.PROFILING_TF_TRACE and predictor.is_loaded and predictor.backend.name == 'keras'
+            and importlib.util.find_spec('tensorflow') is not None)
+
+
+def profile_view(request, view, args, kwargs, mode: str):
+    """
+    Run ``view`` under the profiler and store the profile
+
+    Returns:
+        ``(response, profile id)``
+    """
+    profile_id = f"{timezone.now():%Y%m%d-%H%M%S.%f}-{request.resolver_match.url_name}-{uuid.uuid4().hex[:6]}"
+    directory = Path(settings.PROFILING_DIR) / profile_id
+    directory.mkdir(parents=True)
+
+    # The forward pass may run on the micro-batcher's thread; the TF trace
+    # covers it either way, along with any other request's passes meanwhile
+    tf_trace = _tf_trace_available() and _tf_trace_lock.acquire(blocking=False)
+    if tf_trace:
+        import tensorflow as tf
+
+        tf.profiler.experimental.start(str(directory / 'tf'))
+
+    interval = settings.PROFILING_SAMPLE_INTERVAL_MS / 1000
+    sampler = StackSampler(interval, thread_ids={threading.get_ident()})
+    profiler = cProfile.Profile() if mode == 'cprofile' else None
+    start = time.perf_counter()
+    sampler.start()
+    try:
+        if profiler is not None:
+            response = profiler.runcall(view, request, *args, **kwargs)
+        else:
+            response = view(request, *args, **kwargs)
+    finally:
+        sampler.stop()
+        elapsed = time.perf_counter() - start
+        if tf_trace:
+            try:
+                tf.profiler.experimental.stop()
+            finally:
+                _tf_trace_lock.release()
+
+    counts = sampler.take()
+    (directory / 'stacks.collapsed').write_text(collapsed(counts))
+    (directory / 'speedscope.json').write_text(json.dumps(speedscope(counts, profile_id, interval)))
+    if profiler is not None:
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(100)
+        (directory / 'cprofile.txt').write_text(out.getvalue())
+    (directory / 'meta.json').write_text(json.dumps({
+        'id': profile_id,
+        'created_at': timezone.now().isoformat(),
+        'view': request.resolver_match.url_name,
+        'method': request.method,
+        'path': request.path,
+        'mode': mode,
+        'status': response.status_code,
+        'seconds': elapsed,
+        'samples': sampler.samples,
+        'sample_interval_ms': settings.PROFILING_SAMPLE_INTERVAL_MS,
+        'stages': metrics.current_timings(),
+        'tf_trace': bool(tf_trace),
+        'pid': os.getpid(),
+    }, indent=2))
+    prune()
+    return response, profile_id
+
+
+# --- The profile ring ------------------------------------------------------------
+
+def prune():
+    """Delete the oldest profiles beyond PROFILING_MAX_PROFILES"""
+    for directory in _profile_dirs()[settings.PROFILING_MAX_PROFILES:]:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _profile_dirs() -> list:
+    root = Path(settings.PROFILING_DIR)
+    if not root.is_dir():
+        return []
+    # Ids start with a timestamp, so newest first is reverse name order
+    return sorted((path for path in root.iterdir() if path.is_dir()), key=lambda p: p.name, reverse=True)
+
+
+def list_profiles() -> list:
+    """Metadata of stored profiles, newest first"""
+    profiles = []
+    for directory in _profile_dirs():
+        try:
+            meta = json.loads((directory / 'meta.json').read_text())
+        except (OSError, ValueError):
+            continue  # Still being written, or pruned meanwhile
+        meta['files'] = [name for name in PROFILE_FILES if (directory / name).exists()]
+        profiles.append(meta)
+    return profiles
+
+
+def profile_file(profile_id: str, name: str):
+    """Path of one file of a stored profile, or None"""
+    if name not in PROFILE_FILES or Path(profile_id).name != profile_id:
+        return None
+    path = Path(settings.PROFILING_DIR) / profile_id / name
+    return path if path.is_file() else None
@@ -0,0 +1,227 @@
+"""
+Content-addressed, compacted storage for prediction images
+
+Each distinct upload is stored once, under a path derived from the SHA-256
+of its bytes (``images/ab/cd/abcd....webp``), after being transcoded to
+IMAGE_STORAGE_FORMAT with its longest side capped at IMAGE_STORAGE_MAX_SIDE.
+Thumbnails are generated by a background thread pool; an image whose
+thumbnail could not be scheduled is shown full size. StoredImage rows
+count the predictions referencing each file, and a file is only deleted
+once nothing references it.
+
+Reference counts err on the side of keeping files: a prediction row that
+fails to insert after its image was acquired leaves a count that is one
+too high, never one too low.
+"""
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from PIL import Image, ImageOps, features
+
+from .models import Prediction, StoredImage
+
+logger = logging.getLogger(__name__)
+
+FORMAT_EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+
+@dataclass
+class ImageFile:
+    """A compacted image written to storage, not yet referenced in the database"""
+    sha256: str
+    path: str
+    width: int
+    height: int
+    size_bytes: int
+
+
+def storage_format() -> str:
+    """IMAGE_STORAGE_FORMAT, falling back to JPEG when Pillow lacks WebP support"""
+    fmt = settings.IMAGE_STORAGE_FORMAT.lower()
+    if fmt not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Unknown IMAGE_STORAGE_FORMAT '{fmt}' (choose from {', '.join(FORMAT_EXTENSIONS)})")
+    if fmt == 'webp' and not features.check('webp'):
+        return 'jpeg'
+    return fmt
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def image_path(sha256: str, prefix: str = 'images') -> str:
+    """Storage path for a hash, fanned out over two directory levels"""
+    return f"{prefix}/{sha256[:2]}/{sha256[2:4]}/{sha256}.{FORMAT_EXTENSIONS[storage_format()]}"
+
+
+def _encode(img: Image.Image, max_side: int) -> bytes:
+    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, format=storage_format().upper(), quality=settings.IMAGE_STORAGE_QUALITY)
+    return buffer.getvalue()
+
+
+def compact_image(data: bytes):
+    """
+    Decode an upload and re-encode it for storage
+
+    Applies the EXIF orientation (the stored copy drops EXIF), caps the
+    longest side at IMAGE_STORAGE_MAX_SIDE and encodes as
+    IMAGE_STORAGE_FORMAT.
+
+    Returns:
+        ``(encoded bytes, width, height)``
+    """
+    max_side = settings.IMAGE_STORAGE_MAX_SIDE
+    img = Image.open(io.BytesIO(data))
+    if img.format == 'JPEG':
+        # Let libjpeg decode at a reduced scale when the photo is much larger
+        img.draft('RGB', (max_side, max_side))
+    img = ImageOps.exif_transpose(img).convert('RGB')
+    encoded = _encode(img, max_side)
+    width, height = img.size
+    return encoded, width, height
+
+
+def write_image(data: bytes, sha256: str = None) -> ImageFile:
+    """Compact and write an upload to its content-addressed path, unless already stored"""
+    sha256 = sha256 or content_hash(data)
+    path = image_path(sha256)
+    if default_storage.exists(path):
+        with default_storage.open(path, 'rb') as f:
+            width, height = Image.open(f).size  # reads the header only
+        return ImageFile(sha256, path, width, height, default_storage.size(path))
+
+    encoded, width, height = compact_image(data)
+    saved = default_storage.save(path, ContentFile(encoded))
+    if saved != path:
+        # Another thread or process stored the same content meanwhile
+        default_storage.delete(saved)
+    return ImageFile(sha256, path, width, height, len(encoded))
+
+
+def _acquire(image_file: ImageFile, count: int = 1) -> StoredImage:
+    """Add ``count`` references to a written image, creating its row if needed"""
+    # Write before reading: on SQLite a transaction that reads and then
+    # writes fails at once with "database is locked" under contention
+    while True:
+        if StoredImage.objects.filter(sha256=image_file.sha256).update(ref_count=F('ref_count') + count):
+            # Our reference keeps release() from deleting the row
+            stored, created = StoredImage.objects.get(sha256=image_file.sha256), False
+            break
+        try:
+            with transaction.atomic():
+                stored = StoredImage.objects.create(
+                    sha256=image_file.sha256,
+                    path=image_file.path,
+                    width=image_file.width,
+                    height=image_file.height,
+                    size_bytes=image_file.size_bytes,
+                    ref_count=count,
+                )
+            created = True
+            break
+        except IntegrityError:
+            # Created concurrently - take a reference on that row instead
+            continue
+
+    if created:
+        # After commit, so the thumbnail thread can see the row
+        transaction.on_commit(lambda: _schedule_thumbnail(stored.pk))
+    return stored
+
+
+def _schedule_thumbnail(stored_image_id: int):
+    try:
+        thumbnail_pool().submit(_make_thumbnail, stored_image_id)
+    except RuntimeError:
+        # The pool refuses work during interpreter shutdown. The image stays
+        # without a thumbnail; thumbnail_url falls back to the full image.
+        logger.info("Skipping the thumbnail for stored image %s", stored_image_id)
+
+
+def store_image(data: bytes) -> StoredImage:
+    """
+    Store an upload (if its content is new) and take one reference to it
+
+    Returns:
+        The StoredImage; its ``path`` is the name to give an ImageField
+    """
+    sha256 = content_hash(data)
+    stored = _acquire(write_image(data, sha256))
+    if not default_storage.exists(stored.path):
+        # A release deleted the file between our write and our acquire
+        try:
+            write_image(data, sha256)
+        except Exception:
+            release(stored.pk)
+            raise
+    return stored
+
+
+def release(stored_image_id: int, count: int = 1):
+    """Drop references to a stored image, deleting it and its files at zero"""
+    with transaction.atomic():
+        StoredImage.objects.filter(pk=stored_image_id).update(ref_count=F('ref_count') - count)
+        # Never delete an image a prediction still points at, even if the count drifted
+        orphan = StoredImage.objects.filter(
+            pk=stored_image_id, ref_count__lte=0, predictions__isnull=True
+        ).first()
+        if orphan is None:
+            return
+        orphan.delete()
+        paths = [orphan.path] + ([orphan.thumbnail_path] if orphan.thumbnail_path else [])
+        # Only touch the files once the row is really gone
+        transaction.on_commit(lambda: [default_storage.delete(path) for path in paths])
+
+
+def _make_thumbnail(stored_image_id: int):
+    close_old_connections()
+    try:
+        stored = StoredImage.objects.get(pk=stored_image_id)
+        with default_storage.open(stored.path, 'rb') as f:
+            img = Image.open(f).convert('RGB')
+            encoded = _encode(img, settings.IMAGE_THUMBNAIL_SIZE)
+        path = image_path(stored.sha256, prefix='thumbs')
+        if not default_storage.exists(path):
+            default_storage.save(path, ContentFile(encoded))
+        StoredImage.objects.filter(pk=stored_image_id).update(thumbnail_path=path)
+    except StoredImage.DoesNotExist:
+        pass
+    except Exception:
+        logger.exception("Thumbnail generation failed for stored image %s", stored_image_id)
+    finally:
+        close_old_connections()
+
+
+@receiver(post_delete, sender=Prediction)
+def _release_prediction_image(sender, instance, **kwargs):
+    if instance.stored_image_id is not None:
+        release(instance.stored_image_id)
+
+
+_thumbnail_pool = None
+_thumbnail_pool_lock = threading.Lock()
+
+
+def thumbnail_pool() -> ThreadPoolExecutor:
+    """Background threads generating thumbnails (IMAGE_THUMBNAIL_THREADS)"""
+    global _thumbnail_pool
+    if _thumbnail_pool is None:
+        with _thumbnail_pool_lock:
+            if _thumbnail_pool is None:
+                _thumbnail_pool = ThreadPoolExecutor(
+                    max(1, settings.IMAGE_THUMBNAIL_THREADS), thread_name_prefix='thumbnails'
+                )
+    return _thumbnail_pool
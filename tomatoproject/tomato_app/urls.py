@@ -1,6 +1,6 @@
 from django.urls import path
 from . import views
-from .debug_views import debug_upload, simple_upload, client_side_upload
+from .debug_views import debug_upload, simple_upload, client_side_upload, debug_memory, profile_file, profile_list
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -10,12 +10,28 @@ urlpatterns = [
     path('model-performance/', views.model_performance, name='model_performance'),
     path('about/', views.about, name='about'),
 
+    # Health checks (no trailing slash so probes are never redirected)
+    path('healthz', views.healthz, name='healthz'),
+    path('readyz', views.readyz, name='readyz'),
+    path('metrics', views.metrics_view, name='metrics'),
+
     # API endpoints
     path('api/predict/', views.api_predict, name='api_predict'),
+    path('api/predict/async/', views.api_predict_async, name='api_predict_async'),
+    path('api/predict/stream/', views.api_predict_stream, name='api_predict_stream'),
+    path('api/cache-stats/', views.api_cache_stats, name='api_cache_stats'),
+    path('api/jobs/', views.api_job_submit, name='api_job_submit'),
+    path('api/jobs/<uuid:job_id>/', views.api_job_status, name='api_job_status'),
+    path('api/jobs/<uuid:job_id>/cancel/', views.api_job_cancel, name='api_job_cancel'),
     
     # Upload endpoints - Simple upload is now the primary interface
     path('upload/', simple_upload, name='upload_image'),  # Redirect to simple upload
     path('simple-upload/', simple_upload, name='simple_upload'),
     path('debug-upload/', debug_upload, name='debug_upload'),
     path('client-side-upload/', client_side_upload, name='client_side_upload'),
+
+    # Profiling and memory (staff only)
+    path('debug/memory/', debug_memory, name='debug_memory'),
+    path('debug/profiles/', profile_list, name='profile_list'),
+    path('debug/profiles/<str:profile_id>/<str:name>', profile_file, name='profile_file'),
 ]
@@ -1,63 +1,79 @@
-from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.shortcuts import get_object_or_404, render, redirect
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.views.decorators.http import require_http_methods
 from django.conf import settings
-from datetime import datetime
+from django.urls import reverse
+from datetime import date, datetime
+import csv
 import os
 from PIL import Image
 import json
+from . import analytics, counters, metrics
+from .concurrency import ExecutorSaturated, inference_executor
+from .decorators import model_ready_required
 from .forms import ImageUploadForm, MultiImageUploadForm
 from .ml_model import predictor
-from .models import Prediction
+from .jobs import cancel_job, create_job
+from .models import BatchJob, BatchJobImage, DailyPredictionRollup, Prediction
+from .persistence import save_predictions
 from .disease_info import disease_info
+from .evaluation import latest_evaluation
 
 
 def index(request):
     """Home/landing page with introduction"""
     return render(request, 'tomato_app/index.html', {
         'page_title': 'SmartCrop AI - Tomato Disease Detection',
-        'total_predictions': Prediction.objects.count(),
+        'total_predictions': counters.prediction_count(),
     })
 
 
 
 
 
+@model_ready_required
 def batch_predict(request):
     """Batch prediction for multiple images"""
     if request.method == 'POST':
-        form = MultiImageUploadForm(request.POST, request.FILES)
+        with metrics.stage('parse'):
+            form = MultiImageUploadForm(request.POST, request.FILES)
         if form.is_valid():
             try:
                 uploaded_files = request.FILES.getlist('images')
                 results = []
 
-                for uploaded_file in uploaded_files:
-                    try:
-                        img = Image.open(uploaded_file).convert('RGB')
-                        result = predictor.predict(img)
-
-                        # Save prediction with image
-                        prediction = Prediction.objects.create(
-                            image=uploaded_file,
-                            image_name=uploaded_file.name,
-                            prediction=result['predicted_class'],
-                            confidence=result['confidence']
-                        )
+                # Cached files skip inference; the rest share batched forward passes
+                batch_results = predictor.predict_uploads(uploaded_files)
 
+                to_save = []
+                for uploaded_file, result in zip(uploaded_files, batch_results):
+                    metrics.record_result('batch_predict', result)
+                    if not result.get('success'):
                         results.append({
                             'image_name': uploaded_file.name,
-                            'result': result,
-                            'disease_info': disease_info.get(result['predicted_class'], {}),
-                            'prediction': prediction
+                            'error': str(result.get('error', 'Prediction failed'))
                         })
+                        continue
+
+                    prediction = Prediction(
+                        image_name=uploaded_file.name,
+                        prediction=result['predicted_class'],
+                        confidence=result['confidence']
+                    )
+                    to_save.append((prediction, uploaded_file))
+                    results.append({
+                        'image_name': uploaded_file.name,
+                        'result': result,
+                        'disease_info': disease_info.get(result['predicted_class'], {}),
+                        'prediction': prediction
+                    })
 
-                    except Exception as e:
-                        results.append({
-                            'image_name': uploaded_file.name,
-                            'error': str(e)
-                        })
+                # Images are stored in parallel before rendering; the rows are written in the background
+                with metrics.stage('db'):
+                    save_predictions(to_save)
 
                 context = {
                     'results': results,
@@ -65,7 +81,8 @@ def batch_predict(request):
                     'successful': len([r for r in results if 'error' not in r]),
                 }
 
-                return render(request, 'tomato_app/batch_results.html', context)
+                with metrics.stage('render'):
+                    return render(request, 'tomato_app/batch_results.html', context)
 
             except Exception as e:
                 messages.error(request, f"Batch processing failed: {str(e)}")
@@ -91,91 +108,63 @@ def disease_info_view(request):
     return render(request, 'tomato_app/disease_info.html', context)
 
 
+def _report_date(value, default):
+    try:
+        return date.fromisoformat(value) if value else default
+    except ValueError:
+        return default
+
+
 def crop_report(request):
-    """View prediction analytics and reports - NO DATABASE STORAGE"""
-    # Since we're not storing predictions in database, we'll show model performance metrics
-    # and create a mock report based on the model's test results
-    
-    # Model performance data based on our actual test results
-    total_test_images = 2189
-    model_accuracy = 0.95
-    
-    # Mock prediction data based on test results
-    mock_predictions = [
-        {'prediction': 'Healthy Plant', 'confidence': 0.95, 'image_name': 'test_001.jpg'},
-        {'prediction': 'Late Blight', 'confidence': 0.87, 'image_name': 'test_002.jpg'},
-        {'prediction': 'Bacterial Spot', 'confidence': 0.92, 'image_name': 'test_003.jpg'},
-        {'prediction': 'Healthy Plant', 'confidence': 0.88, 'image_name': 'test_004.jpg'},
-        {'prediction': 'Early Blight', 'confidence': 0.91, 'image_name': 'test_005.jpg'},
-        {'prediction': 'Healthy Plant', 'confidence': 0.93, 'image_name': 'test_006.jpg'},
-        {'prediction': 'Target Spot', 'confidence': 0.89, 'image_name': 'test_007.jpg'},
-        {'prediction': 'Healthy Plant', 'confidence': 0.96, 'image_name': 'test_008.jpg'},
-        {'prediction': 'Septoria Leaf Spot', 'confidence': 0.85, 'image_name': 'test_009.jpg'},
-        {'prediction': 'Healthy Plant', 'confidence': 0.94, 'image_name': 'test_010.jpg'},
-    ]
-    
-    # Calculate statistics from test data
-    total_predictions = len(mock_predictions)
-    healthy_count = len([p for p in mock_predictions if p['prediction'] == 'Healthy Plant'])
-    diseased_count = total_predictions - healthy_count
-    
-    # Calculate health percentage
-    health_percentage = (healthy_count / total_predictions * 100) if total_predictions > 0 else 0
-    
-    # Disease distribution from test data with percentages
-    disease_distribution = [
-        {'prediction': 'Healthy Plant', 'count': healthy_count, 'percentage': (healthy_count / total_predictions * 100) if total_predictions > 0 else 0},
-        {'prediction': 'Late Blight', 'count': 2, 'percentage': (2 / total_predictions * 100) if total_predictions > 0 else 0},
-        {'prediction': 'Bacterial Spot', 'count': 1, 'percentage': (1 / total_predictions * 100) if total_predictions > 0 else 0},
-        {'prediction': 'Early Blight', 'count': 1, 'percentage': (1 / total_predictions * 100) if total_predictions > 0 else 0},
-        {'prediction': 'Target Spot', 'count': 1, 'percentage': (1 / total_predictions * 100) if total_predictions > 0 else 0},
-        {'prediction': 'Septoria Leaf Spot', 'count': 1, 'percentage': (1 / total_predictions * 100) if total_predictions > 0 else 0},
-    ]
-    
-    stats = {
-        'total': total_predictions,
-        'healthy': healthy_count,
-        'diseased': diseased_count,
-        'disease_distribution': disease_distribution,
-    }
-    
+    """Prediction analytics for a date range, read from the daily rollups"""
+    default_start, default_end = analytics.default_range(settings.CROP_REPORT_DEFAULT_DAYS)
+    start = _report_date(request.GET.get('start'), default_start)
+    end = _report_date(request.GET.get('end'), default_end)
+    if start > end:
+        start, end = end, start
+
+    stats = analytics.report(start, end)
+
+    if request.GET.get('download') == 'csv':
+        response = HttpResponse(content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="crop-report-{start}-{end}.csv"'
+        writer = csv.writer(response)
+        writer.writerow(['day', 'prediction', 'count', 'avg_confidence'])
+        rollups = DailyPredictionRollup.objects.filter(day__range=(start, end), count__gt=0).order_by('day', 'prediction')
+        for rollup in rollups:
+            writer.writerow([rollup.day, rollup.prediction, rollup.count, f'{rollup.avg_confidence:.4f}'])
+        return response
+
+    # Served by the timestamp index
+    recent = Prediction.objects.filter(
+        **analytics.timestamp_filter(start, end)
+    ).only('timestamp', 'image_name', 'prediction', 'confidence')[:20]
+
     context = {
-        'predictions': mock_predictions,  # Mock predictions for display
+        'predictions': recent,
         'stats': stats,
-        'health_percentage': health_percentage,
-        'total_test_images': total_test_images,
-        'model_accuracy': model_accuracy,
+        'health_percentage': stats['health_percentage'],
+        'start': start,
+        'end': end,
     }
 
     return render(request, 'tomato_app/crop_report.html', context)
 
 
 def model_performance(request):
-    """Display model performance metrics"""
-    metrics = {
-        'accuracy': 0.95,
-        'precision': 0.93,
-        'recall': 0.93,
-        'f1_score': 0.93,
-        'test_images': 2189,
-    }
-
-    per_class_metrics = [
-        {'disease': 'Bacterial Spot', 'precision': 0.95, 'recall': 0.96, 'f1_score': 0.96},
-        {'disease': 'Early Blight', 'precision': 0.90, 'recall': 0.78, 'f1_score': 0.84},
-        {'disease': 'Late Blight', 'precision': 0.96, 'recall': 0.97, 'f1_score': 0.96},
-        {'disease': 'Leaf Mold', 'precision': 0.92, 'recall': 0.94, 'f1_score': 0.93},
-        {'disease': 'Septoria Leaf Spot', 'precision': 0.92, 'recall': 0.94, 'f1_score': 0.93},
-        {'disease': 'Target Spot', 'precision': 0.88, 'recall': 0.87, 'f1_score': 0.88},
-        {'disease': 'Yellow Leaf Curl Virus', 'precision': 1.00, 'recall': 0.99, 'f1_score': 0.99},
-        {'disease': 'Mosaic Virus', 'precision': 0.93, 'recall': 0.91, 'f1_score': 0.92},
-        {'disease': 'Two-Spotted Spider Mite', 'precision': 0.93, 'recall': 0.92, 'f1_score': 0.93},
-        {'disease': 'Healthy Leaves', 'precision': 0.94, 'recall': 0.98, 'f1_score': 0.96},
-    ]
-
+    """Display model performance metrics measured by ``manage.py evaluate_model``"""
+    # Never loads the model; before it is loaded the latest evaluation is shown
+    evaluation = latest_evaluation(predictor.model_version)
     context = {
-        'metrics': metrics,
-        'per_class_metrics': per_class_metrics,
+        'evaluation': evaluation,
+        'metrics': evaluation and {
+            'accuracy': evaluation.accuracy,
+            'precision': evaluation.precision,
+            'recall': evaluation.recall,
+            'f1_score': evaluation.f1_score,
+            'test_images': evaluation.images,
+        },
+        'per_class_metrics': evaluation.per_class if evaluation else [],
     }
 
     return render(request, 'tomato_app/model_performance.html', context)
@@ -187,58 +176,278 @@ def about(request):
 
 
 @require_http_methods(["POST"])
+@model_ready_required
 def api_predict(request):
     """API endpoint for predictions - NO DATABASE STORAGE"""
     """
     API endpoint for prediction (for mobile/JS clients)
     Expects multipart/form-data with 'image' field
     """
-    if 'image' not in request.FILES:
+    with metrics.stage('parse'):
+        files = request.FILES
+    if 'image' not in files:
         return JsonResponse({'error': 'No image provided'}, status=400)
 
     try:
-        uploaded_file = request.FILES['image']
-        img = Image.open(uploaded_file).convert('RGB')
-        result = predictor.predict(img)
-
-        if result.get('success'):
-            # Ensure all values are JSON serializable
-            # Get disease info and ensure it's JSON serializable
-            raw_disease_info = disease_info.get(str(result['predicted_class']), {})
-            safe_disease_info = {}
-            for key, value in raw_disease_info.items():
-                if isinstance(value, str):
-                    safe_disease_info[str(key)] = str(value)
-                elif isinstance(value, (int, float)):
-                    safe_disease_info[str(key)] = float(value)
-                elif isinstance(value, bool):
-                    safe_disease_info[str(key)] = bool(value)
-                else:
-                    safe_disease_info[str(key)] = str(value)
-            
-            prediction_data = {
-                'class': str(result['predicted_class']),
-                'confidence': float(result['confidence']),
-                'disease_info': safe_disease_info
-            }
-            
-            # Ensure all_predictions is JSON serializable
-            all_predictions = []
-            if 'all_predictions' in result:
-                for pred in result['all_predictions']:
-                    all_predictions.append({
-                        'disease': str(pred.get('disease', '')),
-                        'confidence': float(pred.get('confidence', 0)),
-                        'is_predicted': bool(pred.get('is_predicted', False))
-                    })
-            
-            return JsonResponse({
-                'success': True,
-                'prediction': prediction_data,
-                'all_predictions': all_predictions
-            })
-        else:
-            return JsonResponse({'error': str(result.get('error', 'Unknown error'))}, status=500)
+        result = predictor.predict_upload(files['image'])
+        metrics.record_result('api_predict', result)
+        return _api_prediction_response(result)
 
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+
+@model_ready_required
+async def api_predict_async(request):
+    """
+    Async version of api_predict for ASGI servers
+
+    Upload parsing, decoding and inference run on a bounded thread pool, so
+    the event loop keeps serving other requests meanwhile. When every
+    in-flight slot is taken the request gets 429 + Retry-After at once.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    executor = inference_executor()
+    try:
+        executor.acquire()
+    except ExecutorSaturated as e:
+        response = JsonResponse({'error': f'Server busy: {e}'}, status=429)
+        response['Retry-After'] = str(settings.ASYNC_RETRY_AFTER)
+        return response
+
+    try:
+        # Reading request.FILES parses the multipart body
+        files = await executor.run(_parse_files, request)
+        if 'image' not in files:
+            return JsonResponse({'error': 'No image provided'}, status=400)
+
+        result = await executor.run(predictor.predict_upload, files['image'])
+        metrics.record_result('api_predict_async', result)
+        return _api_prediction_response(result)
+
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+    finally:
+        executor.release()
+
+
+def _parse_files(request):
+    with metrics.stage('parse'):
+        return request.FILES
+
+
+def _api_prediction_response(result):
+    """JSON response for a predict_upload result"""
+    payload = _api_prediction_payload(result)
+    if not payload['success']:
+        if result.get('retry_after'):
+            response = JsonResponse({'error': payload['error']}, status=503)
+            response['Retry-After'] = str(result['retry_after'])
+            return response
+        return JsonResponse({'error': payload['error']}, status=500)
+    return JsonResponse(payload)
+
+
+def _api_prediction_payload(result):
+    """JSON-serializable API representation of one prediction result"""
+    if result.get('success'):
+        # Ensure all values are JSON serializable
+        # Get disease info and ensure it's JSON serializable
+        raw_disease_info = disease_info.get(str(result['predicted_class']), {})
+        safe_disease_info = {}
+        for key, value in raw_disease_info.items():
+            if isinstance(value, str):
+                safe_disease_info[str(key)] = str(value)
+            elif isinstance(value, (int, float)):
+                safe_disease_info[str(key)] = float(value)
+            elif isinstance(value, bool):
+                safe_disease_info[str(key)] = bool(value)
+            else:
+                safe_disease_info[str(key)] = str(value)
+
+        prediction_data = {
+            'class': str(result['predicted_class']),
+            'confidence': float(result['confidence']),
+            'disease_info': safe_disease_info
+        }
+
+        # Ensure all_predictions is JSON serializable
+        all_predictions = []
+        if 'all_predictions' in result:
+            for pred in result['all_predictions']:
+                all_predictions.append({
+                    'disease': str(pred.get('disease', '')),
+                    'confidence': float(pred.get('confidence', 0)),
+                    'is_predicted': bool(pred.get('is_predicted', False))
+                })
+
+        return {
+            'success': True,
+            'prediction': prediction_data,
+            'all_predictions': all_predictions
+        }
+    else:
+        return {'success': False, 'error': str(result.get('error', 'Unknown error'))}
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@model_ready_required
+def api_predict_stream(request):
+    """
+    Stream predictions for many images as newline-delimited JSON
+
+    Expects multipart/form-data with one or more 'images' fields. Each line
+    is one image's result, written as soon as its batch finishes (cache hits
+    first, so lines are not in upload order - use 'index'); the final line
+    is a summary with "done": true. Uploads are spooled to temporary files,
+    so memory does not grow with the number of images.
+    """
+    # Must be set before anything reads the body, which is why CSRF is
+    # checked by _predict_stream rather than the middleware
+    request.upload_handlers = [TemporaryFileUploadHandler(request)]
+    return _predict_stream(request)
+
+
+@csrf_protect
+def _predict_stream(request):
+    with metrics.stage('parse'):
+        uploaded_files = request.FILES.getlist('images')
+    if not uploaded_files:
+        return JsonResponse({'error': 'No images provided'}, status=400)
+
+    def lines():
+        succeeded = 0
+        try:
+            for i, result in predictor.iter_predict_uploads(uploaded_files):
+                metrics.record_result('api_predict_stream', result)
+                payload = _api_prediction_payload(result)
+                succeeded += payload['success']
+                yield json.dumps({'index': i, 'filename': uploaded_files[i].name, **payload}) + '\n'
+        except Exception as e:
+            yield json.dumps({'done': True, 'error': str(e)}) + '\n'
+            return
+        yield json.dumps({'done': True, 'total': len(uploaded_files), 'succeeded': succeeded}) + '\n'
+
+    response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    # Ask nginx not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_http_methods(["POST"])
+def api_job_submit(request):
+    """
+    Queue a background batch job for many images
+
+    Expects multipart/form-data with one or more 'images' fields; the
+    images are predicted by ``manage.py run_batch_worker``. Poll the
+    returned status_url for progress and results.
+    """
+    uploaded_files = request.FILES.getlist('images')
+    if not uploaded_files:
+        return JsonResponse({'error': 'No images provided'}, status=400)
+    if len(uploaded_files) > settings.BATCH_JOB_MAX_IMAGES:
+        return JsonResponse(
+            {'error': f'Too many images ({len(uploaded_files)}); the limit is {settings.BATCH_JOB_MAX_IMAGES}'},
+            status=400,
+        )
+
+    job = create_job(uploaded_files)
+    response = JsonResponse(_job_payload(job, request), status=202)
+    response['Location'] = request.build_absolute_uri(reverse('api_job_status', args=[job.pk]))
+    return response
+
+
+@require_http_methods(["GET"])
+def api_job_status(request, job_id):
+    """
+    Progress and results of a batch job
+
+    Results are paged by image position: pass ?after=<next_after> from the
+    previous response to fetch the next page.
+    """
+    job = get_object_or_404(BatchJob, pk=job_id)
+    try:
+        after = int(request.GET.get('after', -1))
+    except ValueError:
+        return JsonResponse({'error': "'after' must be an integer"}, status=400)
+
+    images = list(
+        job.images.exclude(status=BatchJobImage.STATUS_PENDING).filter(position__gt=after)
+        .order_by('position')[:settings.BATCH_JOB_RESULTS_PAGE_SIZE]
+    )
+    payload = _job_payload(job, request)
+    payload['results'] = [
+        {
+            'index': image.position,
+            'filename': image.image_name,
+            **_api_prediction_payload(image.result or {'error': image.error}),
+        }
+        for image in images
+    ]
+    payload['next_after'] = images[-1].position if images else after
+    return JsonResponse(payload)
+
+
+@require_http_methods(["POST"])
+def api_job_cancel(request, job_id):
+    """Cancel a batch job - queued jobs stop at once, running ones after their current batch"""
+    job = get_object_or_404(BatchJob, pk=job_id)
+    if job.is_finished and not job.cancel_requested:
+        return JsonResponse({'error': f'Job already {job.status}', **_job_payload(job, request)}, status=409)
+    return JsonResponse(_job_payload(cancel_job(job), request))
+
+
+def _job_payload(job, request):
+    """Status fields shared by the batch job endpoints"""
+    return {
+        'job_id': str(job.pk),
+        'status': job.status,
+        'cancel_requested': job.cancel_requested,
+        'total_images': job.total_images,
+        'processed_images': job.processed_images,
+        'failed_images': job.failed_images,
+        'progress': round(job.progress, 4),
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'status_url': request.build_absolute_uri(reverse('api_job_status', args=[job.pk])),
+    }
+
+
+def healthz(request):
+    """Liveness probe - the process is up and serving requests"""
+    return JsonResponse({'status': 'ok'})
+
+
+def readyz(request):
+    """Readiness probe - 200 once the model is loaded and warmed up, 503 before"""
+    if predictor.is_ready:
+        return JsonResponse({'status': 'ready', 'model': predictor.describe()})
+
+    # In lazy mode the first readiness check starts the load
+    predictor.start_background_load()
+    response = JsonResponse({'status': predictor.load_state, 'model': predictor.describe()}, status=503)
+    response['Retry-After'] = str(settings.MODEL_LOADING_RETRY_AFTER)
+    return response
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint - every gunicorn worker's metrics, merged"""
+    if not settings.METRICS_ENABLED:
+        return JsonResponse({'error': 'Metrics are disabled'}, status=404)
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {settings.METRICS_TOKEN}':
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def api_cache_stats(request):
+    """Prediction cache hit/miss counters for this worker process"""
+    if predictor.cache is None:
+        return JsonResponse({'enabled': False})
+    return JsonResponse(dict(predictor.cache.stats(), enabled=True, model_version=predictor.model_version))
@@ -14,3 +14,12 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tomato_disease.settings')
 
 application = get_asgi_application()
+
+# Start loading the model while the worker begins accepting requests;
+# prediction views answer 503 until it is ready
+from django.conf import settings  # noqa: E402
+
+if settings.MODEL_LOAD_ON_STARTUP:
+    from tomato_app.ml_model import predictor  # noqa: E402
+
+    predictor.start_background_load()
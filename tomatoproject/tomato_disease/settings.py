@@ -2,6 +2,7 @@
 Django settings for tomato_disease project.
 """
 import os
+import tempfile
 from pathlib import Path
 from decouple import config
 
@@ -28,6 +29,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tomato_app.middleware.MetricsMiddleware',  # First, so its timing covers the rest
+    'tomato_app.middleware.MemoryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # For serving static files in production
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -35,6 +38,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'tomato_app.middleware.ProfilingMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -117,6 +121,80 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # Model file path
 MODEL_PATH = config('MODEL_PATH', default=str(BASE_DIR.parent.parent / 'models' / 'best_mobilenet_finetuned.keras'))
 
+# Model loading - the model is loaded in a background thread when a WSGI/ASGI
+# worker boots (or lazily on first use when disabled); management commands
+# that don't need it never import TensorFlow
+MODEL_LOAD_ON_STARTUP = config('MODEL_LOAD_ON_STARTUP', default=True, cast=bool)
+MODEL_LOADING_RETRY_AFTER = config('MODEL_LOADING_RETRY_AFTER', default=5, cast=int)  # seconds
+
+# Inference backend: 'keras' (float32 MODEL_PATH), 'tflite_int8' (written by
+# `python manage.py quantize_model`), 'onnx' (written by `python manage.py export_onnx`)
+# or 'remote' (a `python manage.py run_inference_server` daemon)
+INFERENCE_BACKEND = config('INFERENCE_BACKEND', default='keras')
+TFLITE_MODEL_PATH = config('TFLITE_MODEL_PATH', default=str(Path(MODEL_PATH).with_name('best_mobilenet_int8.tflite')))
+TFLITE_NUM_THREADS = config('TFLITE_NUM_THREADS', default=0, cast=int)  # 0 lets TFLite decide
+ONNX_MODEL_PATH = config('ONNX_MODEL_PATH', default=str(Path(MODEL_PATH).with_name('best_mobilenet_finetuned.onnx')))
+ONNX_INTRA_OP_THREADS = config('ONNX_INTRA_OP_THREADS', default=0, cast=int)  # 0 lets ONNX Runtime decide
+ONNX_INTER_OP_THREADS = config('ONNX_INTER_OP_THREADS', default=0, cast=int)
+ONNX_GRAPH_OPTIMIZATION_LEVEL = config('ONNX_GRAPH_OPTIMIZATION_LEVEL', default='all')  # disable/basic/extended/all
+
+# Out-of-process inference (manage.py run_inference_server). With
+# INFERENCE_BACKEND=remote, web workers send preprocessed images to the
+# server over INFERENCE_SERVER_SOCKET; the server runs INFERENCE_SERVER_BACKEND.
+INFERENCE_SERVER_SOCKET = config('INFERENCE_SERVER_SOCKET', default='/tmp/tomato-inference.sock')
+INFERENCE_SERVER_BACKEND = config('INFERENCE_SERVER_BACKEND', default='keras')
+INFERENCE_SERVER_TIMEOUT = config('INFERENCE_SERVER_TIMEOUT', default=30.0, cast=float)
+INFERENCE_SERVER_POOL_SIZE = config('INFERENCE_SERVER_POOL_SIZE', default=4, cast=int)
+# Load the model in the web worker when the server cannot be reached; requests
+# get 503 + Retry-After while that load runs
+INFERENCE_SERVER_FALLBACK = config('INFERENCE_SERVER_FALLBACK', default=True, cast=bool)
+
+# TensorFlow thread pools per process (0 = TF default). With several gunicorn
+# workers per node, roughly cores / workers avoids oversubscription.
+TF_INTRA_OP_THREADS = config('TF_INTRA_OP_THREADS', default=0, cast=int)
+TF_INTER_OP_THREADS = config('TF_INTER_OP_THREADS', default=0, cast=int)
+
+# Compiled serving function - traced tf.function used instead of model.predict
+INFERENCE_SERVING_FUNCTION = config('INFERENCE_SERVING_FUNCTION', default=True, cast=bool)
+INFERENCE_XLA_JIT = config('INFERENCE_XLA_JIT', default=False, cast=bool)
+# Hand raw uint8 pixels to the Keras serving function, which resizes and rescales in-graph
+INFERENCE_GRAPH_PREPROCESSING = config('INFERENCE_GRAPH_PREPROCESSING', default=False, cast=bool)
+INFERENCE_WARMUP_IMAGES_DIR = config('INFERENCE_WARMUP_IMAGES_DIR', default=str(BASE_DIR / 'tomato_app' / 'warmup_images'))
+
+# Labelled train/val/test images used by evaluation and benchmark commands
+DATA_SPLIT_DIR = config('DATA_SPLIT_DIR', default=str(BASE_DIR.parent / 'notebooks' / 'data_split'))
+
+# Image preprocessing - JPEG draft mode decodes phone photos close to 224x224
+IMAGE_JPEG_DRAFT = config('IMAGE_JPEG_DRAFT', default=True, cast=bool)
+IMAGE_RESAMPLE_FILTER = config('IMAGE_RESAMPLE_FILTER', default='bicubic')  # nearest/box/bilinear/hamming/bicubic/lanczos
+IMAGE_REDUCING_GAP = config('IMAGE_REDUCING_GAP', default=0.0, cast=float)  # 0 disables Pillow's reducing_gap
+
+# Inference micro-batching - concurrent predictions are grouped into one forward pass
+INFERENCE_BATCHING = config('INFERENCE_BATCHING', default=True, cast=bool)
+INFERENCE_MAX_BATCH_SIZE = config('INFERENCE_MAX_BATCH_SIZE', default=16, cast=int)
+INFERENCE_MAX_QUEUE_DELAY_MS = config('INFERENCE_MAX_QUEUE_DELAY_MS', default=10.0, cast=float)
+INFERENCE_MAX_QUEUE_DEPTH = config('INFERENCE_MAX_QUEUE_DEPTH', default=256, cast=int)
+INFERENCE_REQUEST_TIMEOUT = config('INFERENCE_REQUEST_TIMEOUT', default=30.0, cast=float)  # seconds
+
+# Chunk size for multi-image uploads handled by predict_batch
+INFERENCE_BATCH_CHUNK_SIZE = config('INFERENCE_BATCH_CHUNK_SIZE', default=32, cast=int)
+
+# Async prediction API (api/predict/async/). Decode and inference run on a
+# pool of ASYNC_INFERENCE_WORKERS threads (0 = one per CPU); beyond
+# ASYNC_MAX_IN_FLIGHT concurrent requests (0 = 4x the workers) new ones get
+# 429 with Retry-After instead of queueing.
+ASYNC_INFERENCE_WORKERS = config('ASYNC_INFERENCE_WORKERS', default=0, cast=int)
+ASYNC_MAX_IN_FLIGHT = config('ASYNC_MAX_IN_FLIGHT', default=0, cast=int)
+ASYNC_RETRY_AFTER = config('ASYNC_RETRY_AFTER', default=1, cast=int)  # seconds
+
+# Prediction result cache keyed by upload content hash + model version.
+# Set PREDICTION_CACHE_DIR to share a disk tier between gunicorn workers.
+PREDICTION_CACHE_ENABLED = config('PREDICTION_CACHE_ENABLED', default=True, cast=bool)
+PREDICTION_CACHE_MAX_ENTRIES = config('PREDICTION_CACHE_MAX_ENTRIES', default=1024, cast=int)
+PREDICTION_CACHE_TTL = config('PREDICTION_CACHE_TTL', default=24 * 3600, cast=int)  # seconds, 0 = never expire
+PREDICTION_CACHE_DIR = config('PREDICTION_CACHE_DIR', default='')
+PREDICTION_CACHE_DISK_MAX_ENTRIES = config('PREDICTION_CACHE_DISK_MAX_ENTRIES', default=10000, cast=int)
+
 # Security settings for production
 if not DEBUG:
     SECURE_SSL_REDIRECT = config('SECURE_SSL_REDIRECT', default=True, cast=bool)
@@ -136,6 +214,84 @@ else:
 FILE_UPLOAD_MAX_MEMORY_SIZE = config('FILE_UPLOAD_MAX_MEMORY_SIZE', default=10 * 1024 * 1024, cast=int)  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = config('DATA_UPLOAD_MAX_MEMORY_SIZE', default=10 * 1024 * 1024, cast=int)  # 10MB
 DATA_UPLOAD_MAX_NUMBER_FIELDS = config('DATA_UPLOAD_MAX_NUMBER_FIELDS', default=10000, cast=int)
+DATA_UPLOAD_MAX_NUMBER_FILES = config('DATA_UPLOAD_MAX_NUMBER_FILES', default=1000, cast=int)
+
+# Write-behind persistence for Prediction rows: a request's image files are
+# written in parallel by PREDICTION_IMAGE_IO_THREADS threads and rows are inserted
+# with one bulk_create every PREDICTION_FLUSH_ROWS rows or PREDICTION_FLUSH_INTERVAL_MS.
+# Set PREDICTION_WRITE_BEHIND=False to write synchronously in the request.
+PREDICTION_WRITE_BEHIND = config('PREDICTION_WRITE_BEHIND', default=True, cast=bool)
+PREDICTION_FLUSH_ROWS = config('PREDICTION_FLUSH_ROWS', default=100, cast=int)
+PREDICTION_FLUSH_INTERVAL_MS = config('PREDICTION_FLUSH_INTERVAL_MS', default=200.0, cast=float)
+PREDICTION_IMAGE_IO_THREADS = config('PREDICTION_IMAGE_IO_THREADS', default=2, cast=int)
+
+# Content-addressed storage for prediction images: each distinct upload is
+# stored once, transcoded to IMAGE_STORAGE_FORMAT ('webp' or 'jpeg') with its
+# longest side capped at IMAGE_STORAGE_MAX_SIDE pixels
+IMAGE_STORAGE_FORMAT = config('IMAGE_STORAGE_FORMAT', default='webp')
+IMAGE_STORAGE_MAX_SIDE = config('IMAGE_STORAGE_MAX_SIDE', default=1024, cast=int)
+IMAGE_STORAGE_QUALITY = config('IMAGE_STORAGE_QUALITY', default=80, cast=int)
+IMAGE_THUMBNAIL_SIZE = config('IMAGE_THUMBNAIL_SIZE', default=256, cast=int)
+IMAGE_THUMBNAIL_THREADS = config('IMAGE_THUMBNAIL_THREADS', default=1, cast=int)
+
+# Maintained counters (landing page prediction total): cached for
+# COUNTER_CACHE_SECONDS, recounted for real every COUNTER_RECONCILE_SECONDS
+COUNTER_CACHE_SECONDS = config('COUNTER_CACHE_SECONDS', default=60, cast=int)
+COUNTER_RECONCILE_SECONDS = config('COUNTER_RECONCILE_SECONDS', default=3600, cast=int)
+
+# Crop report: days shown when no date range is given
+CROP_REPORT_DEFAULT_DAYS = config('CROP_REPORT_DEFAULT_DAYS', default=30, cast=int)
+
+# Metrics: Prometheus text at /metrics and per-stage Server-Timing headers.
+# Set METRICS_TOKEN to require "Authorization: Bearer <token>" on /metrics.
+# METRICS_MULTIPROCESS_DIR lets any gunicorn worker report all of them
+# (gunicorn.conf.py sets one up when it is empty)
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_SERVER_TIMING = config('METRICS_SERVER_TIMING', default=True, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_MULTIPROCESS_DIR = config('METRICS_MULTIPROCESS_DIR', default='')
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=1.0, cast=float)  # seconds
+
+# On-demand request profiling: staff add ?profile=sampling|cprofile, other
+# clients send an X-Profile-Token header (`python manage.py profile_token`).
+# The newest PROFILING_MAX_PROFILES profiles are kept in PROFILING_DIR
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=True, cast=bool)
+PROFILING_VIEWS = config('PROFILING_VIEWS', default='api_predict,simple_upload',
+                         cast=lambda v: [s.strip() for s in v.split(',') if s])
+PROFILING_DIR = config('PROFILING_DIR', default=os.path.join(tempfile.gettempdir(), 'tomato-profiles'))
+PROFILING_MAX_PROFILES = config('PROFILING_MAX_PROFILES', default=50, cast=int)
+PROFILING_SAMPLE_INTERVAL_MS = config('PROFILING_SAMPLE_INTERVAL_MS', default=1.0, cast=float)
+PROFILING_TOKEN_MAX_AGE = config('PROFILING_TOKEN_MAX_AGE', default=3600, cast=int)  # seconds
+PROFILING_TF_TRACE = config('PROFILING_TF_TRACE', default=True, cast=bool)  # keras backend only
+
+# Always-on sampling profiler in every gunicorn worker: all threads sampled
+# every SAMPLING_PROFILER_INTERVAL_MS, a collapsed-stack file written every
+# SAMPLING_PROFILER_ROTATE_SECONDS (merge them with `manage.py merge_profiles`)
+SAMPLING_PROFILER_ENABLED = config('SAMPLING_PROFILER_ENABLED', default=False, cast=bool)
+SAMPLING_PROFILER_INTERVAL_MS = config('SAMPLING_PROFILER_INTERVAL_MS', default=10.0, cast=float)  # 100 Hz
+SAMPLING_PROFILER_ROTATE_SECONDS = config('SAMPLING_PROFILER_ROTATE_SECONDS', default=300, cast=int)
+SAMPLING_PROFILER_MAX_FILES = config('SAMPLING_PROFILER_MAX_FILES', default=500, cast=int)
+SAMPLING_PROFILER_INCLUDE_IDLE = config('SAMPLING_PROFILER_INCLUDE_IDLE', default=False, cast=bool)
+SAMPLING_PROFILER_DIR = config('SAMPLING_PROFILER_DIR', default=os.path.join(tempfile.gettempdir(), 'tomato-stacks'))
+
+# Worker memory: per-request RSS growth by view, /debug/memory for staff, and
+# recycling a gunicorn worker (after its current request) once its RSS is
+# over MEMORY_MAX_RSS_MB or has grown MEMORY_MAX_RSS_GROWTH_MB since the
+# model was ready (0 disables either). MEMORY_TRACEMALLOC traces Python
+# allocations in every worker from the start (slows requests noticeably)
+MEMORY_TRACKING_ENABLED = config('MEMORY_TRACKING_ENABLED', default=True, cast=bool)
+MEMORY_MAX_RSS_MB = config('MEMORY_MAX_RSS_MB', default=0, cast=int)
+MEMORY_MAX_RSS_GROWTH_MB = config('MEMORY_MAX_RSS_GROWTH_MB', default=0, cast=int)
+MEMORY_REQUEST_WARN_MB = config('MEMORY_REQUEST_WARN_MB', default=50, cast=int)  # log requests growing RSS this much
+MEMORY_TRACEMALLOC = config('MEMORY_TRACEMALLOC', default=False, cast=bool)
+MEMORY_TRACEMALLOC_FRAMES = config('MEMORY_TRACEMALLOC_FRAMES', default=1, cast=int)
+
+# Background batch jobs (api/jobs/, processed by `python manage.py run_batch_worker`)
+BATCH_JOB_MAX_IMAGES = config('BATCH_JOB_MAX_IMAGES', default=1000, cast=int)
+BATCH_JOB_LEASE_SECONDS = config('BATCH_JOB_LEASE_SECONDS', default=300, cast=int)  # reclaimed after a worker dies
+BATCH_JOB_MAX_ATTEMPTS = config('BATCH_JOB_MAX_ATTEMPTS', default=3, cast=int)
+BATCH_JOB_POLL_INTERVAL = config('BATCH_JOB_POLL_INTERVAL', default=2.0, cast=float)  # seconds
+BATCH_JOB_RESULTS_PAGE_SIZE = config('BATCH_JOB_RESULTS_PAGE_SIZE', default=100, cast=int)
 
 # Logging configuration
 LOGGING = {